@@ -34,6 +34,24 @@ from collections import namedtuple
 #To create a regular expression, we require the re module.
 import re
 
+# To store a program in columns of numbers, we require the array module.
+import array
+
+# To keep a program in a balanced tree, we require the random module for the priorities of its nodes, and
+# the collections.abc module to look up its labels like a dictionary.
+import random
+import collections.abc
+
+# To tell a file name apart from an open file or a memory-mapped buffer, we require the os and mmap modules.
+import os
+import mmap
+
+
+# Create a regular expression for use in the instruction creation. We will need to take out some
+# characters from some strings generated through splitting a program line. It is compiled once here
+# rather than for every line.
+strrmv = re.compile(r'[\s,]')
+
 
 # Write an Instruction class to create Instruction objects that can be used to
 # define a Program object.
@@ -64,6 +82,135 @@ class Instruction(namedtuple('Instruction', ['label', 'instruction', 'condition'
     # defined for us already using the name-value pairs in the tuple.
 
 
+# Process a single line of a "blub" program into an Instruction object.
+def parseLine(aLine):
+    """
+    Formats a line of a "blub" program to separate the parts of a single instruction.
+
+    :param aLine: The line to be formatted.
+    :return: The Instruction object for the line, or None if the line is blank.
+    """
+
+    # A line may have a label, an instruction name (may or may not have a condition)
+    # and operands (may be a label, registers or immediate values depending on the
+    # instruction.
+    # Account for extraneous whitespaces, and skip lines that only have whitespace.
+    if not aLine.strip():
+        return None
+
+    # First split the line to get out any existing labels.
+    labelSplit = aLine.split(':')
+
+    # Next split the instruction from its operands.
+    instructSplit = ([x for x in labelSplit[1].split(" ") if x != '']
+                     if len(labelSplit) > 1
+                     else [x for x in labelSplit[0].split(" ") if x != ''])
+
+    # Initialize the instruction for easier use. A line that is missing its instruction or its operands
+    # gets empty strings for them, which the interpreter reports as an improperly formatted instruction.
+    theInstruction = instructSplit[0].strip() if instructSplit else ''
+
+    return Instruction(label=(labelSplit[0].strip() if len(labelSplit) > 1 else '')
+                       , instruction=(theInstruction[0] if theInstruction[:1] == 'b'
+                                      else theInstruction)
+                       , condition=(theInstruction[1:]
+                                    if theInstruction[:1] == 'b' else '')
+                       , op1=(strrmv.sub('', instructSplit[1]) if len(instructSplit) > 1
+                              else '')
+                       , op2=(strrmv.sub('', instructSplit[2]) if len(instructSplit) > 2
+                              else '')
+                       , op3=(strrmv.sub('', instructSplit[3]) if len(instructSplit) > 3
+                              else '')
+                       )
+
+
+# Read the lines of a "blub" program from a file name, an open file or a memory-mapped buffer.
+def readLines(aSource):
+    """
+    Yields the lines of a "blub" program one at a time as strings.
+
+    :param aSource: A file name, a file object opened in text or binary mode, or a buffer with a readline
+                    method such as an mmap object.
+    :return: A generator of the lines of the program.
+    """
+
+    # A file name is opened here, and closed once all of its lines have been read.
+    if isinstance(aSource, (str, bytes, os.PathLike)):
+        with open(aSource) as theFile:
+            yield from theFile
+        return
+
+    # File objects can be iterated over directly. A memory-mapped buffer can only be read a line at a time.
+    lines = iter(aSource.readline, b'') if isinstance(aSource, mmap.mmap) else aSource
+
+    for aLine in lines:
+        yield aLine.decode() if isinstance(aLine, bytes) else aLine
+
+
+# Write an InstructionStream class to process a "blub" program lazily, one line at a time.
+class InstructionStream:
+    """
+    A class that yields the instructions of a "blub" program one at a time, without keeping them.
+    """
+
+    # Class constructor
+    def __init__(self, aSource):
+        """
+        The constructor for the InstructionStream class.
+
+        :param aSource: A file name, a file object or a memory-mapped buffer holding a "blub" program.
+        """
+
+        self.source = aSource
+
+        # As we process each line, we keep the line numbers of the labels declared so far, the first line
+        # that branches to each label, and the number of instructions read.
+        self.labelLocator = {}
+        self.references = {}
+        self.lineCount = 0
+
+
+    # Class methods
+
+    # Yield the instructions of the program
+    def __iter__(self):
+        """
+        Processes the program one line at a time.
+        :return: A generator of the Instruction objects of the program, in order. Blank lines are skipped.
+        """
+
+        lineNum = 0
+
+        for aLine in readLines(self.source):
+            anInstruction = parseLine(aLine)
+            if anInstruction is None:
+                continue
+
+            lineNum += 1
+
+            # Keep track of the labels declared and of the labels branched to, which may be declared later.
+            if anInstruction.label:
+                self.labelLocator[anInstruction.label] = lineNum
+            if anInstruction.instruction == 'b' and not (anInstruction.op1 in self.references):
+                self.references[anInstruction.op1] = lineNum
+
+            yield anInstruction
+
+        self.lineCount = lineNum
+
+
+    # Resolve the labels branched to
+    def resolveLabels(self):
+        """
+        Looks up every label branched to in the label table, once the whole program has been read. This is
+        how forward references are resolved without going over the instructions a second time.
+        :return: A dictionary of every label branched to and its line number, or None if it is never declared.
+        """
+
+        return {aLabel: self.labelLocator.get(aLabel) for aLabel in self.references}
+
+
+
 # Write the Program class to process a .blub file into a Program object.
 class Program:
     """
@@ -76,69 +223,51 @@ class Program:
         The constructor for the Program class.
         It takes a "blub" program as an argument and parses its lines.
 
-        :param aProgramFile: The "blub" program file to be formatted.
+        :param aProgramFile: The "blub" program file to be formatted. An open file object or a memory-mapped
+                             buffer may be given instead of a file name.
         """
 
-        # First open the given file to access its content.
-        theFile = open(aProgramFile)
-
         # As we process each line, we generate a dictionary of instructions to initialize the
-        # Program class instance.
+        # Program class instance. The lines are read and formatted by an InstructionStream.
         self.program = {}
+        theStream = InstructionStream(aProgramFile)
 
         # Initialize a value to generate the keys.
         self.aKey = 1
 
-        # Process each line accordingly.
-        for aLine in theFile:
-            # Format the line accordingly to separate the parts of a single instruction.
-            # A line may have a label, an instruction name (may or may not have a condition)
-            # and operands (may be a label, registers or immediate values depending on the
-            # instruction.
-            # Account for extraneous whitespaces.
-
-            # First split the line to get out any existing labels.
-            labelSplit = aLine.split(':')
-
-            # Next split the instruction from its operands.
-            instructSplit = ([x for x in labelSplit[1].split(" ") if x != '']
-                             if len(labelSplit) > 1
-                             else [x for x in labelSplit[0].split(" ") if x != ''])
-
-            # Every line would at least have an instruction and one operand. We need not worry about
-            # having a line without an instruction or at least one operand. Initialize the
-            # instruction for easier use.
-            theInstruction = instructSplit[0].strip()
-
-            # Create a regular expression for use in the instruction creation. We will need to take out some
-            # characters from some strings generated through splitting a program line.
-            strrmv = re.compile('[\s,]')
-
-            # Create an instruction object and add it to the program list.
-            self.program[self.aKey] = Instruction(label=(labelSplit[0].strip() if len(labelSplit) > 1 else '')
-                                                   , instruction=(theInstruction[0] if theInstruction[0] == 'b'
-                                                                  else theInstruction)
-                                                   , condition=(theInstruction[1:]
-                                                                if theInstruction[0] == 'b' else '')
-                                                   , op1=strrmv.sub('', instructSplit[1])
-                                                   , op2=(strrmv.sub('', instructSplit[2]) if len(instructSplit) > 2
-                                                          else '')
-                                                   , op3=(strrmv.sub('', instructSplit[3]) if len(instructSplit) > 3
-                                                          else '')
-                                                   )
+        # Add each instruction to the program dictionary.
+        for anInstruction in theStream:
+            self.program[self.aKey] = anInstruction
 
             # Increment aKey
             self.aKey += 1
 
         # After the loop is completed, we should have a dictionary of instructions.
 
-        # Generate the dictionary with the labels in the program and their line numbers.
-        self.labelLocator = {y.label: x for (x, y) in self.program.items() if y.label}
+        # Keep the dictionary with the labels in the program and their line numbers.
+        self.labelLocator = theStream.labelLocator
 
 
 
     # Class methods
 
+    # Create a program from a list of instructions rather than a file
+    @classmethod
+    def fromInstructions(cls, instructions):
+        """
+        Creates a Program object holding the given instructions, numbered from one in the order given.
+        :param instructions: An iterable of Instruction objects.
+        :return: The new Program object.
+        """
+
+        aProgram = cls.__new__(cls)
+        aProgram.program = dict(enumerate(instructions, 1))
+        aProgram.aKey = len(aProgram.program) + 1
+        aProgram.labelLocator = {y.label: x for (x, y) in aProgram.program.items() if y.label}
+
+        return aProgram
+
+
     # Print the program as a string
     def __str__(self):
         """
@@ -256,6 +385,595 @@ class Program:
 
 
 
+# Write the ColumnarProgram class to process a .blub file into a compact Program object.
+class ColumnarProgram:
+    """
+    A class that represents a "blub" assembly language program, stored in parallel arrays of integers
+    rather than in a dictionary of Instruction objects. It can be used wherever a Program object is read.
+    """
+
+    # Class variables:
+    # The kinds of operands, as kept in the kinds column. Each instruction keeps the kinds of its three
+    # operands in two bits each.
+    EMPTY, REGISTER, IMMEDIATE, TEXT = range(4)
+
+    # Class constructor
+    def __init__(self, aProgramFile):
+        """
+        The constructor for the ColumnarProgram class.
+        It takes a "blub" program as an argument and parses its lines.
+
+        :param aProgramFile: The "blub" program file to be formatted. An open file object or a memory-mapped
+                             buffer may be given instead of a file name.
+        """
+
+        # Initialize a table of the strings of the program, such as labels and instruction names, and a
+        # dictionary of each string and its index in the table. Each string is only kept once.
+        self.strings = ['']
+        self.stringIds = {'': 0}
+
+        # Initialize a column for each part of an instruction. Labels, instruction names and conditions
+        # are kept as indexes into the string table, and operands as numbers along with their kinds.
+        self.labels = array.array('i')
+        self.names = array.array('i')
+        self.conditions = array.array('i')
+        self.kinds = array.array('B')
+        self.op1 = array.array('i')
+        self.op2 = array.array('i')
+        self.op3 = array.array('i')
+
+        # Initialize the dictionary with the labels in the program and their line numbers.
+        self.labelLocator = {}
+
+        # Add each instruction to the columns.
+        for anInstruction in InstructionStream(aProgramFile):
+            self.append(anInstruction)
+
+
+    # Create a program from its string table and columns rather than a file
+    @classmethod
+    def fromColumns(cls, strings, labels, names, conditions, kinds, op1, op2, op3):
+        """
+        Creates a ColumnarProgram object from the string table and columns of another one, such as ones
+        read back from a file, without parsing any text.
+        :param strings: The list of strings of the program.
+        :param labels: The array of the label of each instruction, as an index into the strings.
+        :param names: The array of the name of each instruction, as an index into the strings.
+        :param conditions: The array of the condition of each instruction, as an index into the strings.
+        :param kinds: The array of the kinds of the operands of each instruction.
+        :param op1: The array of the first operand of each instruction.
+        :param op2: The array of the second operand of each instruction.
+        :param op3: The array of the third operand of each instruction.
+        :return: The new ColumnarProgram object.
+        """
+
+        aProgram = cls.__new__(cls)
+        aProgram.strings = list(strings)
+        aProgram.stringIds = {aString: stringId for (stringId, aString) in enumerate(aProgram.strings)}
+        aProgram.labels, aProgram.names, aProgram.conditions = labels, names, conditions
+        aProgram.kinds, aProgram.op1, aProgram.op2, aProgram.op3 = kinds, op1, op2, op3
+        aProgram.labelLocator = {aProgram.strings[labelId]: lineNum for (lineNum, labelId) in enumerate(labels, 1)
+                                 if labelId}
+
+        return aProgram
+
+
+    # Class methods
+
+    # Get the index of a string in the string table, adding it if it is not there yet.
+    def intern(self, aString):
+        """
+        Get the index of a string in the string table of the program.
+        :param aString: The string to look up.
+        :return: The index of the string in the string table.
+        """
+
+        stringId = self.stringIds.get(aString)
+
+        if stringId is None:
+            stringId = self.stringIds[aString] = len(self.strings)
+            self.strings.append(aString)
+
+        return stringId
+
+
+    # Convert an operand into its kind and its number.
+    def encodeOperand(self, operand):
+        """
+        Converts an operand into a number. Registers and immediate values are kept as their numbers, and
+        anything else (such as a label) as the index of the operand in the string table.
+        :param operand: The operand as a string.
+        :return: A tuple of the kind of the operand and its number.
+        """
+
+        if operand == '':
+            return self.EMPTY, 0
+
+        # Only numbers that are written back exactly the same way (without leading zeros, for instance)
+        # and that fit in a column are kept as numbers.
+        if operand[:1] == 'r' and operand[1:].isdigit() and str(int(operand[1:])) == operand[1:] \
+                and int(operand[1:]) < 2 ** 31:
+            return self.REGISTER, int(operand[1:])
+
+        if operand.isdigit() and str(int(operand)) == operand and int(operand) < 2 ** 31:
+            return self.IMMEDIATE, int(operand)
+
+        return self.TEXT, self.intern(operand)
+
+
+    # Convert the kind and number of an operand back into the operand.
+    def decodeOperand(self, kind, number):
+        """
+        Converts the kind and number of an operand back into the operand as a string.
+        :param kind: The kind of the operand.
+        :param number: The number of the operand.
+        :return: The operand as a string.
+        """
+
+        if kind == self.REGISTER:
+            return 'r' + str(number)
+        if kind == self.IMMEDIATE:
+            return str(number)
+        return self.strings[number]
+
+
+    # Add an instruction to the end of the program
+    def append(self, anInstruction):
+        """
+        Add an instruction after the last instruction of the program.
+        :param anInstruction: The instruction to be added.
+        """
+
+        kind1, number1 = self.encodeOperand(anInstruction.op1)
+        kind2, number2 = self.encodeOperand(anInstruction.op2)
+        kind3, number3 = self.encodeOperand(anInstruction.op3)
+
+        self.labels.append(self.intern(anInstruction.label))
+        self.names.append(self.intern(anInstruction.instruction))
+        self.conditions.append(self.intern(anInstruction.condition))
+        self.kinds.append(kind1 | (kind2 << 2) | (kind3 << 4))
+        self.op1.append(number1)
+        self.op2.append(number2)
+        self.op3.append(number3)
+
+        # Add the line number to labelLocator if the added instruction has a label.
+        if anInstruction.label:
+            self.labelLocator[anInstruction.label] = len(self.names)
+
+
+    # Print the program as a string
+    def __str__(self):
+        """
+        Prints the contents of the program in a better formatted manner.
+        :return: The program as a list of instructions.
+        """
+
+        return "".join(str(aKey) + '    ' + str(self[aKey]) + "\n" for aKey in range(1, len(self) + 1))
+
+
+    # Get an instruction given a line number (line numbers start from one)
+    def __getitem__(self, lineNum):
+        """
+        Get an instruction from the program at the given index.
+        :param lineNum: The index  of the desired instruction.
+        :return: The desired instruction at the given index, rebuilt from the columns.
+        """
+
+        # Line numbers outside the program are missing keys, just like in a Program object.
+        if not (1 <= lineNum <= len(self.names)):
+            raise KeyError(lineNum)
+
+        i = lineNum - 1
+        kinds = self.kinds[i]
+
+        return Instruction(label=self.strings[self.labels[i]],
+                           instruction=self.strings[self.names[i]],
+                           condition=self.strings[self.conditions[i]],
+                           op1=self.decodeOperand(kinds & 3, self.op1[i]),
+                           op2=self.decodeOperand((kinds >> 2) & 3, self.op2[i]),
+                           op3=self.decodeOperand(kinds >> 4, self.op3[i]))
+
+
+    #Get the line number of the first instruction within a given label.
+    def getAddress(self, aLabel):
+        """
+        Get the line number of the first instruction within the given label.
+        :param aLabel: The label of a set of instructions.
+        :return: The line number of the first instruction within the label.
+        """
+
+        return self.labelLocator[aLabel]
+
+
+    # Get the number of instructions in a program
+    def __len__(self):
+        """
+        Get the number of instructions in a program.
+        :return: The number of instructions in a program.
+        """
+
+        return len(self.names)
+
+
+
+# Write a ProgramNode class to hold a single instruction of an EditableProgram object.
+class ProgramNode:
+    """
+    A class that represents a node of the balanced tree an EditableProgram object keeps its instructions in.
+    """
+
+    __slots__ = ('instruction', 'priority', 'size', 'left', 'right', 'parent')  # Keep memory requirements low.
+
+    # Class constructor
+    def __init__(self, anInstruction):
+        """
+        The constructor for the ProgramNode class.
+
+        :param anInstruction: The instruction held by the node.
+        """
+
+        self.instruction = anInstruction
+
+        # The tree is a treap: nodes are ordered by line number, and each node has a random priority that is
+        # higher than the priorities of the nodes below it, which keeps the tree balanced on average.
+        self.priority = random.random()
+
+        # The number of nodes in the subtree starting at this node, and the nodes linked to it.
+        self.size = 1
+        self.left = None
+        self.right = None
+        self.parent = None
+
+
+# Write a LabelLocator class to look up the line numbers of the labels of an EditableProgram object.
+class LabelLocator(collections.abc.Mapping):
+    """
+    A class that maps the labels of an EditableProgram object to their line numbers. The line numbers are
+    worked out from the position of the labelled node when they are looked up, so nothing has to be
+    updated when instructions are inserted or deleted before a label.
+    """
+
+    # Class constructor
+    def __init__(self, aProgram):
+        """
+        The constructor for the LabelLocator class.
+
+        :param aProgram: The EditableProgram object whose labels are looked up.
+        """
+
+        self.program = aProgram
+
+
+    # Class methods
+
+    # Get the line number of a label
+    def __getitem__(self, aLabel):
+        return self.program.lineOf(self.program.labelNodes[aLabel])
+
+    # Go through the labels
+    def __iter__(self):
+        return iter(self.program.labelNodes)
+
+    # Get the number of labels
+    def __len__(self):
+        return len(self.program.labelNodes)
+
+
+# Write the EditableProgram class to process a .blub file into a Program object that is cheap to edit.
+class EditableProgram:
+    """
+    A class that represents a "blub" assembly language program that is meant to be edited. Its instructions
+    are kept in a balanced tree, so inserting or deleting an instruction takes O(log n) time rather than
+    shifting every following instruction, and the labels are kept as references to the nodes they label.
+    """
+
+    # Class constructor
+    def __init__(self, aProgramFile):
+        """
+        The constructor for the EditableProgram class.
+        It takes a "blub" program as an argument and parses its lines.
+
+        :param aProgramFile: The "blub" program file to be formatted. An open file object or a memory-mapped
+                             buffer may be given instead of a file name.
+        """
+
+        # Initialize a dictionary of the labels in the program and the nodes they label, along with the
+        # mapping of the labels to their line numbers that the Program class also has.
+        self.labelNodes = {}
+        self.labelLocator = LabelLocator(self)
+
+        # Build the tree from the instructions of the program.
+        self.root = None
+        self.rebuild([ProgramNode(anInstruction) for anInstruction in InstructionStream(aProgramFile)])
+
+
+    # Class methods
+
+    # Get the number of nodes in a subtree.
+    @staticmethod
+    def sizeOf(node):
+        return node.size if node is not None else 0
+
+
+    # Update the size of a node after the nodes below it changed.
+    @staticmethod
+    def resize(node):
+        node.size = 1 + (node.left.size if node.left is not None else 0) \
+                    + (node.right.size if node.right is not None else 0)
+
+
+    # Split a tree into a tree of its first count nodes and a tree of the rest.
+    def split(self, node, count):
+        """
+        Splits a tree in two.
+        :param node: The root of the tree to split.
+        :param count: The number of nodes to put in the first tree.
+        :return: A tuple of the roots of the two trees.
+        """
+
+        if node is None:
+            return None, None
+
+        node.parent = None
+
+        if count <= self.sizeOf(node.left):
+            first, rest = self.split(node.left, count)
+            node.left = rest
+            if rest is not None:
+                rest.parent = node
+            self.resize(node)
+            return first, node
+
+        first, rest = self.split(node.right, count - self.sizeOf(node.left) - 1)
+        node.right = first
+        if first is not None:
+            first.parent = node
+        self.resize(node)
+        return node, rest
+
+
+    # Join two trees into one, with the nodes of the first tree before the nodes of the second.
+    def merge(self, first, second):
+        """
+        Merges two trees into one.
+        :param first: The root of the tree whose nodes come first.
+        :param second: The root of the tree whose nodes come second.
+        :return: The root of the merged tree.
+        """
+
+        if first is None or second is None:
+            root = first if second is None else second
+        elif first.priority > second.priority:
+            first.right = self.merge(first.right, second)
+            first.right.parent = first
+            self.resize(first)
+            root = first
+        else:
+            second.left = self.merge(first, second.left)
+            second.left.parent = second
+            self.resize(second)
+            root = second
+
+        if root is not None:
+            root.parent = None
+        return root
+
+
+    # Rebuild the tree from a list of nodes in program order.
+    def rebuild(self, nodes):
+        """
+        Replaces the tree with a perfectly balanced tree of the given nodes in O(n) time, and rebuilds the
+        dictionary of labelled nodes.
+        :param nodes: The nodes of the program, in order.
+        """
+
+        # Link the nodes up the way a binary search would visit them, keeping the order of the levels.
+        def link(low, high, parent, level):
+            if low >= high:
+                return None
+            mid = (low + high) // 2
+            node = nodes[mid]
+            node.parent = parent
+            levels.append((level, mid))
+            node.left = link(low, mid, node, level + 1)
+            node.right = link(mid + 1, high, node, level + 1)
+            node.size = high - low
+            return node
+
+        levels = []
+        self.root = link(0, len(nodes), None, 0)
+
+        # Hand out the priorities from the highest to the lowest level by level, so that every node has a
+        # higher priority than the nodes below it.
+        priorities = sorted((random.random() for x in nodes), reverse=True)
+        for (priority, (level, mid)) in zip(priorities, sorted(levels)):
+            nodes[mid].priority = priority
+
+        self.labelNodes = {node.instruction.label: node for node in nodes if node.instruction.label}
+
+
+    # Get the node at a given line number.
+    def nodeAt(self, lineNum):
+        """
+        Finds the node of the instruction at a given line number, walking down from the root.
+        :param lineNum: The line number of the node (line numbers start from one).
+        :return: The node at the given line number.
+        """
+
+        if not (1 <= lineNum <= len(self)):
+            raise KeyError(lineNum)
+
+        node = self.root
+        index = lineNum - 1
+
+        while True:
+            leftSize = self.sizeOf(node.left)
+            if index < leftSize:
+                node = node.left
+            elif index == leftSize:
+                return node
+            else:
+                index -= leftSize + 1
+                node = node.right
+
+
+    # Get the line number of a given node.
+    def lineOf(self, node):
+        """
+        Finds the line number of a node, walking up from the node to the root.
+        :param node: A node of the program.
+        :return: The line number of the node.
+        """
+
+        lineNum = self.sizeOf(node.left) + 1
+
+        while node.parent is not None:
+            if node is node.parent.right:
+                lineNum += self.sizeOf(node.parent.left) + 1
+            node = node.parent
+
+        return lineNum
+
+
+    # Go through the nodes of the program in order.
+    def nodes(self):
+        """
+        Goes through the nodes of the program in order, without recursion.
+        :return: A generator of the nodes of the program.
+        """
+
+        stack = []
+        node = self.root
+
+        while stack or node is not None:
+            while node is not None:
+                stack.append(node)
+                node = node.left
+            node = stack.pop()
+            yield node
+            node = node.right
+
+
+    # Go through the instructions of the program in order.
+    def __iter__(self):
+        return (node.instruction for node in self.nodes())
+
+
+    # Print the program as a string
+    def __str__(self):
+        """
+        Prints the contents of the program in a better formatted manner.
+        :return: The program as a list of instructions.
+        """
+
+        return "".join(str(aKey) + '    ' + str(anInstruction) + "\n"
+                       for (aKey, anInstruction) in enumerate(self, 1))
+
+
+    # Get an instruction given a line number (line numbers start from one)
+    def __getitem__(self, lineNum):
+        """
+        Get an instruction from the program at the given index.
+        :param lineNum: The index  of the desired instruction.
+        :return: The desired instruction at the given index.
+        """
+
+        return self.nodeAt(lineNum).instruction
+
+
+    #Get the line number of the first instruction within a given label.
+    def getAddress(self, aLabel):
+        """
+        Get the line number of the first instruction within the given label.
+        :param aLabel: The label of a set of instructions.
+        :return: The line number of the first instruction within the label.
+        """
+
+        return self.labelLocator[aLabel]
+
+
+    # Get the number of instructions in a program
+    def __len__(self):
+        """
+        Get the number of instructions in a program.
+        :return: The number of instructions in a program.
+        """
+
+        return self.sizeOf(self.root)
+
+
+    # Add a new instruction to the program
+    def __setitem__(self, lineNum, anInstruction : Instruction):
+        """
+        Add an instruction to the program at the given line number, moving the instruction already there
+        (and every instruction after it) down a line. A line number past the end of the program adds the
+        instruction after the last instruction.
+        :param lineNum: The line number at which one wishes to add an instruction.
+        :param anInstruction: The instruction to be added.
+        """
+
+        node = ProgramNode(anInstruction)
+        first, rest = self.split(self.root, min(lineNum, len(self) + 1) - 1)
+        self.root = self.merge(self.merge(first, node), rest)
+
+        # Add the node to the labels if the added instruction has a label.
+        if anInstruction.label:
+            self.labelNodes[anInstruction.label] = node
+
+
+    # Delete an instruction from the program
+    def __delitem__(self, lineNum):
+        """
+        Remove an instruction from the program at the given line number.
+        :param lineNum: The line number from which one wishes to remove an instruction.
+
+        """
+
+        node = self.nodeAt(lineNum)
+        first, rest = self.split(self.root, lineNum - 1)
+        removed, rest = self.split(rest, 1)
+        self.root = self.merge(first, rest)
+
+        # Take out the label of the instruction if it labels this instruction.
+        if self.labelNodes.get(node.instruction.label) is node:
+            del self.labelNodes[node.instruction.label]
+
+
+    # Apply a batch of insertions and deletions
+    def applyEdits(self, edits):
+        """
+        Inserts and deletes many instructions in one pass over the program, in O(n + k) time for k edits.
+        Every line number refers to the program as it was before any of the edits, so for example an
+        instruction can be inserted before every branch by giving the line numbers of the branches.
+
+        :param edits: An iterable of (line number, instruction) tuples. An instruction is inserted before the
+                      instruction at the line number (or after the last instruction if the line number is
+                      past the end of the program), and an instruction of None deletes the instruction at
+                      the line number. Instructions inserted at the same line keep the order they are given in.
+        """
+
+        inserts = {}
+        deletes = set()
+
+        for (lineNum, anInstruction) in edits:
+            if anInstruction is None:
+                deletes.add(lineNum)
+            else:
+                inserts.setdefault(min(lineNum, len(self) + 1), []).append(ProgramNode(anInstruction))
+
+        # Go through the program once, putting the inserted nodes before their lines and leaving out the
+        # deleted lines.
+        nodes = []
+        for (lineNum, node) in enumerate(self.nodes(), 1):
+            nodes += inserts.get(lineNum, ())
+            if not (lineNum in deletes):
+                nodes.append(node)
+        nodes += inserts.get(len(self) + 1, ())
+
+        self.rebuild(nodes)
+
+
+
 #We shall use this purely as a module to access Program and Instruction classes.
 
 # # The main program of blub.py
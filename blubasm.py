@@ -0,0 +1,297 @@
+# Assemble Program objects written in "Blub" assembly language into binary images, and load them back.
+# An image holds every instruction as four 32-bit words: one for the opcode, condition and operand kinds,
+# and one for each operand. It is followed by a symbol section with the labels of the program and the lines
+# they are on, and a table of the strings the program uses. An image is run straight from a memory-mapped
+# file without parsing any text, and disassembles to the same text Program.__str__ gives.
+
+# Assumptions made prior to code writing:
+#   Only programs without errors that use the instructions every Machine object starts with are assembled,
+#   so the opcode of an instruction is its position in the list of mnemonics below.
+#
+#   Registers and immediate values are kept as numbers. An operand that is not written the way its number
+#   would be written back (such as 'r007') is kept as text instead, so that the disassembled program is the
+#   same as the source program. Labels used as operands are kept as text.
+#
+#   Words are 32-bit little-endian integers whatever the computer the image was assembled on.
+
+# To read and write images we require the sys, struct, mmap and array modules.
+import sys
+import struct
+import mmap
+import array
+
+# To create Instruction objects, import the blub module.
+import blub
+
+# To check and decode programs, import the blubvm module.
+import blubvm
+
+
+# The first bytes of every image, and the version of its format.
+MAGIC = b'BLUBIMG\0'
+FORMAT_VERSION = 1
+
+# The header of an image: the magic bytes, the format version, the number of lines, the number of symbols
+# and the number of bytes of the string table.
+header = struct.Struct('<8sHxxIII')
+
+# The instructions and conditions of the instruction set, in the order of their opcodes.
+mnemonics = ('movi', 'cmpi', 'andi', 'add', 'lsri', 'prnt', 'b', 'popcnt', 'ldr', 'str', 'ldrb', 'strb')
+conditionNames = ('', 'gt', 'ge', 'eq', 'ne', 'le', 'lt')
+
+# The kinds of operands, which are the same as the ones of a ColumnarProgram object.
+EMPTY, REGISTER, IMMEDIATE, TEXT = blub.ColumnarProgram.EMPTY, blub.ColumnarProgram.REGISTER, \
+                                   blub.ColumnarProgram.IMMEDIATE, blub.ColumnarProgram.TEXT
+
+
+# Check whether an image file starts with the magic bytes of an image.
+def isImage(aFile):
+    """
+    Checks whether a file is a binary image rather than the source of a program.
+
+    :param aFile: The name of the file.
+    :return: True if the file starts with the magic bytes of an image, False otherwise.
+    """
+
+    with open(aFile, 'rb') as theFile:
+        return theFile.read(len(MAGIC)) == MAGIC
+
+
+# Assemble a program into an image.
+def assemble(aProgram, aFile):
+    """
+    Assembles a program into a binary image.
+
+    :param aProgram: The Program object to assemble.
+    :param aFile: The name of the image file to write.
+    :raises blubvm.VerificationError: If the program has errors.
+    """
+
+    # Only correct programs are assembled, so that an image can be run without checking it again.
+    theMachine = blubvm.Machine(aProgram)
+    theMachine.decoded = theMachine.decode()
+
+    strings = ['']
+    stringIds = {'': 0}
+
+    def intern(aString):
+        if not (aString in stringIds):
+            stringIds[aString] = len(strings)
+            strings.append(aString)
+        return stringIds[aString]
+
+    words = array.array('I')
+    symbols = array.array('I')
+
+    for lineNum in range(1, len(aProgram) + 1):
+        anInstruction = aProgram[lineNum]
+        kinds = 0
+        values = []
+
+        for (position, operand) in enumerate((anInstruction.op1, anInstruction.op2, anInstruction.op3)):
+            if operand == '':
+                kind, value = EMPTY, 0
+            elif operand[:1] == 'r' and operand[1:].isdigit() and str(int(operand[1:])) == operand[1:]:
+                kind, value = REGISTER, int(operand[1:])
+            elif operand.isdigit() and str(int(operand)) == operand and int(operand) < 2 ** 32:
+                kind, value = IMMEDIATE, int(operand)
+            else:
+                kind, value = TEXT, intern(operand)
+            kinds |= kind << (2 * position)
+            values.append(value)
+
+        words.append(mnemonics.index(anInstruction.instruction)
+                     | (conditionNames.index(anInstruction.condition) << 8) | (kinds << 12))
+        words.extend(values)
+
+        if anInstruction.label:
+            symbols.extend((intern(anInstruction.label), lineNum))
+
+    stringTable = "\0".join(strings).encode()
+
+    if sys.byteorder != 'little':
+        words.byteswap()
+        symbols.byteswap()
+
+    with open(aFile, 'wb') as theFile:
+        theFile.write(header.pack(MAGIC, FORMAT_VERSION, len(aProgram), len(symbols) // 2, len(stringTable)))
+        theFile.write(words.tobytes())
+        theFile.write(symbols.tobytes())
+        theFile.write(stringTable)
+
+
+
+# Write the ImageProgram class to run a program straight from its image.
+class ImageProgram:
+    """
+    A class that represents a "blub" assembly language program held in a memory-mapped binary image. It can
+    be used wherever a Program object is read.
+    """
+
+    # Class constructor
+    def __init__(self, aFile):
+        """
+        The constructor for the ImageProgram class.
+
+        :param aFile: The name of the image file.
+        :raises ValueError: If the file is not an image of this version.
+        """
+
+        with open(aFile, 'rb') as theFile:
+            self.buffer = mmap.mmap(theFile.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if len(self.buffer) < header.size:
+            raise ValueError("Not a blub image: " + aFile)
+
+        magic, formatVersion, lineCount, symbolCount, stringsLength = header.unpack_from(self.buffer)
+        wordsEnd = header.size + 16 * lineCount
+        symbolsEnd = wordsEnd + 8 * symbolCount
+
+        if magic != MAGIC or formatVersion != FORMAT_VERSION or len(self.buffer) != symbolsEnd + stringsLength:
+            raise ValueError("Not a blub image of this version: " + aFile)
+
+        # The words are read straight from the buffer, unless they have to be swapped into the byte order of
+        # this computer first.
+        view = memoryview(self.buffer)
+        if sys.byteorder == 'little':
+            self.words = view[header.size:wordsEnd].cast('I')
+            symbols = view[wordsEnd:symbolsEnd].cast('I')
+        else:
+            self.words = array.array('I', bytes(view[header.size:wordsEnd]))
+            symbols = array.array('I', bytes(view[wordsEnd:symbolsEnd]))
+            self.words.byteswap()
+            symbols.byteswap()
+
+        self.lineCount = lineCount
+        self.strings = bytes(view[symbolsEnd:]).decode().split("\0")
+
+        # Initialize the dictionary with the labels in the program and their line numbers, and a dictionary of
+        # the line numbers with labels and their labels.
+        self.labelLocator = {}
+        self.lineLabels = {}
+        for i in range(0, len(symbols), 2):
+            self.labelLocator[self.strings[symbols[i]]] = symbols[i + 1]
+            self.lineLabels[symbols[i + 1]] = self.strings[symbols[i]]
+
+
+    # Class methods
+
+    # Get the operand kinds and values of a line.
+    def fieldsOf(self, lineNum):
+        """
+        Get the fields of the words of a line.
+        :param lineNum: The line number.
+        :return: A tuple of the opcode, the condition, a tuple of the kinds of the three operands and a tuple of
+                 their values.
+        """
+
+        i = 4 * (lineNum - 1)
+        word = self.words[i]
+        kinds = word >> 12
+
+        return (word & 0xFF, (word >> 8) & 0xF, (kinds & 3, (kinds >> 2) & 3, (kinds >> 4) & 3),
+                (self.words[i + 1], self.words[i + 2], self.words[i + 3]))
+
+
+    # Print the program as a string
+    def __str__(self):
+        """
+        Prints the contents of the program in a better formatted manner.
+        :return: The program as a list of instructions.
+        """
+
+        return "".join(str(aKey) + '    ' + str(self[aKey]) + "\n" for aKey in range(1, len(self) + 1))
+
+
+    # Get an instruction given a line number (line numbers start from one)
+    def __getitem__(self, lineNum):
+        """
+        Get an instruction from the program at the given index.
+        :param lineNum: The index  of the desired instruction.
+        :return: The desired instruction at the given index, rebuilt from its words.
+        """
+
+        # Line numbers outside the program are missing keys, just like in a Program object.
+        if not (1 <= lineNum <= self.lineCount):
+            raise KeyError(lineNum)
+
+        opcode, condition, kinds, values = self.fieldsOf(lineNum)
+        operands = ['' if kind == EMPTY else 'r' + str(value) if kind == REGISTER
+                    else str(value) if kind == IMMEDIATE else self.strings[value]
+                    for (kind, value) in zip(kinds, values)]
+
+        return blub.Instruction(label=self.lineLabels.get(lineNum, ''), instruction=mnemonics[opcode],
+                                condition=conditionNames[condition], op1=operands[0], op2=operands[1],
+                                op3=operands[2])
+
+
+    #Get the line number of the first instruction within a given label.
+    def getAddress(self, aLabel):
+        """
+        Get the line number of the first instruction within the given label.
+        :param aLabel: The label of a set of instructions.
+        :return: The line number of the first instruction within the label.
+        """
+
+        return self.labelLocator[aLabel]
+
+
+    # Get the number of instructions in a program
+    def __len__(self):
+        """
+        Get the number of instructions in a program.
+        :return: The number of instructions in a program.
+        """
+
+        return self.lineCount
+
+
+    # Decode the program straight from its words.
+    def decode(self):
+        """
+        Converts the program into the decoded form run by a Machine object, straight from the words of the
+        image. The program was checked when it was assembled, so it is not checked again.
+
+        :return: The list of decoded instructions, as returned by Machine.decode.
+        """
+
+        opcodes = [blubvm.Machine.opcodes[blubvm.Machine.operators[aName]] for aName in mnemonics]
+        branches = [blubvm.Machine.branches[aCondition] for aCondition in conditionNames]
+        decoded = [(blubvm.OP_HALT, 0, 0, 0)]
+
+        branchOpcode = mnemonics.index('b')
+
+        # Go through the words four at a time, one instruction after the other.
+        for (word, a, b, c) in zip(*[iter(self.words)] * 4):
+            opcode = word & 0xFF
+
+            # Operands kept as text are labels, or numbers written in an unusual way. An operand is kept as
+            # text when both bits of its kind are set.
+            kinds = word >> 12
+            if kinds & (kinds >> 1) & 0b010101:
+                a, b, c = [value if (kinds >> shift) & 3 != TEXT
+                           else self.labelLocator[self.strings[value]] if opcode == branchOpcode
+                           else int(self.strings[value].replace('r', ''))
+                           for (shift, value) in ((0, a), (2, b), (4, c))]
+
+            if opcode == branchOpcode:
+                decoded.append((branches[(word >> 8) & 0xF], a, 0, 0))
+            else:
+                decoded.append((opcodes[opcode], a, b, c))
+
+        decoded.append((blubvm.OP_HALT, 0, 0, 0))
+
+        return blubvm.Machine.fuseCompares(decoded)
+
+
+
+# Disassemble an image.
+def disassemble(aFile):
+    """
+    Disassembles a binary image into the text of its program, numbered the way a Program object prints it.
+
+    :param aFile: The name of the image file.
+    :return: The program as a string.
+    """
+
+    return str(ImageProgram(aFile))
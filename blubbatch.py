@@ -0,0 +1,193 @@
+# Run many Program objects written in "Blub" assembly language across a pool of worker processes.
+# The programs are given as a directory of program files or as a manifest that lists them. Each worker
+# parses and runs the programs it is handed one after the other, capturing the output of each program on
+# its own, and reports its output, how long it took and whether it failed.
+
+# Assumptions made prior to code writing:
+#   Every file in a directory is a program, except for hidden files. The files of a directory are run in
+#   the order of their names.
+#
+#   A manifest lists one program file per line. Blank lines and lines starting with '#' are skipped, and
+#   paths that are not absolute are taken relative to the directory the manifest is in.
+#
+#   A program that fails to parse or run does not stop the batch. Its error is reported along with the
+#   output it printed before failing.
+#
+#   A program that never ends would keep its worker busy forever, so programs run by the decoded interpreter
+#   are run within a budget of instructions or seconds, by default defaultTimeout seconds, and the ones
+#   stopped by it are reported. The other engines cannot stop a program part of the way through, so they run
+#   every program to its end.
+
+# To find the program files and report the results, we require the os, sys and json modules.
+import os
+import sys
+import json
+
+# To run the programs in worker processes with their output captured and timed, we require the
+# multiprocessing, io, contextlib and time modules.
+import multiprocessing
+import io
+import contextlib
+import time
+
+# To create Program objects, import the blub module.
+import blub
+
+# To run the programs, import the blubvm module.
+import blubvm
+
+
+# The default number of seconds a program of a batch run by the decoded interpreter may run for.
+defaultTimeout = 60.0
+
+# Get the program files to run.
+def findPrograms(aSource):
+    """
+    Lists the program files of a directory, or the program files named in a manifest file.
+
+    :param aSource: The path to a directory of program files, or to a manifest file.
+    :return: A list of the paths to the program files.
+    """
+
+    if os.path.isdir(aSource):
+        return [os.path.join(aSource, aName) for aName in sorted(os.listdir(aSource))
+                if not aName.startswith('.') and os.path.isfile(os.path.join(aSource, aName))]
+
+    base = os.path.dirname(aSource)
+    with open(aSource) as manifest:
+        return [os.path.join(base, aLine.strip()) for aLine in manifest
+                if aLine.strip() and not aLine.strip().startswith('#')]
+
+
+# Parse and run a single program file with its output captured.
+def runProgram(aProgramFile, engineName='decoded', maxSteps=None, timeout=None):
+    """
+    Parses and runs a program file on a fresh Machine object, capturing what it prints.
+
+    :param aProgramFile: The path to the program file.
+    :param engineName: The name of the engine to run the program with, as found in blubvm.engines.
+    :param maxSteps: The most instructions to run, or None for no limit. See Machine.interpretWithBudget,
+                     which runs the program in place of the engine when a budget is given.
+    :param timeout: The most seconds to run for, or None for no limit.
+    :return: A dictionary of the path to the program, its status ('ok', 'error' or 'stopped' if it went
+             over its budget), the error message if it failed or was stopped, its output, the number of
+             instructions run and the seconds taken to parse and to run.
+    """
+
+    result = {'program': aProgramFile, 'status': 'ok', 'error': None, 'output': '', 'instructions': 0,
+              'parseSeconds': 0.0, 'runSeconds': 0.0}
+    output = io.StringIO()
+    interpreter = None
+
+    try:
+        startTime = time.perf_counter()
+        prog = blub.Program(aProgramFile)
+        result['parseSeconds'] = time.perf_counter() - startTime
+
+        # The printed values are collected in memory and written out in batches, rather than going
+        # through stdout one at a time.
+        printed = blubvm.BufferedOutput(output)
+        interpreter = blubvm.Machine(prog, printed)
+
+        startTime = time.perf_counter()
+        with printed:
+            if maxSteps is None and timeout is None:
+                blubvm.engines[engineName](interpreter)
+            else:
+                runResult = interpreter.interpretWithBudget(maxSteps, timeout)
+        result['runSeconds'] = time.perf_counter() - startTime
+
+        if (maxSteps is not None or timeout is not None) and runResult.status != 'done':
+            result['status'] = 'stopped'
+            result['error'] = "Stopped by the %s budget at line %d after %d instructions" \
+                              % (runResult.status, runResult.pc, runResult.steps)
+
+    # The interpreter lists every error it finds in the program.
+    except blubvm.BlubError as anError:
+        result['status'] = 'error'
+        result['error'] = str(anError)
+    except Exception as anError:
+        result['status'] = 'error'
+        result['error'] = "%s: %s" % (type(anError).__name__, anError)
+
+    result['output'] = output.getvalue()
+    if interpreter is not None:
+        result['instructions'] = interpreter.steps
+
+    return result
+
+
+# Run a single program in a worker process.
+def runTask(task):
+    return runProgram(*task)
+
+
+# Run many program files across a pool of worker processes.
+def runBatch(programFiles, engineName='decoded', processes=None, maxSteps=None, timeout=None):
+    """
+    Runs program files across a pool of worker processes, one program at a time per worker.
+
+    :param programFiles: A list of the paths to the program files.
+    :param engineName: The name of the engine to run the programs with, as found in blubvm.engines.
+    :param processes: The number of worker processes, or None for one per CPU. With a single process the
+                      programs are run in this process, without a pool.
+    :param maxSteps: The most instructions to run each program for, or None for no limit.
+    :param timeout: The most seconds to run each program for, or None for defaultTimeout seconds if neither
+                    budget is given and the programs are run by the decoded interpreter.
+    :return: A generator of the result of each program, as returned by runProgram, in the order given.
+    """
+
+    if engineName == 'decoded' and maxSteps is None and timeout is None:
+        timeout = defaultTimeout
+
+    tasks = [(aProgramFile, engineName, maxSteps, timeout) for aProgramFile in programFiles]
+    processes = processes or os.cpu_count() or 1
+
+    if processes == 1:
+        yield from map(runTask, tasks)
+        return
+
+    # Hand the programs out in chunks so that small programs are not dominated by the cost of sending them
+    # to the workers, while still leaving enough chunks to keep every worker busy until the end.
+    chunkSize = max(1, len(tasks) // (processes * 8))
+
+    with multiprocessing.Pool(processes) as pool:
+        yield from pool.imap(runTask, tasks, chunkSize)
+
+
+# Run a directory or manifest of programs and write their results.
+def main(aSource, engineName='decoded', processes=None, aFile=None, maxSteps=None, timeout=None):
+    """
+    Runs the programs of a directory or manifest, and writes the result of each as a line of JSON. A summary
+    of the number of programs run, failed and stopped by their budget and the time taken is printed to
+    standard error.
+
+    :param aSource: The path to a directory of program files, or to a manifest file.
+    :param engineName: The name of the engine to run the programs with, as found in blubvm.engines.
+    :param processes: The number of worker processes, or None for one per CPU.
+    :param aFile: The name of the file to write the results to, or None to write to standard output.
+    :param maxSteps: The most instructions to run each program for, or None for no limit.
+    :param timeout: The most seconds to run each program for, or None for the default, see runBatch.
+    :return: The number of programs that failed or were stopped by their budget.
+    """
+
+    programFiles = findPrograms(aSource)
+    failed = 0
+    stopped = []
+
+    startTime = time.perf_counter()
+    with (open(aFile, 'w') if aFile is not None else contextlib.nullcontext(sys.stdout)) as theFile:
+        for result in runBatch(programFiles, engineName, processes, maxSteps, timeout):
+            failed += result['status'] == 'error'
+            if result['status'] == 'stopped':
+                stopped.append(result['program'])
+            theFile.write(json.dumps(result, sort_keys=True) + "\n")
+    elapsed = time.perf_counter() - startTime
+
+    print("%d programs, %d failed, %d stopped by their budget, in %.3f s  %.0f programs/s"
+          % (len(programFiles), failed, len(stopped), elapsed, len(programFiles) / elapsed if elapsed else 0),
+          file=sys.stderr)
+    for aProgramFile in stopped:
+        print("Stopped by its budget: " + aProgramFile, file=sys.stderr)
+
+    return failed + len(stopped)
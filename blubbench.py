@@ -0,0 +1,245 @@
+# Benchmark the parsing, decoding and running of "Blub" programs.
+# The benchmark generates a corpus of programs that each stress one part of the interpreter, and times
+# parsing, decoding and running every program with every engine separately. The results are written as
+# JSON so that they can be kept and compared between releases.
+
+# Assumptions made prior to code writing:
+#   The generated programs only use the instructions every engine supports, and never put a value in a
+#   register that does not fit in 32 bits.
+#
+#   Every time reported is the best of a number of repeats, since the best time is the one least affected
+#   by whatever else the computer is doing.
+#
+#   The output of the programs is captured rather than printed, so that printing does not count towards
+#   the time taken to run them.
+
+# To build programs in memory and time them, we require the io, time and random modules. To describe the
+# computer the benchmark ran on and write the results, we require the platform, sys and json modules.
+import io
+import time
+import random
+import platform
+import sys
+import json
+
+# To create Program objects, import the blub module.
+import blub
+
+# To decode and run programs with each engine, import the blubvm module.
+import blubvm
+
+
+# The version of the results format. Results with different versions should not be compared.
+BENCH_VERSION = 1
+
+
+# Generate a program that spends its time in a small loop.
+def tightLoop(size):
+    """
+    Generates a program whose loop adds to a counter until it reaches a limit, so that almost all of its
+    time is spent running the same four instructions.
+
+    :param size: The number of times the loop runs.
+    :return: The source code of the program as a string.
+    """
+
+    return "\n".join(["movi r0, 0",
+                      "movi r1, 1",
+                      "movi r2, 0",
+                      "loop: cmpi r0, %d" % size,
+                      "bge done",
+                      "add r0, r0, r1",
+                      "add r2, r2, r0",
+                      "andi r2, r2, 65535",
+                      "b loop",
+                      "done: prnt r2"]) + "\n"
+
+
+# Generate a program that takes a different path through its loop on every run.
+def branchHeavy(size):
+    """
+    Generates a program whose loop tests the low bits of a counter with a chain of conditional branches,
+    so that most of the instructions it runs are compares and branches that go both ways.
+
+    :param size: The number of times the loop runs.
+    :return: The source code of the program as a string.
+    """
+
+    lines = ["movi r0, 0",
+             "movi r1, 1",
+             "movi r2, 0",
+             "loop: cmpi r0, %d" % size,
+             "bge done",
+             "add r0, r0, r1"]
+
+    # Each bit of the counter decides whether the next test is skipped.
+    for bit in range(4):
+        lines += ["lsri r3, r0, %d" % bit,
+                  "andi r3, r3, 1",
+                  "cmpi r3, 0",
+                  "beq skip%d" % bit,
+                  "add r2, r2, r3",
+                  "skip%d: cmpi r2, 60000" % bit,
+                  "blt keep%d" % bit,
+                  "movi r2, 0",
+                  "keep%d: andi r2, r2, 65535" % bit]
+
+    lines += ["b loop",
+              "done: prnt r2"]
+
+    return "\n".join(lines) + "\n"
+
+
+# Generate a long program with no branches.
+def straightLine(size, seed=0):
+    """
+    Generates a program that runs each of its instructions once from the first line to the last.
+
+    :param size: The number of instructions in the program.
+    :param seed: The seed of the random instructions.
+    :return: The source code of the program as a string.
+    """
+
+    generator = random.Random(seed)
+    lines = ["movi r%d, %d" % (reg, reg + 1) for reg in range(8)]
+
+    while len(lines) < size - 1:
+        a, b, c = (generator.randrange(8) for i in range(3))
+        lines.append(generator.choice(["add r%d, r%d, r%d" % (a, b, c),
+                                       "andi r%d, r%d, 4095" % (a, b),
+                                       "lsri r%d, r%d, 1" % (a, b),
+                                       "movi r%d, %d" % (a, generator.randrange(4096))]))
+
+        # Keep the values small enough that adding them up never overflows a register.
+        if lines[-1].startswith('add'):
+            lines.append("andi r%d, r%d, 65535" % (a, a))
+
+    lines.append("prnt r0")
+
+    return "\n".join(lines) + "\n"
+
+
+# Generate a program with a label on every other line.
+def labelTable(size, seed=0):
+    """
+    Generates a program made of labelled blocks that branch to each other in a random order, visiting
+    every block once, so that the program has a large number of labels to look up.
+
+    :param size: The number of labels in the program.
+    :param seed: The seed of the order in which the blocks are visited.
+    :return: The source code of the program as a string.
+    """
+
+    order = list(range(1, size))
+    random.Random(seed).shuffle(order)
+    following = dict(zip([0] + order, order + ['done']))
+
+    lines = ["movi r0, 0",
+             "movi r1, 1",
+             "b l0"]
+    for label in range(size):
+        lines += ["l%d: add r0, r0, r1" % label,
+                  "b l%s" % following[label]]
+    lines.append("ldone: prnt r0")
+
+    return "\n".join(lines) + "\n"
+
+
+# Initialize a dictionary of the workloads in the corpus, and the size of each at a scale of 1.
+workloads = {'tight-loop': (tightLoop, 20000),
+             'branch-heavy': (branchHeavy, 2000),
+             'straight-line': (straightLine, 50000),
+             'label-table': (labelTable, 20000)}
+
+
+# Get the best time taken by a function over a number of repeats.
+def bestTime(aFunction, repeats):
+    """
+    Calls a function a number of times and keeps the shortest time it took.
+
+    :param aFunction: The function to call, without arguments.
+    :param repeats: The number of times to call it.
+    :return: A tuple of the shortest time in seconds, and the value returned by the last call.
+    """
+
+    best = None
+
+    for aRepeat in range(repeats):
+        startTime = time.perf_counter()
+        result = aFunction()
+        elapsed = time.perf_counter() - startTime
+        best = elapsed if best is None else min(best, elapsed)
+
+    return best, result
+
+
+# Benchmark a single program.
+def benchmarkSource(aSource, engineNames, repeats=3):
+    """
+    Times parsing, decoding and running a program with each of the given engines.
+
+    :param aSource: The source code of the program as a string.
+    :param engineNames: The names of the engines to run the program with, as found in blubvm.engines.
+    :param repeats: The number of times each step is timed.
+    :return: A dictionary of the results, suitable for writing as JSON.
+    """
+
+    parseTime, prog = bestTime(lambda: blub.Program(io.StringIO(aSource)), repeats)
+    decodeTime, decoded = bestTime(lambda: blubvm.Machine(prog).decode(), repeats)
+
+    result = {'lines': len(prog), 'parse': parseTime, 'decode': decodeTime, 'engines': {}}
+
+    for engineName in engineNames:
+        runs = [blubvm.compareEngines(prog, [engineName])[0] for aRepeat in range(repeats)]
+        name, steps, elapsed = min(runs, key=lambda run: run[2])
+        result['engines'][engineName] = {'instructions': steps, 'seconds': elapsed,
+                                         'instructionsPerSecond': steps / elapsed if elapsed else None}
+
+    return result
+
+
+# Benchmark the whole corpus.
+def runBenchmarks(engineNames=None, scale=1.0, repeats=3, names=None):
+    """
+    Generates every workload of the corpus and benchmarks it.
+
+    :param engineNames: The names of the engines to run the programs with, or None for every engine.
+    :param scale: How much larger or smaller than their default size to make the workloads.
+    :param repeats: The number of times each step is timed.
+    :param names: The names of the workloads to run, or None for every workload.
+    :return: A dictionary of the results, suitable for writing as JSON.
+    """
+
+    engineNames = sorted(blubvm.engines) if engineNames is None else list(engineNames)
+
+    results = {'version': BENCH_VERSION,
+               'python': platform.python_version(),
+               'implementation': platform.python_implementation(),
+               'platform': platform.platform(),
+               'scale': scale,
+               'repeats': repeats,
+               'workloads': {}}
+
+    for name in (sorted(workloads) if names is None else names):
+        generate, size = workloads[name]
+        results['workloads'][name] = benchmarkSource(generate(max(1, int(size * scale))), engineNames, repeats)
+
+    return results
+
+
+# Write the results of a benchmark as JSON.
+def writeResults(results, aFile=None):
+    """
+    Writes the results of a benchmark as JSON.
+
+    :param results: The dictionary returned by runBenchmarks.
+    :param aFile: The name of the file to write, or None to write to standard output.
+    """
+
+    if aFile is None:
+        json.dump(results, sys.stdout, indent=2, sort_keys=True)
+        print()
+    else:
+        with open(aFile, 'w') as theFile:
+            json.dump(results, theFile, indent=2, sort_keys=True)
+            theFile.write("\n")
@@ -0,0 +1,285 @@
+# Cache Program objects written in "Blub" assembly language on disk, in their parsed and decoded form.
+# A program file that has been loaded before is read back from a compact binary file made of the columns of
+# a ColumnarProgram object and the decoded form of the program, so loading it again skips parsing and
+# checking its text. The binary file is read through a memory-mapped buffer straight into arrays.
+
+# Assumptions made prior to code writing:
+#   Cached programs are found by a hash of the contents of the program file and the version of the decoded
+#   form, so a changed program file or a new version of the interpreter never loads a stale entry.
+#
+#   Only programs without errors are cached, and their decoded form is the one for the instructions every
+#   Machine object starts with. Machine objects with added instructions should decode the program again.
+#
+#   The cache is bounded in size. Every time a cached program is loaded its file is touched, and when the
+#   cache grows too large the files that were used the longest time ago are removed first.
+#
+#   Numbers are kept as little-endian integers whatever the computer they were written on: 32-bit ones for
+#   the columns, which only hold numbers below 2 ** 31, and 64-bit ones for the decoded form, which holds
+#   immediate values as they were written. A program with an immediate value too large even for that is not
+#   cached.
+
+# To find, hash and store cached programs, we require the os, sys, hashlib, tempfile and struct modules. To
+# read them back without copying them through a file object we require the mmap and array modules, and the
+# io module to parse a program from the bytes of its file.
+import os
+import sys
+import hashlib
+import tempfile
+import struct
+import mmap
+import array
+import io
+
+# To create Program objects, import the blub module.
+import blub
+
+# To decode programs, import the blubvm module. The cache is kept next to the one of the blubjit module.
+import blubvm
+import blubjit
+
+
+# The first bytes of every cached program file, and the version of its format.
+MAGIC = b'BLUBPROG'
+FORMAT_VERSION = 2
+
+# The header of a cached program file: the magic bytes, the format version, the version of the decoded
+# form, the number of lines, the number of bytes of the string table, and the number of integers of the
+# decoded form.
+header = struct.Struct('<8sHHIII')
+
+# The integer columns of a ColumnarProgram object, in the order they are written.
+integerColumns = ('labels', 'names', 'conditions', 'op1', 'op2', 'op3')
+
+# The default largest size of the cache in bytes.
+defaultMaxBytes = 64 * 1024 * 1024
+
+
+# Get the directory in which programs are cached.
+def cacheDirectory():
+    """
+    Get the directory in which parsed programs are cached, next to the directory of compiled programs.
+
+    :return: The path to the cache directory.
+    """
+
+    return os.path.join(blubjit.cacheDirectory(), 'programs')
+
+
+# Get the key a program file is cached under.
+def cacheKey(data):
+    """
+    Get the key a program is cached under, from the contents of its file and the version of the decoded form.
+
+    :param data: The contents of the program file as bytes.
+    :return: The key as a string of hexadecimal digits.
+    """
+
+    return hashlib.sha256(b"%d\n%d\n" % (FORMAT_VERSION, blubvm.VM_VERSION) + data).hexdigest()
+
+
+# Convert an array of integers to or from little-endian order.
+def littleEndian(anArray):
+    if sys.byteorder != 'little':
+        anArray.byteswap()
+    return anArray
+
+
+# Read an array of numbers from a part of a buffer.
+def arrayOf(typecode, data):
+    anArray = array.array(typecode)
+    anArray.frombytes(data)
+    return anArray
+
+
+# Write a program and its decoded form to a file.
+def writeProgram(aFile, aProgram, decoded):
+    """
+    Writes a ColumnarProgram object and its decoded form in the binary format of the cache.
+
+    :param aFile: A file object opened for writing bytes.
+    :param aProgram: The ColumnarProgram object.
+    :param decoded: The decoded form of the program, as returned by Machine.decode.
+    :raises OverflowError: If a number of the decoded form does not fit in 64 bits.
+    """
+
+    strings = "\0".join(aProgram.strings).encode()
+    flatDecoded = littleEndian(array.array('q', [number for aTuple in decoded for number in aTuple]))
+
+    aFile.write(header.pack(MAGIC, FORMAT_VERSION, blubvm.VM_VERSION, len(aProgram), len(strings),
+                            len(flatDecoded)))
+    for aColumn in integerColumns:
+        aFile.write(littleEndian(array.array('i', getattr(aProgram, aColumn))).tobytes())
+    aFile.write(flatDecoded.tobytes())
+    aFile.write(aProgram.kinds.tobytes())
+    aFile.write(strings)
+
+
+# Read a program and its decoded form from a file.
+def readProgram(aProgramFile):
+    """
+    Reads a program written by writeProgram through a memory-mapped buffer, without parsing any text.
+
+    :param aProgramFile: The name of the cached program file.
+    :return: A tuple of the ColumnarProgram object and its decoded form.
+    :raises ValueError: If the file is not a cached program of this version.
+    """
+
+    with open(aProgramFile, 'rb') as theFile:
+        with mmap.mmap(theFile.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            if len(buffer) < header.size:
+                raise ValueError("Not a cached blub program: " + aProgramFile)
+
+            magic, formatVersion, vmVersion, lineCount, stringsLength, decodedLength = header.unpack_from(buffer)
+            if magic != MAGIC or formatVersion != FORMAT_VERSION or vmVersion != blubvm.VM_VERSION \
+                    or len(buffer) != header.size + 4 * 6 * lineCount + 8 * decodedLength + lineCount + stringsLength:
+                raise ValueError("Not a cached blub program of this version: " + aProgramFile)
+
+            # Read each section of the file into an array, straight from the buffer.
+            with memoryview(buffer) as view:
+                position = header.size
+                columns = {}
+                for aColumn in integerColumns:
+                    columns[aColumn] = littleEndian(arrayOf('i', view[position:position + 4 * lineCount]))
+                    position += 4 * lineCount
+
+                flatDecoded = littleEndian(arrayOf('q', view[position:position + 8 * decodedLength]))
+                position += 8 * decodedLength
+
+                kinds = arrayOf('B', view[position:position + lineCount])
+                position += lineCount
+
+                strings = bytes(view[position:position + stringsLength]).decode().split("\0")
+
+    aProgram = blub.ColumnarProgram.fromColumns(strings, kinds=kinds, **columns)
+    decoded = list(zip(*[iter(flatDecoded)] * 4))
+
+    return aProgram, decoded
+
+
+
+# Write the ProgramCache class to load programs through the cache.
+class ProgramCache:
+    """
+    A class that loads program files, parsing and decoding each one only the first time it is seen.
+    """
+
+    # Class constructor
+    def __init__(self, cacheDir=None, maxBytes=defaultMaxBytes):
+        """
+        The constructor for the ProgramCache class.
+
+        :param cacheDir: The directory to cache programs in, or None for the default cache directory.
+        :param maxBytes: The largest size of the cache in bytes.
+        """
+
+        self.cacheDir = cacheDir or cacheDirectory()
+        self.maxBytes = maxBytes
+
+        # Initialize counts of the programs loaded from the cache and of the ones that had to be parsed.
+        self.hits = 0
+        self.misses = 0
+
+
+    # Class methods
+
+    # Load a program file through the cache.
+    def load(self, aProgramFile):
+        """
+        Loads a program file, from the cache if it has been loaded before.
+
+        :param aProgramFile: The name of the "blub" program file.
+        :return: A tuple of the ColumnarProgram object and its decoded form. The decoded form is None if the
+                 program has errors, which are not cached so that they are reported every time.
+        """
+
+        with open(aProgramFile, 'rb') as theFile:
+            data = theFile.read()
+
+        path = os.path.join(self.cacheDir, cacheKey(data) + '.bin')
+
+        # Use the cached program if there is one, and mark it as the most recently used.
+        try:
+            aProgram, decoded = readProgram(path)
+            os.utime(path)
+            self.hits += 1
+            return aProgram, decoded
+        except (OSError, ValueError):
+            pass
+
+        self.misses += 1
+
+        aProgram = blub.ColumnarProgram(io.StringIO(data.decode()))
+        theMachine = blubvm.Machine(aProgram)
+        if theMachine.verify():
+            return aProgram, None
+
+        # Write the program to a temporary file first and then move it into place, so that another process
+        # never reads a partly written file. The temporary file is removed if it is not moved into place.
+        # Failing to cache, such as for a program with an immediate value too large to store, is not an error.
+        try:
+            os.makedirs(self.cacheDir, exist_ok=True)
+            handle, tempPath = tempfile.mkstemp(dir=self.cacheDir, suffix='.tmp')
+            try:
+                with os.fdopen(handle, 'wb') as tempFile:
+                    writeProgram(tempFile, aProgram, theMachine.decoded)
+                os.replace(tempPath, path)
+            except BaseException:
+                try:
+                    os.remove(tempPath)
+                except OSError:
+                    pass
+                raise
+            self.evict()
+        except (OSError, OverflowError):
+            pass
+
+        return aProgram, theMachine.decoded
+
+
+    # Remove the least recently used programs until the cache fits in its size.
+    def evict(self):
+        """
+        Removes cached programs, starting with the one used the longest time ago, until the total size of the
+        cache is no more than its largest size.
+
+        :return: The number of cached programs removed.
+        """
+
+        return evictFiles(self.cacheDir, self.maxBytes)
+
+
+
+# Remove the least recently used files of a cache directory until it fits in its size.
+def evictFiles(cacheDir, maxBytes):
+    """
+    Removes the cached files of a directory, starting with the one used the longest time ago, until their
+    total size is no more than the largest size of the cache.
+
+    :param cacheDir: The cache directory.
+    :param maxBytes: The largest size of the cache in bytes.
+    :return: The number of files removed.
+    """
+
+    entries = []
+    for aName in os.listdir(cacheDir):
+        if aName.endswith('.bin'):
+            try:
+                status = os.stat(os.path.join(cacheDir, aName))
+                entries.append((status.st_mtime, status.st_size, aName))
+            except OSError:
+                pass
+
+    total = sum(size for (mtime, size, aName) in entries)
+    removed = 0
+
+    for (mtime, size, aName) in sorted(entries):
+        if total <= maxBytes:
+            break
+        try:
+            os.remove(os.path.join(cacheDir, aName))
+            removed += 1
+        except OSError:
+            pass
+        total -= size
+
+    return removed
@@ -0,0 +1,272 @@
+# Run a Program object written in "Blub" assembly language once for every row of a file of inputs.
+# Each row gives the values some of the registers start with. The program is parsed and decoded once, and
+# the same Machine object is reset and run again for every row, so a run costs no more than the program
+# takes to run. The inputs are read from a CSV file, or from a binary file of 32-bit integers read through a
+# memory-mapped buffer, and the values printed by each run are written out as a line.
+
+# Assumptions made prior to code writing:
+#   The first row of a CSV file names the registers its columns give values for, such as "r0,r3". Every
+#   other row holds a value for each of them. Blank rows are skipped, but a first row that names no registers
+#   is an error rather than a file of no runs.
+#
+#   A binary input file starts with a header giving the number of columns and rows, followed by the
+#   register number of every column and the values of the rows one after the other, as 32-bit little-endian
+#   integers whatever the computer the file was written on.
+#
+#   Registers a row does not give a value for start with the values given on the command line, or otherwise
+#   with the values the program moves into them when it starts. See Machine.reset.
+
+# To read and write the input files and report the results, we require the sys, time, csv, struct, mmap and
+# array modules.
+import sys
+import time
+import csv
+import struct
+import mmap
+import array
+
+# To run the program, import the blubvm module.
+import blubvm
+
+
+# The first bytes of every binary input file, and the version of its format.
+MAGIC = b'BLUBROWS'
+FORMAT_VERSION = 1
+
+# The header of a binary input file: the magic bytes, the format version, the number of columns and the
+# number of rows.
+header = struct.Struct('<8sHxxII')
+
+
+# Get the register number a register name gives.
+def registerOf(aName):
+    """
+    Get the number of the register a name such as 'r3' gives.
+
+    :param aName: The name of the register.
+    :return: The register number.
+    :raises ValueError: If the name is not the name of one of the 32 registers.
+    """
+
+    aName = aName.strip()
+    if not blubvm.Machine.isRegister(aName) or int(aName[1:]) > 31:
+        raise ValueError("Not a register: " + aName)
+
+    return int(aName[1:])
+
+
+# Get the register and value an assignment such as 'r0=1234' gives.
+def assignmentOf(anAssignment):
+    """
+    Get the register and the value of an assignment of the form 'r0=1234'.
+
+    :param anAssignment: The assignment as a string.
+    :return: A tuple of the register number and the value.
+    :raises ValueError: If the assignment is badly formed.
+    """
+
+    aName, separator, aValue = anAssignment.partition('=')
+    if not separator:
+        raise ValueError("Not an assignment of a register: " + anAssignment)
+
+    return registerOf(aName), int(aValue)
+
+
+# Check whether a file starts with the magic bytes of a binary input file.
+def isRowFile(aFile):
+    with open(aFile, 'rb') as theFile:
+        return theFile.read(len(MAGIC)) == MAGIC
+
+
+# Read the rows of a CSV file.
+def readCsv(aFile):
+    """
+    Reads the inputs of a CSV file whose first row names the registers of its columns.
+
+    :param aFile: The name of the CSV file.
+    :return: A tuple of a list of the register numbers of the columns and an array of the values of every
+             row, one row after the other.
+    :raises ValueError: If the first row names no registers, or a row is badly formed.
+    """
+
+    values = array.array('i')
+
+    with open(aFile, newline='') as theFile:
+        reader = csv.reader(theFile)
+        registers = [registerOf(aName) for aName in next(reader, [])]
+        if not registers:
+            raise ValueError("The first line of %s names no registers" % aFile)
+
+        for row in reader:
+            if not row:
+                continue
+            if len(row) != len(registers):
+                raise ValueError("Line %d of %s has %d values rather than %d"
+                                 % (reader.line_num, aFile, len(row), len(registers)))
+            values.extend(int(aValue) for aValue in row)
+
+    return registers, values
+
+
+# Read the rows of a binary input file.
+def readBinary(aFile):
+    """
+    Reads the inputs of a binary input file through a memory-mapped buffer, without copying the values.
+
+    :param aFile: The name of the binary input file.
+    :return: A tuple of a list of the register numbers of the columns and a sequence of the values of every
+             row, one row after the other. The values may be read from the buffer of the file, which is closed
+             by closeRows.
+    :raises ValueError: If the file is not a binary input file of this version, or names no registers.
+    """
+
+    with open(aFile, 'rb') as theFile:
+        buffer = mmap.mmap(theFile.fileno(), 0, access=mmap.ACCESS_READ)
+
+    # The file is checked before any of it is read into a view, so that the buffer can be closed if it is not
+    # a binary input file.
+    try:
+        if len(buffer) < header.size:
+            raise ValueError("Not a blub input file: " + aFile)
+
+        magic, formatVersion, columnCount, rowCount = header.unpack_from(buffer)
+        valuesStart = header.size + 4 * columnCount
+
+        if magic != MAGIC or formatVersion != FORMAT_VERSION \
+                or len(buffer) != valuesStart + 4 * columnCount * rowCount:
+            raise ValueError("Not a blub input file of this version: " + aFile)
+
+        registers = list(struct.unpack_from('<%di' % columnCount, buffer, header.size))
+        if any(not (0 <= reg <= 31) for reg in registers):
+            raise ValueError("Not a blub input file of this version: " + aFile)
+        if not registers:
+            raise ValueError("%s names no registers" % aFile)
+    except ValueError:
+        buffer.close()
+        raise
+
+    # The values are read straight from the buffer, unless they have to be swapped into the byte order of
+    # this computer first.
+    if sys.byteorder == 'little':
+        return registers, memoryview(buffer)[valuesStart:].cast('i')
+
+    values = array.array('i', buffer[valuesStart:])
+    values.byteswap()
+    buffer.close()
+
+    return registers, values
+
+
+# Close the buffer the values of a binary input file are read from.
+def closeRows(values):
+    """
+    Closes the memory-mapped buffer of a binary input file once its values have been read.
+
+    :param values: The sequence of values returned by readRows. Values that were not read from a buffer are
+                   left as they are.
+    """
+
+    if isinstance(values, memoryview):
+        buffer = values.obj
+        values.release()
+        buffer.close()
+
+
+# Read the rows of an input file.
+def readRows(aFile):
+    """
+    Reads the inputs of a binary input file, or of a CSV file.
+
+    :param aFile: The name of the input file.
+    :return: A tuple of a list of the register numbers of the columns and a sequence of the values of every
+             row, one row after the other.
+    """
+
+    return readBinary(aFile) if isRowFile(aFile) else readCsv(aFile)
+
+
+# Write rows of inputs to a binary input file.
+def writeRows(aFile, registers, values):
+    """
+    Writes rows of inputs to a binary input file, which is read faster than a CSV file.
+
+    :param aFile: The name of the binary input file to write.
+    :param registers: A list of the register numbers of the columns.
+    :param values: A sequence of the values of every row, one row after the other.
+    """
+
+    columns = array.array('i', registers)
+    values = array.array('i', values)
+
+    if sys.byteorder != 'little':
+        columns.byteswap()
+        values.byteswap()
+
+    with open(aFile, 'wb') as theFile:
+        theFile.write(header.pack(MAGIC, FORMAT_VERSION, len(columns), len(values) // max(1, len(columns))))
+        theFile.write(columns.tobytes())
+        theFile.write(values.tobytes())
+
+
+# Run a Machine object once for every row of inputs.
+def runRows(aMachine, registers, values, engineName='decoded', inputs=None, memo=None):
+    """
+    Runs the program of a Machine object once for every row of inputs, resetting the machine before each run.
+
+    :param aMachine: The Machine object to run.
+    :param registers: A list of the register numbers of the columns.
+    :param values: A sequence of the values of every row, one row after the other.
+    :param engineName: The name of the engine to run the program with, as found in blubvm.engines.
+    :param inputs: A dictionary of register numbers and the values they start with in every row, or None.
+    :param memo: A blubmemo.ResultCache object to run the rows through, so that repeated rows are not run
+                 again, or None to run every row.
+    :return: A generator of a list of the values printed by each run.
+    """
+
+    printed = []
+    aMachine.output = printed.append
+    engine = blubvm.engines[engineName]
+    inputs = dict(inputs or {})
+
+    for row in zip(*[iter(values)] * len(registers)):
+        inputs.update(zip(registers, row))
+        aMachine.reset(inputs)
+        if memo is not None:
+            memo.run(aMachine, engine)
+        else:
+            engine(aMachine)
+        yield list(printed)
+        printed.clear()
+
+
+# Run a Machine object over an input file and write its results.
+def main(aMachine, aFile, engineName='decoded', inputs=None, output=None, memo=None):
+    """
+    Runs the program of a Machine object once for every row of an input file, and writes the values printed
+    by each run as a line. The number of runs and the runs per second are printed to standard error.
+
+    :param aMachine: The Machine object to run.
+    :param aFile: The name of the input file.
+    :param engineName: The name of the engine to run the program with, as found in blubvm.engines.
+    :param inputs: A dictionary of register numbers and the values they start with in every row, or None.
+    :param output: A file object to write the results to, or None to write to standard output.
+    :param memo: A blubmemo.ResultCache object to run the rows through, or None to run every row.
+    :return: The number of runs.
+    """
+
+    registers, values = readRows(aFile)
+    runs = 0
+
+    startTime = time.perf_counter()
+    try:
+        with blubvm.BufferedOutput(output) as write:
+            for printed in runRows(aMachine, registers, values, engineName, inputs, memo):
+                write(" ".join(map(str, printed)))
+                runs += 1
+    finally:
+        closeRows(values)
+    elapsed = time.perf_counter() - startTime
+
+    print("%d runs in %.3f s  %.0f runs/s" % (runs, elapsed, runs / elapsed if elapsed else 0), file=sys.stderr)
+
+    return runs
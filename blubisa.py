@@ -0,0 +1,50 @@
+# Add arithmetic instructions to the Machine objects that run Program objects written in "Blub" assembly
+# language. Each instruction is declared once as a blubvm.Operation object, which gives the kinds of its
+# operands and the function that works out the value of its first register, so that it is checked and decoded
+# with the rest of the program and run as quickly as the base instructions.
+
+# Assumptions made prior to code writing:
+#   Instructions ending in 'i' take an immediate value as their last operand, just like the base instructions.
+#
+#   Just like add, an instruction whose result does not fit in a register raises an OverflowError rather than
+#   wrapping around.
+#
+#   A shift shifts by the lowest 8 bits of its amount, whether it is a register or an immediate value, the way
+#   a 32-bit ARM processor does, so a negative amount is a large shift rather than a shift the other way, and
+#   a huge immediate value is never used to build a huge number.
+
+# To work out the values, we require the operator module.
+import operator
+
+# To declare the instructions, import the blubvm module.
+import blubvm
+
+
+# Shift a value left by the lowest 8 bits of an amount.
+def lsl(value, amount):
+    return value << (amount & 0xFF)
+
+
+# Initialize a dictionary of the arithmetic instructions and their declarations. These are the instructions
+# added by the --extend option of blubvm.py when it is given this module.
+instructions = {'mul': blubvm.Operation('rrr', operator.mul),
+                'sub': blubvm.Operation('rrr', operator.sub),
+                'subi': blubvm.Operation('rri', operator.sub),
+                'lsl': blubvm.Operation('rrr', lsl),
+                'lsli': blubvm.Operation('rri', lsl),
+                'xor': blubvm.Operation('rrr', operator.xor),
+                'xori': blubvm.Operation('rri', operator.xor)}
+
+
+# Add the arithmetic instructions to a Machine object.
+def extend(aMachine, added=None):
+    """
+    Adds instructions to a Machine object.
+
+    :param aMachine: The Machine object.
+    :param added: A dictionary of instruction names and their blubvm.Operation objects, or None for the
+                  arithmetic instructions of this module.
+    """
+
+    for (instrName, anOperation) in (instructions if added is None else added).items():
+        aMachine[instrName] = anOperation
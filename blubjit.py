@@ -0,0 +1,409 @@
+# Compile Program objects written in "Blub" assembly language into Python source code and run it.
+# The program is split into basic blocks, each of which becomes one Python function that keeps the
+# registers it uses in local variables. The functions return the line number of the next block to run,
+# so running the program is a loop over a small state machine rather than over single instructions.
+
+# Assumptions made prior to code writing:
+#   A basic block starts at the first line of the program, at every line with a label, and at every line
+#   following a branch. It ends with a branch or right before the start of the next block.
+#
+#   Registers are written back to the machine at the end of every block, which is where a value that
+#   does not fit in a register raises an OverflowError (the interpreter raises it at the instruction
+#   that produced the value). A block that loops, or that writes over the value before it ends, stores such
+#   a value as soon as it is worked out instead, so that it cannot go on looping with it or lose it. Such a
+#   value is also stored before the block prints, reads or writes the data memory or calls an added
+#   instruction, so that nothing is printed or stored before the OverflowError is raised.
+#
+#   Instructions added to a Machine object that are called with the machine can change the program counter
+#   in ways that cannot be known ahead of time, so programs using them are run by the decoded interpreter
+#   instead. Instructions that only work out the value of a register call their function in the block.
+
+# To find and store cached source code, we require the os, hashlib and tempfile modules.
+import os
+import hashlib
+import tempfile
+
+# To access the opcodes of the decoded form of a program, import the blubvm module.
+import blubvm
+
+
+# The version of the generated source code. It is part of the cache key, so changing the code generator
+# should change this number too.
+JIT_VERSION = 8
+
+# The opcodes of the branch instructions, and the Python expression each conditional branch tests.
+branchOps = {blubvm.OP_B, blubvm.OP_BGT, blubvm.OP_BGE, blubvm.OP_BEQ, blubvm.OP_BNE, blubvm.OP_BLE,
+             blubvm.OP_BLT}
+conditionSource = {blubvm.OP_BGT: "cl > cr", blubvm.OP_BGE: "cl >= cr", blubvm.OP_BEQ: "cl == cr",
+                   blubvm.OP_BNE: "cl != cr", blubvm.OP_BLE: "cl <= cr", blubvm.OP_BLT: "cl < cr"}
+
+# The opcodes that compare a register with an immediate value. A compare-and-branch is compiled as a plain
+# compare, since the branch it was fused with is still on the next line.
+compareOps = {blubvm.OP_CMPI, blubvm.OP_CMPBGT, blubvm.OP_CMPBGE, blubvm.OP_CMPBEQ, blubvm.OP_CMPBNE,
+              blubvm.OP_CMPBLE, blubvm.OP_CMPBLT}
+
+# The functions of the blubvm module that load and store the data memory, for each opcode that does.
+memoryLoads = {blubvm.OP_LDR: 'loadWord', blubvm.OP_LDRB: 'loadByte'}
+memoryStores = {blubvm.OP_STR: 'storeWord', blubvm.OP_STRB: 'storeByte'}
+
+# The arguments each opcode of an added instruction calls its function with. See blubvm.Operation.
+callArguments = {blubvm.OP_CALLRRR: "r%(b)d, r%(c)d", blubvm.OP_CALLRRI: "r%(b)d, %(c)d",
+                 blubvm.OP_CALLRR: "r%(b)d", blubvm.OP_CALLRI: "%(b)d"}
+
+# The largest value that fits in a register.
+maxRegister = 2 ** 31 - 1
+
+# The largest block that is appended to the block before it.
+maxAppended = 16
+
+
+# Get the directory in which generated source code is cached.
+def cacheDirectory():
+    """
+    Get the directory in which compiled programs are cached. It is taken from the BLUB_CACHE_DIR
+    environment variable if it is set, and is a 'blub' directory in the user's cache directory otherwise.
+
+    :return: The path to the cache directory.
+    """
+
+    return os.environ.get('BLUB_CACHE_DIR',
+                          os.path.join(os.path.expanduser('~'), '.cache', 'blub'))
+
+
+# Find the line numbers at which the basic blocks of a decoded program start.
+def findLeaders(aProgram, decoded, entry=1):
+    """
+    Finds the first line of every basic block of a program.
+
+    :param aProgram: The Program object the decoded program came from.
+    :param decoded: The decoded form of the program, as returned by Machine.decode.
+    :param entry: The line a reset machine starts at, after the movi instructions the program starts with.
+                  See blubvm.Machine.startState.
+    :return: A sorted list of the line numbers at which a block starts.
+    """
+
+    # The first line, the line a reset machine starts at and every labelled line start a block.
+    leaders = {1, entry}
+    leaders.update(aProgram.labelLocator.values())
+
+    # So does every branch target and every line following a branch.
+    for pc in range(1, len(decoded) - 1):
+        op, a, b, c = decoded[pc]
+        if op in branchOps:
+            leaders.add(a)
+            leaders.add(pc + 1)
+
+    # The halt line after the last line of the program is where the state machine stops, not a block.
+    return sorted(x for x in leaders if x < len(decoded) - 1)
+
+
+# Get the registers a decoded instruction writes.
+def writtenBy(op, a, b, c):
+    if op == blubvm.OP_POPCNT:
+        return {a, b, c}
+    if op in callArguments:
+        return {a & 31}
+    if op in (blubvm.OP_ADD, blubvm.OP_ANDI, blubvm.OP_LSRI, blubvm.OP_MOVI) or op in memoryLoads:
+        return {a}
+    return set()
+
+
+# Generate the source code of a single basic block.
+def generateBlock(decoded, start, lines):
+    """
+    Generates the Python source code of the function that runs a basic block of a decoded program. The
+    block may have the block it is followed by appended to it, and when it ends by going back to its own
+    first line the function loops over it without returning.
+
+    :param decoded: The decoded form of the program.
+    :param start: The first line of the block.
+    :param lines: The line numbers of the instructions run by the function, in order.
+    :return: The source code of the function as a list of lines.
+    """
+
+    body = []
+    used = set()
+    written = set()
+    functions = set()
+    usesCompare = False
+    setsCompare = False
+
+    # Work out where the block goes once its last instruction has run. A branch back to the first line
+    # of the block continues the loop around the block instead of returning.
+    op, a, b, c = decoded[lines[-1]]
+    taken = a if op in branchOps else None
+    following = None if op == blubvm.OP_B else lines[-1] + 1
+    loops = start in (taken, following)
+
+    # Work out the registers written after each line of the block, the last line first.
+    writtenAfter = [set()]
+    for pc in reversed(lines[1:]):
+        writtenAfter.append(writtenAfter[-1] | writtenBy(*decoded[pc]))
+    writtenAfter.reverse()
+
+    # A block that loops may never leave if a value does not fit in its register, and a value that is written
+    # over before the end of the block is never written back, so in either case a value that may not fit is
+    # stored in the registers as soon as it is worked out, which raises the OverflowError the interpreter
+    # raises. Otherwise it is stored before the next instruction whose effects are seen outside the block.
+    unchecked = set()
+
+    def check(reg):
+        if loops or reg in writtenAfter[position]:
+            body.append("R[%d] = r%d" % (reg, reg))
+            unchecked.discard(reg)
+        else:
+            unchecked.add(reg)
+
+    def checkAll():
+        body.extend("R[%d] = r%d" % (reg, reg) for reg in sorted(unchecked))
+        unchecked.clear()
+
+    for (position, pc) in enumerate(lines):
+        op, a, b, c = decoded[pc]
+
+        if op == blubvm.OP_ADD:
+            body.append("r%d = r%d + r%d" % (a, b, c))
+            check(a)
+            used.update((a, b, c))
+            written.add(a)
+
+        elif op == blubvm.OP_ANDI:
+            body.append("r%d = r%d & %d" % (a, b, c))
+            if c > maxRegister:
+                check(a)
+            used.update((a, b))
+            written.add(a)
+
+        elif op == blubvm.OP_LSRI:
+            body.append("r%d = r%d >> %d" % (a, b, c))
+            used.update((a, b))
+            written.add(a)
+
+        elif op == blubvm.OP_MOVI:
+            body.append("r%d = %d" % (a, b))
+            if b > maxRegister:
+                check(a)
+            used.add(a)
+            written.add(a)
+
+        elif op == blubvm.OP_PRNT:
+            checkAll()
+            body.append("emit(r%d); S[1] += 1" % a)
+            used.add(a)
+
+        elif op == blubvm.OP_POPCNT:
+            # Count the bits just like the popcnt function.
+            body.append("if r%d > 0: r%d = r%d + r%d.bit_count(); r%d = 1; r%d = 0" % (b, a, a, b, c, b))
+            check(a)
+            body.append("cl = r%d; cr = 0" % b)
+            used.update((a, b, c))
+            written.update((a, b, c))
+            usesCompare = setsCompare = True
+
+        elif op in memoryLoads:
+            # Loads and stores check their address just like the interpreter.
+            checkAll()
+            body.append("r%d = %s(M, r%d, %d)" % (a, memoryLoads[op], b, pc))
+            used.update((a, b))
+            written.add(a)
+
+        elif op in memoryStores:
+            checkAll()
+            body.append("%s(M, r%d, r%d, %d)" % (memoryStores[op], b, a, pc))
+            used.update((a, b))
+
+        elif op in callArguments:
+            # An added instruction calls its function, which is kept above the register in its first operand.
+            checkAll()
+            body.append("r%d = f%d(%s)" % (a & 31, a >> 5, callArguments[op] % {'b': b, 'c': c}))
+            check(a & 31)
+            used.add(a & 31)
+            if op != blubvm.OP_CALLRI:
+                used.add(b)
+            if op == blubvm.OP_CALLRRR:
+                used.add(c)
+            written.add(a & 31)
+            functions.add(a >> 5)
+
+        elif op in compareOps:
+            # Compare keeps the two values it compares, just like the cmpi function.
+            body.append("cl = r%d; cr = %d" % (a, b))
+            used.add(a)
+            usesCompare = setsCompare = True
+
+        elif op in conditionSource:
+            usesCompare = True
+
+    op, a, b, c = decoded[lines[-1]]
+
+    # Leaving the block writes back the registers and compare it changed and counts the instructions run.
+    def leave(target):
+        if target == start:
+            return ["continue"]
+        return (["R[%d] = r%d" % (reg, reg) for reg in sorted(written)]
+                + (["C[0] = cl; C[1] = cr"] if setsCompare else [])
+                + ["S[0] += %s" % (("k * %d" % len(lines)) if loops else len(lines)),
+                   "return %d" % target])
+
+    if op in conditionSource:
+        body.append("if %s:" % conditionSource[op])
+        body += ["    " + line for line in leave(taken)]
+        body += leave(following)
+    else:
+        body += leave(taken if op == blubvm.OP_B else following)
+
+    # A loop that goes on with its next iteration at the end of its body needs no continue statement.
+    if body[-1] == "continue":
+        body.pop()
+
+    # Every register the block uses is loaded when it starts, so that the ones it changes can be written
+    # back from any of its exits.
+    source = ["def block%d(R=R, C=C, S=S, M=M, emit=emit%s):"
+              % (start, "".join(", f%d=F[%d]" % (index, index) for index in sorted(functions)))]
+    source += ["    r%d = R[%d]" % (reg, reg) for reg in sorted(used)]
+    if usesCompare:
+        source.append("    cl, cr = C")
+    if loops:
+        source += ["    k = 0", "    while True:", "        k += 1"]
+        source += ["        " + line for line in body]
+    else:
+        source += ["    " + line for line in body]
+
+    return source
+
+
+# Generate the source code of a whole program.
+def generateSource(aProgram, decoded, entry=1):
+    """
+    Generates the Python source code of a program. It defines one function per basic block, the BLOCKS
+    list that maps the first line of a block to its function, and a run function that runs blocks until
+    the program runs past its last line.
+
+    :param aProgram: The Program object the decoded program came from.
+    :param decoded: The decoded form of the program, as returned by Machine.decode.
+    :param entry: The line a reset machine starts at, see findLeaders.
+    :return: The source code as a string.
+    """
+
+    end = len(decoded) - 1
+    leaders = findLeaders(aProgram, decoded, entry)
+    bounds = dict(zip(leaders, leaders[1:] + [end]))
+
+    source = ["# Generated from a blub program by blubjit version %d." % JIT_VERSION]
+    for (start, stop) in bounds.items():
+        lines = list(range(start, stop))
+
+        # A block that always goes on to another small block has that block appended to it. This turns
+        # the body of a loop followed by its test into a single function that can loop by itself.
+        op, a, b, c = decoded[stop - 1]
+        following = a if op == blubvm.OP_B else (None if op in branchOps else stop)
+        if following in bounds and following != start and bounds[following] - following <= maxAppended:
+            lines += range(following, bounds[following])
+
+        source += generateBlock(decoded, start, lines)
+
+    blocks = ["None"] * (end + 1)
+    for start in bounds:
+        blocks[start] = "block%d" % start
+
+    source.append("BLOCKS = [%s]" % ", ".join(blocks))
+    source.append("END = %d" % end)
+    source.append("def run(pc, blocks=BLOCKS, end=END):")
+    source.append("    while pc != end:")
+    source.append("        pc = blocks[pc]()")
+
+    return "\n".join(source) + "\n"
+
+
+# Get the source code of a program, from the cache if it has been generated before.
+def loadSource(aProgram, decoded, cacheDir=None, entry=1):
+    """
+    Gets the generated source code of a program. The source is cached on disk under a hash of the
+    program and its decoded form, so repeat runs of the same program skip code generation. The decoded form
+    is part of the hash because the same program decodes differently on machines with added or replaced
+    instructions.
+
+    :param aProgram: The Program object the decoded program came from.
+    :param decoded: The decoded form of the program, as returned by Machine.decode.
+    :param cacheDir: The directory to cache source code in, or None for the default cache directory.
+    :param entry: The line a reset machine starts at, see findLeaders.
+    :return: The source code as a string.
+    """
+
+    cacheDir = os.path.join(cacheDir or cacheDirectory(), 'jit')
+    key = hashlib.sha256(("%d\n%d\n%s\n%r" % (JIT_VERSION, entry, aProgram, decoded)).encode()).hexdigest()
+    path = os.path.join(cacheDir, key + '.py')
+
+    # Use the cached source if there is one.
+    try:
+        with open(path) as cached:
+            return cached.read()
+    except OSError:
+        pass
+
+    source = generateSource(aProgram, decoded, entry)
+
+    # Write the source to a temporary file first and then move it into place, so that another process
+    # never reads a partly written file. Failing to cache is not an error.
+    try:
+        os.makedirs(cacheDir, exist_ok=True)
+        handle, tempPath = tempfile.mkstemp(dir=cacheDir, suffix='.tmp')
+        with os.fdopen(handle, 'w') as tempFile:
+            tempFile.write(source)
+        os.replace(tempPath, path)
+    except OSError:
+        pass
+
+    return source
+
+
+# Run a Machine object's program with compiled basic blocks.
+def run(aMachine, cacheDir=None):
+    """
+    Runs the program of a Machine object from its current program counter until it runs past its last
+    line, using the compiled form of the program. Programs that cannot be compiled, and runs that do not
+    start at the beginning of a block, are run by the decoded interpreter instead.
+
+    :param aMachine: The Machine object to run.
+    :param cacheDir: The directory to cache source code in, or None for the default cache directory.
+    """
+
+    # Decode the program if it has not been decoded already.
+    if aMachine.decoded is None:
+        aMachine.decoded = aMachine.decode()
+    decoded = aMachine.decoded
+
+    if aMachine.extensions:
+        aMachine.interpret()
+        return
+
+    # Bind the compiled functions to the registers, compare, instruction count, print count and data memory of
+    # this machine, unless they were bound by an earlier run with the same program, registers, output and memory.
+    bound = (decoded, aMachine.registers, aMachine.output, aMachine.memory)
+    if aMachine.compiledCode is None or any(x is not y for (x, y) in zip(bound, aMachine.compiledCode)):
+        counter = [0, 0]
+        compared = [0, -1]
+        namespace = {'R': aMachine.registers, 'C': compared, 'S': counter, 'M': aMachine.memoryOrEmpty(),
+                     'F': aMachine.functions,
+                     'emit': aMachine.output, 'loadWord': blubvm.loadWord, 'storeWord': blubvm.storeWord,
+                     'loadByte': blubvm.loadByte, 'storeByte': blubvm.storeByte}
+        # A reset machine starts after the movi instructions the program starts with, which starts a block too.
+        entry = aMachine.startState()[0]
+        exec(compile(loadSource(aMachine.code, decoded, cacheDir, entry), '<blubjit>', 'exec'), namespace)
+        aMachine.compiledCode = bound + (set(findLeaders(aMachine.code, decoded, entry)), counter, compared,
+                                         namespace['run'])
+
+    leaders, counter, compared, runBlocks = aMachine.compiledCode[4:]
+    if aMachine.pc not in leaders:
+        aMachine.interpret()
+        return
+
+    counter[:] = [aMachine.steps, aMachine.printed]
+    compared[:] = [aMachine.cmpLeft, aMachine.cmpRight]
+
+    runBlocks(aMachine.pc)
+
+    aMachine.pc = len(decoded) - 1
+    aMachine.steps = counter[0]
+    aMachine.printed = counter[1]
+    aMachine.cmpLeft, aMachine.cmpRight = compared
@@ -0,0 +1,351 @@
+# Fast-forward the counting loops of Program objects written in "Blub" assembly language.
+# A counting loop is a loop made of a single compare-and-branch and a few arithmetic instructions, with no
+# output, whose number of runs and whose effect on the registers can be worked out from the registers it
+# starts with. Such loops, like shifting a register until it is zero, adding to a register until it reaches a
+# bound, or counting the bits of a register, are run by the interpreter in a few Python operations instead of
+# one step per instruction.
+
+# Assumptions made prior to code writing:
+#   A loop either tests its register at the top, with a compare-and-branch out of the loop and a branch back
+#   at the bottom, or at the bottom, with a compare-and-branch back to the top. Its body is made of add,
+#   andi, lsri and movi instructions only.
+#
+#   The loop register is changed once per run of the body, by shifting it right or by adding a register the
+#   loop does not change. Every other register the loop changes is changed once per run of the body, by
+#   moving a value into it, by adding a register the loop does not change, by taking a value from the loop
+#   register, or by adding the lowest bit of the loop register to it.
+#
+#   A fast-forwarded loop leaves the registers, the compare, the program counter and the number of
+#   instructions run just as running it one step at a time would, including where a run with a limit on the
+#   number of instructions stops. When this cannot be worked out ahead of time, because the loop would never
+#   end, would overflow a register, or shifts a negative value, the loop is run one step at a time as usual.
+
+# To test the conditions of the compare-and-branches, we require the operator module.
+import operator
+
+# To access the opcodes of the decoded form of a program, import the blubvm module.
+import blubvm
+
+
+# Initialize a dictionary of the compare-and-branch opcodes and the tests they make.
+compareTests = {blubvm.OP_CMPBGT: operator.gt, blubvm.OP_CMPBGE: operator.ge, blubvm.OP_CMPBEQ: operator.eq,
+                blubvm.OP_CMPBNE: operator.ne, blubvm.OP_CMPBLE: operator.le, blubvm.OP_CMPBLT: operator.lt}
+
+# Initialize a dictionary of each test and the test that is true whenever it is false.
+oppositeTests = {operator.gt: operator.le, operator.ge: operator.lt, operator.eq: operator.ne,
+                 operator.ne: operator.eq, operator.le: operator.gt, operator.lt: operator.ge}
+
+# The opcodes a loop body may be made of.
+bodyOpcodes = {blubvm.OP_ADD, blubvm.OP_ANDI, blubvm.OP_LSRI, blubvm.OP_MOVI}
+
+# The smallest and largest values that fit in a register.
+minRegister = -2 ** 31
+maxRegister = 2 ** 31 - 1
+
+
+# Work out the value an andi or lsri instruction gives for a value.
+def applyImmediate(op, value, immediate):
+    return value & immediate if op == blubvm.OP_ANDI else value >> immediate
+
+
+# Write the CountingLoop class to fast-forward a single loop.
+class CountingLoop:
+    """
+    A class that represents a counting loop of a decoded program, and runs any number of its runs at once.
+    """
+
+    # Class constructor
+    def __init__(self, head, top, end, op, register, bound, target, topTest, update, step, effects):
+        """
+        The constructor for the CountingLoop class.
+
+        :param head: The line of the compare-and-branch that tests the loop register.
+        :param top: The first line of the loop.
+        :param end: The line of the branch back to the top of the loop.
+        :param op: The opcode of the compare-and-branch.
+        :param register: The loop register.
+        :param bound: The value the loop register is compared with.
+        :param target: The line the compare-and-branch branches to.
+        :param topTest: True if the loop is left when the compare-and-branch at its top is taken, False if the
+                        loop carries on when the compare-and-branch at its bottom is taken.
+        :param update: The opcode that changes the loop register: OP_LSRI or OP_ADD.
+        :param step: The number of bits shifted by an OP_LSRI update, or the register added by an OP_ADD one.
+        :param effects: A list of what the body does to every other register it changes, as tuples of a kind
+                        and the destination register followed by the values needed to work it out.
+        """
+
+        self.head = head
+        self.top = top
+        self.end = end
+        self.register = register
+        self.bound = bound
+        self.target = target
+        self.topTest = topTest
+        self.update = update
+        self.step = step
+        self.effects = effects
+
+        # Initialize the test made by the compare-and-branch, and the number of instructions a run of the loop
+        # adds up to, counting the compare and branch as two.
+        self.compare = compareTests[op]
+        self.length = end - top + (1 if topTest else 2)
+
+
+    # Class methods
+
+    # Get the value of the loop register after a number of runs of the body.
+    def valueAfter(self, value, runs, registers):
+        if self.update == blubvm.OP_LSRI:
+            return value >> (self.step * runs)
+        return value + runs * registers[self.step]
+
+
+    # Tell whether the loop is left when the loop register has a value.
+    def leaves(self, value):
+        return self.compare(value, self.bound) == self.topTest
+
+
+    # Work out how many times the body runs before the loop is left.
+    def tripCount(self, value, registers):
+        """
+        Works out the number of times the body of the loop runs before the loop is left, given the value of
+        the loop register at the next test.
+
+        :param value: The value of the loop register at the next test.
+        :param registers: The registers of the machine.
+        :return: The number of times the body runs, or None if the loop never ends.
+        """
+
+        if self.update == blubvm.OP_LSRI:
+            # A shifted value reaches zero after at most as many runs as it has bits, and then stays there.
+            runs = 0
+            while not self.leaves(value):
+                if value == 0:
+                    return None
+                value >>= self.step
+                runs += 1
+            return runs
+
+        # An added register moves the loop register by the same step every run, so the test is solved for
+        # the first run at which it leaves the loop.
+        step = registers[self.step]
+        if self.leaves(value):
+            return 0
+        if step == 0:
+            return None
+
+        runs = None
+        distance = self.bound - value
+        leaveTest = self.compare if self.topTest else oppositeTests[self.compare]
+
+        if leaveTest is operator.eq:
+            if distance % step == 0 and distance // step > 0:
+                runs = distance // step
+        elif leaveTest is operator.ne:
+            runs = 1
+        elif step > 0 and leaveTest in (operator.gt, operator.ge):
+            # The first value past the bound, or at it.
+            runs = distance // step + 1 if leaveTest is operator.gt else -(-distance // step)
+        elif step < 0 and leaveTest in (operator.lt, operator.le):
+            runs = distance // step + 1 if leaveTest is operator.lt else -(-distance // step)
+
+        return runs
+
+
+    # Run the loop from its test.
+    def run(self, registers, pc, start, steps, stopAt):
+        """
+        Runs the loop from its compare-and-branch until it is left, or until the instruction limit of the run
+        is reached at one of its branches.
+
+        :param registers: The registers of the machine, which are changed in place.
+        :param pc: The line of the compare-and-branch.
+        :param start: The first line of the block being run.
+        :param steps: The number of instructions run before the block.
+        :param stopAt: The number of instructions at which the run stops.
+        :return: A tuple of the new program counter, block start, number of instructions run and the two values
+                 of the last compare, or None if the loop has to be run one step at a time.
+        """
+
+        value = registers[self.register]
+        if self.update == blubvm.OP_LSRI and value < 0:
+            return None
+
+        trips = self.tripCount(value, registers)
+        if not trips:
+            return None
+
+        # The branches taken are the branches back at the bottom of a loop tested at the top, and the
+        # compare-and-branch of a loop tested at the bottom. The first one also counts the block the loop
+        # was entered from. The run stops at the first branch taken at or past its limit, like the
+        # interpreter does.
+        first = (self.end if self.topTest else pc) - start + (1 if self.topTest else 2)
+        stopped = steps + first + (trips - 1) * self.length >= stopAt
+        taken = max(1, -(-(stopAt - steps - first) // self.length) + 1) if stopped else trips
+
+        # A loop tested at the bottom that is stopped at its branch back has not run its body again yet.
+        runs = taken - 1 if stopped and not self.topTest else taken
+        values = self.registersAfter(value, runs, registers)
+        if values is None:
+            return None
+        for (reg, aValue) in values:
+            registers[reg] = aValue
+
+        steps += first + (taken - 1) * self.length
+        if stopped:
+            return self.top, self.top, steps, self.valueAfter(value, taken - 1, registers), self.bound
+
+        left = self.valueAfter(value, trips, registers)
+        if self.topTest:
+            return self.target, self.target, steps + 2, left, self.bound
+        return self.end + 2, self.top, steps, left, self.bound
+
+
+
+    # Work out the registers changed by a number of runs of the body.
+    def registersAfter(self, value, runs, registers):
+        """
+        Works out the values of the registers the body of the loop changes after it runs a number of times.
+
+        :param value: The value of the loop register before the first of the runs.
+        :param runs: The number of runs.
+        :param registers: The registers of the machine.
+        :return: A list of the registers and their new values, or None if one of them would overflow.
+        """
+
+        if runs == 0:
+            return []
+
+        values = [(self.register, self.valueAfter(value, runs, registers))]
+
+        for (kind, reg, *details) in self.effects:
+            if kind == 'set':
+                # A value moved in, or worked out from registers the loop does not change.
+                op, source, immediate = details
+                aValue = immediate if op == blubvm.OP_MOVI \
+                    else registers[source] + registers[immediate] if op == blubvm.OP_ADD \
+                    else applyImmediate(op, registers[source], immediate)
+            elif kind == 'sum':
+                aValue = registers[reg] + runs * registers[details[0]]
+            elif kind == 'derived':
+                # A value taken from the loop register in the last run, before or after it was changed.
+                op, immediate, afterUpdate = details
+                aValue = applyImmediate(op, self.valueAfter(value, runs if afterUpdate else runs - 1, registers),
+                                        immediate)
+            else:
+                # The lowest bits of the loop register, one taken out by each run as it is shifted down.
+                afterUpdate = details[0]
+                aValue = registers[reg] + ((value >> afterUpdate) & ((1 << runs) - 1)).bit_count()
+
+            values.append((reg, aValue))
+
+        if any(not (minRegister <= aValue <= maxRegister) for (reg, aValue) in values):
+            return None
+
+        return values
+
+
+
+# Work out whether a line of a decoded program is the test of a counting loop.
+def findLoop(decoded, pc):
+    """
+    Checks whether the compare-and-branch on a line of a decoded program tests a counting loop.
+
+    :param decoded: The list of decoded instructions, as returned by Machine.decode.
+    :param pc: The line of the compare-and-branch.
+    :return: A CountingLoop object, or None if the line does not test a counting loop.
+    """
+
+    op, register, bound, target = decoded[pc]
+
+    # A loop tested at the top is left by a branch forward past its branch back. A loop tested at the bottom
+    # branches back to its top.
+    if target > pc:
+        topTest = True
+        top = pc
+        end = pc + 2
+        while decoded[end][0] in bodyOpcodes:
+            end += 1
+        if decoded[end][:2] != (blubvm.OP_B, pc) or target <= end:
+            return None
+        body = decoded[pc + 2:end]
+    else:
+        topTest = False
+        top = target
+        end = pc
+        body = decoded[top:end]
+        if not body or any(op not in bodyOpcodes for (op, a, b, c) in body):
+            return None
+
+    # Every register the body changes is changed once.
+    written = [a for (op, a, b, c) in body]
+    if len(set(written)) != len(written) or not (register in written):
+        return None
+
+    def unchanged(reg):
+        return not (reg in written)
+
+    # The loop register is shifted right, or has a register the loop does not change added to it.
+    updateAt = written.index(register)
+    op, a, b, c = body[updateAt]
+    if op == blubvm.OP_LSRI and b == register and c > 0:
+        update, step = op, c
+    elif op == blubvm.OP_ADD and register in (b, c) and unchanged(c if b == register else b):
+        update, step = op, c if b == register else b
+    else:
+        return None
+
+    effects = []
+    for (position, (op, a, b, c)) in enumerate(body):
+        if a == register:
+            continue
+
+        if op == blubvm.OP_MOVI:
+            effects.append(('set', a, op, 0, b))
+        elif op == blubvm.OP_ADD and unchanged(b) and unchanged(c):
+            effects.append(('set', a, op, b, c))
+        elif op != blubvm.OP_ADD and unchanged(b):
+            effects.append(('set', a, op, b, c))
+        elif op != blubvm.OP_ADD and b == register:
+            effects.append(('derived', a, op, c, position > updateAt))
+        elif op == blubvm.OP_ADD and a in (b, c) and unchanged(c if b == a else b):
+            effects.append(('sum', a, c if b == a else b))
+        elif op == blubvm.OP_ADD and a in (b, c):
+            # The lowest bit of the loop register, taken out earlier in the same run while it is shifted
+            # down one bit at a time.
+            bitReg = c if b == a else b
+            bitAt = written.index(bitReg)
+            bitOp, bitA, bitB, bitC = body[bitAt]
+            if not (bitOp == blubvm.OP_ANDI and bitB == register and bitC == 1 and bitAt < position
+                    and update == blubvm.OP_LSRI and step == 1):
+                return None
+            effects.append(('bits', a, int(bitAt > updateAt)))
+        else:
+            return None
+
+    return CountingLoop(pc, top, end, decoded[pc][0], register, bound, target, topTest, update, step, effects)
+
+
+# Find the counting loops of a decoded program.
+def findLoops(decoded):
+    """
+    Finds the counting loops of a decoded program, and marks their tests so that the interpreter runs them
+    with a CountingLoop object.
+
+    :param decoded: The list of decoded instructions, as returned by Machine.decode. It is not changed.
+    :return: A tuple of a copy of the decoded instructions in which the compare-and-branch of every counting
+             loop is replaced by an OP_LOOP instruction, and a list of the CountingLoop objects those
+             instructions refer to.
+    """
+
+    code = list(decoded)
+    loops = []
+
+    for (pc, (op, a, b, c)) in enumerate(decoded):
+        if op in compareTests:
+            aLoop = findLoop(decoded, pc)
+            if aLoop is not None:
+                code[pc] = (blubvm.OP_LOOP, len(loops), 0, 0)
+                loops.append(aLoop)
+
+    return code, loops
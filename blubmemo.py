@@ -0,0 +1,293 @@
+# Remember the results of running Program objects written in "Blub" assembly language.
+# A program that only uses the instructions every Machine object starts with is a function of the state it
+# starts in: its registers, compare and program counter. The values it prints and the state it ends in are
+# kept in a cache under a checkpoint of its starting state, so a program run again from the same state is
+# not run at all, and its values are printed from the cache instead.
+
+# Assumptions made prior to code writing:
+#   Instructions added to a Machine object may do anything, and the same instruction may be added with a
+#   different function to another machine or between runs, and the data memory is read and written by more
+#   than the program, so programs that use either are always run. Base instructions replaced by added ones are
+#   added instructions too. See blubvm.Operation.
+#
+#   Only whole runs are cached, not runs stopped by a limit on the number of instructions.
+#
+#   The cache keeps the most recently used results in memory, up to a number of results, and may also keep
+#   them on disk, up to a number of bytes, so that they are shared between processes and runs. The results
+#   used the longest time ago are removed first from both.
+#
+#   Printed values are the values of registers, so they are kept as 32-bit integers.
+#
+#   The values printed by a run are collected by a Collector object that stands in for the output of the
+#   machine from its first run on, so that the engines that compile the program along with its output only
+#   compile it once rather than for every run that is not cached.
+
+# To keep the results in memory in the order they were used, we require the OrderedDict class of the
+# collections module. To keep them on disk, we require the os, hashlib, tempfile, struct and array modules.
+from collections import OrderedDict
+import os
+import hashlib
+import tempfile
+import struct
+import array
+
+# To run and checkpoint programs, import the blubvm module. The results are kept next to the programs cached
+# by the blubcache module.
+import blubvm
+import blubcache
+
+
+# The first bytes of every cached result file, and the version of its format.
+MAGIC = b'BLUBMEMO'
+FORMAT_VERSION = 1
+
+# The header of a cached result file: the magic bytes, the format version and the number of values printed.
+# It is followed by the checkpoints of the state the run started and ended in, and the values printed.
+header = struct.Struct('<8sHxxI')
+
+# The default largest number of results kept in memory, and the default largest size of the results kept on
+# disk in bytes.
+defaultMaxEntries = 4096
+defaultMaxBytes = 64 * 1024 * 1024
+
+# The opcodes of the instructions whose results do not only depend on the state a program starts in: the
+# ones that load and store the data memory, and added instructions.
+impureOps = blubvm.memoryOps | set(blubvm.callOpcodes.values())
+
+
+# Get the directory in which results are cached.
+def cacheDirectory():
+    """
+    Get the directory in which the results of runs are cached, next to the directory of cached programs.
+
+    :return: The path to the cache directory.
+    """
+
+    return os.path.join(blubcache.cacheDirectory(), 'results')
+
+
+
+# Write the Collector class to collect the values a machine prints.
+class Collector:
+    """
+    A class that stands in for the output of a Machine object, passing every value printed on to the output
+    it replaced and collecting the values printed while a run is being cached.
+    """
+
+    # Class constructor
+    def __init__(self, output):
+        """
+        The constructor for the Collector class.
+
+        :param output: The output of the machine, which every value printed is passed on to.
+        """
+
+        self.output = output
+
+        # Initialize a variable to store the array the values printed are collected in, or None when they are
+        # not being collected.
+        self.printed = None
+
+
+    # Class methods
+
+    # Pass a value printed on to the output, collecting it if a run is being cached.
+    def __call__(self, value):
+        if self.printed is not None:
+            self.printed.append(value)
+        self.output(value)
+
+
+
+# Write the ResultCache class to run programs through a cache of their results.
+class ResultCache:
+    """
+    A class that runs Machine objects, running each program from each starting state only the first time it
+    is seen and replaying its results after that.
+    """
+
+    # Class constructor
+    def __init__(self, maxEntries=defaultMaxEntries, cacheDir=None, maxBytes=defaultMaxBytes):
+        """
+        The constructor for the ResultCache class.
+
+        :param maxEntries: The largest number of results kept in memory.
+        :param cacheDir: The directory to keep results in on disk, or None to keep them in memory only.
+        :param maxBytes: The largest size of the results kept on disk in bytes.
+        """
+
+        self.maxEntries = maxEntries
+        self.cacheDir = cacheDir
+        self.maxBytes = maxBytes
+
+        # Initialize a dictionary of the results kept in memory, from the least to the most recently used. Each
+        # is kept under the checkpoint of the state the run started in, as a tuple of the checkpoint of the
+        # state it ended in and an array of the values printed.
+        self.results = OrderedDict()
+
+        # Initialize a variable to store the decoded program last checked by isPure, and whether it uses the
+        # data memory or added instructions.
+        self.checked = None
+
+        # Initialize counts of the runs replayed from the cache and of the ones that had to be run.
+        self.hits = 0
+        self.misses = 0
+
+
+    # Class methods
+
+    # Check whether the results of a machine's program can be cached.
+    def isPure(self, aMachine):
+        """
+        Checks whether the program of a Machine object is a function of the state it starts in, which is the
+        case when it only uses the instructions every Machine object starts with, apart from the ones that
+        load and store the data memory.
+
+        :param aMachine: The Machine object.
+        :return: True if the results of the program can be cached, False otherwise.
+        """
+
+        if aMachine.decoded is None:
+            aMachine.decoded = aMachine.decode()
+
+        # The program is only looked through again when it is not the one looked through last.
+        if self.checked is None or self.checked[0] is not aMachine.decoded:
+            self.checked = (aMachine.decoded, not any(op in impureOps for (op, a, b, c) in aMachine.decoded))
+
+        return not aMachine.extensions and self.checked[1]
+
+
+    # Get the name of the file a result is kept in on disk.
+    def pathOf(self, key):
+        return os.path.join(self.cacheDir, hashlib.sha256(key).hexdigest() + '.bin')
+
+
+    # Get a result from memory or from disk.
+    def get(self, key):
+        """
+        Gets the result of a run from the state a checkpoint was taken of, marking it as the most recently used.
+
+        :param key: The checkpoint of the state the run started in.
+        :return: A tuple of the checkpoint of the state the run ended in and an array of the values printed,
+                 or None if the run has not been cached.
+        """
+
+        result = self.results.get(key)
+        if result is not None:
+            self.results.move_to_end(key)
+            return result
+
+        if self.cacheDir is None:
+            return None
+
+        # Read the result from disk, and keep it in memory as well. A damaged file is treated as missing.
+        path = self.pathOf(key)
+        try:
+            with open(path, 'rb') as theFile:
+                data = theFile.read()
+            os.utime(path)
+        except OSError:
+            return None
+
+        size = blubvm.checkpointLayout.size
+        if len(data) < header.size:
+            return None
+        magic, formatVersion, count = header.unpack_from(data)
+        if magic != MAGIC or formatVersion != FORMAT_VERSION or len(data) != header.size + 2 * size + 4 * count \
+                or data[header.size:header.size + size] != key:
+            return None
+
+        printed = array.array('i')
+        printed.frombytes(data[header.size + 2 * size:])
+        blubcache.littleEndian(printed)
+
+        result = (data[header.size + size:header.size + 2 * size], printed)
+        self.keep(key, result)
+
+        return result
+
+
+    # Keep a result in memory.
+    def keep(self, key, result):
+        self.results[key] = result
+        self.results.move_to_end(key)
+        while len(self.results) > self.maxEntries:
+            self.results.popitem(last=False)
+
+
+    # Keep a result in memory and on disk.
+    def put(self, key, result):
+        """
+        Keeps the result of a run, removing the results used the longest time ago if the cache is full.
+
+        :param key: The checkpoint of the state the run started in.
+        :param result: A tuple of the checkpoint of the state the run ended in and an array of the values
+                       printed.
+        """
+
+        self.keep(key, result)
+
+        if self.cacheDir is None:
+            return
+
+        # Write the result to a temporary file first and then move it into place, so that another process
+        # never reads a partly written file. Failing to cache is not an error.
+        final, printed = result
+        try:
+            os.makedirs(self.cacheDir, exist_ok=True)
+            handle, tempPath = tempfile.mkstemp(dir=self.cacheDir, suffix='.tmp')
+            with os.fdopen(handle, 'wb') as tempFile:
+                tempFile.write(header.pack(MAGIC, FORMAT_VERSION, len(printed)))
+                tempFile.write(key)
+                tempFile.write(final)
+                tempFile.write(blubcache.littleEndian(array.array('i', printed)).tobytes())
+            os.replace(tempPath, self.pathOf(key))
+            blubcache.evictFiles(self.cacheDir, self.maxBytes)
+        except OSError:
+            pass
+
+
+    # Run a machine through the cache.
+    def run(self, aMachine, engine=blubvm.Machine.interpret):
+        """
+        Runs the program of a Machine object from its current state until it runs past its last line. If the
+        program has been run from the same state before, the values it printed are printed again and the
+        machine is put in the state it ended in, without running it.
+
+        :param aMachine: The Machine object to run.
+        :param engine: The engine to run the program with when it is not cached, as found in blubvm.engines.
+        :return: True if the results were replayed from the cache, False if the program was run.
+        """
+
+        if not self.isPure(aMachine):
+            engine(aMachine)
+            return False
+
+        key = aMachine.checkpoint()
+        result = self.get(key)
+
+        if result is not None:
+            self.hits += 1
+            final, printed = result
+            for value in printed:
+                aMachine.output(value)
+            aMachine.restore(final)
+            return True
+
+        self.misses += 1
+
+        # Collect the values printed while passing them on as usual. The collector is only put in place of the
+        # output of the machine the first time, so that a compiled program bound to it can be run again.
+        collector = aMachine.output
+        if not isinstance(collector, Collector):
+            collector = aMachine.output = Collector(aMachine.output)
+
+        printed = collector.printed = array.array('i')
+        try:
+            engine(aMachine)
+        finally:
+            collector.printed = None
+
+        self.put(key, (aMachine.checkpoint(), printed))
+
+        return False
@@ -0,0 +1,411 @@
+# Optimize Program objects written in "Blub" assembly language before they are run.
+# The optimizer looks at a few instructions at a time and rewrites or removes the ones whose effect can be
+# worked out ahead of time, then returns a new Program object that can be printed and diffed with the
+# original.
+
+# Assumptions made prior to code writing:
+#   A labelled instruction may be branched to from anywhere, so what is known about the registers is
+#   forgotten at every label. An instruction right after a branch is only reached through the branch if it
+#   has no label.
+#
+#   Instructions the optimizer does not know, and instructions with badly formed operands, are left alone
+#   and end whatever the optimizer knows about the registers. The interpreter reports any errors in them.
+#
+#   When an instruction with a label is removed, its label moves to the next instruction. If that
+#   instruction already has a label, the branches to the removed label are changed to branch to it.
+
+# To create Program and Instruction objects, import the blub module.
+import blub
+
+
+# Get the register number of an operand.
+def registerOf(operand):
+    """
+    Get the number of the register an operand names.
+
+    :param operand: An operand string from an Instruction object.
+    :return: The register number, or None if the operand is not a register.
+    """
+
+    return int(operand[1:]) if operand[:1] == 'r' and operand[1:].isdigit() else None
+
+
+# Get the value of an immediate operand.
+def immediateOf(operand):
+    """
+    Get the value of an immediate operand.
+
+    :param operand: An operand string from an Instruction object.
+    :return: The value, or None if the operand is not an immediate value.
+    """
+
+    return int(operand) if operand.isdigit() else None
+
+
+# Write the Optimizer class to optimize a Program object.
+class Optimizer:
+    """
+    A class that runs peephole optimizations over the instructions of a Program object.
+    """
+
+    # Class variables:
+    # The forms of the operands of the instructions the optimizer knows about: 'r' for a register, 'i' for
+    # an immediate value and '' for a missing operand.
+    forms = {'movi': 'ri', 'cmpi': 'ri', 'andi': 'rri', 'lsri': 'rri', 'add': 'rrr', 'prnt': 'r'}
+
+    # The conditions a branch may have.
+    conditions = {'', 'gt', 'ge', 'eq', 'ne', 'le', 'lt'}
+
+    # The largest value a movi instruction can move into a register.
+    maxImmediate = 2 ** 31 - 1
+
+
+    # Class constructor
+    def __init__(self, aProgram):
+        """
+        The constructor for the Optimizer class.
+
+        :param aProgram: The Program object to optimize. It is not changed.
+        """
+
+        # Initialize a list of the instructions being optimized, and a dictionary of the lines removed by
+        # the current pass along with the reason each was removed.
+        self.lines = [aProgram[lineNum] for lineNum in range(1, len(aProgram) + 1)]
+        self.removed = {}
+
+        # Initialize a dictionary counting the instructions removed or rewritten by each optimization.
+        self.counts = {'branches to next line': 0, 'dead stores': 0, 'threaded jumps': 0,
+                       'folded constants': 0, 'fused bit count loops': 0}
+
+
+    # Class methods
+
+    # Get the decoded operands of an instruction the optimizer knows about.
+    def operandsOf(self, anInstruction):
+        """
+        Checks whether the optimizer knows an instruction and its operands are well formed.
+
+        :param anInstruction: The Instruction object to check.
+        :return: A list of the register numbers and immediate values of the operands (the label of a branch
+                 is left as it is), or None if the instruction is to be left alone.
+        """
+
+        name = anInstruction.instruction
+        operands = [anInstruction.op1, anInstruction.op2, anInstruction.op3]
+
+        if name == 'b':
+            if anInstruction.condition in self.conditions and operands[0] and not operands[1]:
+                return [operands[0]]
+            return None
+
+        if not (name in self.forms) or anInstruction.condition:
+            return None
+
+        form = self.forms[name]
+        values = []
+
+        for (j, operand) in enumerate(operands):
+            # An operand the instruction does not take has to be missing.
+            if j >= len(form):
+                if operand:
+                    return None
+                continue
+
+            value = registerOf(operand) if form[j] == 'r' else immediateOf(operand)
+            if value is None:
+                return None
+            values.append(value)
+
+        return values
+
+
+    # Get the line index of every label.
+    def labelIndexes(self):
+        return {anInstruction.label: i for (i, anInstruction) in enumerate(self.lines) if anInstruction.label}
+
+
+    # Mark a line to be removed, along with the optimization it is counted for (if any).
+    def remove(self, i, reason):
+        self.removed[i] = reason
+
+
+    # Take the removed lines out of the program, moving their labels to the lines that follow them.
+    def compact(self):
+        """
+        Takes the lines removed by the last pass out of the list of instructions.
+
+        :return: The number of lines removed.
+        """
+
+        # A removed line with a label and nothing left after it has nowhere to move its label to. Keeping it
+        # is always safe, since every optimization only removes lines that have no effect.
+        survivor = False
+        for i in range(len(self.lines) - 1, -1, -1):
+            if not (i in self.removed):
+                survivor = True
+            elif self.lines[i].label and not survivor:
+                del self.removed[i]
+                survivor = True
+
+        kept = []
+        pending = []
+        renamed = {}
+
+        for (i, anInstruction) in enumerate(self.lines):
+            if i in self.removed:
+                if self.removed[i]:
+                    self.counts[self.removed[i]] += 1
+                if anInstruction.label:
+                    pending.append(anInstruction.label)
+                continue
+
+            # Move the labels of the removed lines right before this one onto it.
+            if pending:
+                if not anInstruction.label:
+                    anInstruction = anInstruction._replace(label=pending.pop())
+                for aLabel in pending:
+                    renamed[aLabel] = anInstruction.label
+                pending = []
+
+            kept.append(anInstruction)
+
+        # Change the branches to the labels that could not be moved.
+        self.lines = [anInstruction._replace(op1=renamed[anInstruction.op1])
+                      if anInstruction.instruction == 'b' and anInstruction.op1 in renamed else anInstruction
+                      for anInstruction in kept]
+
+        count = len(self.removed)
+        self.removed = {}
+        return count
+
+
+    # Make branches to an unconditional branch go straight to where it goes.
+    def threadJumps(self):
+        """
+        Changes every branch whose label is on an unconditional branch to branch to the label of that
+        branch instead, following chains of unconditional branches.
+
+        :return: The number of branches changed.
+        """
+
+        labels = self.labelIndexes()
+        count = 0
+
+        for (i, anInstruction) in enumerate(self.lines):
+            if anInstruction.instruction != 'b' or self.operandsOf(anInstruction) is None:
+                continue
+
+            target = anInstruction.op1
+            visited = {target}
+
+            while target in labels:
+                nextInstruction = self.lines[labels[target]]
+                if nextInstruction.instruction != 'b' or nextInstruction.condition \
+                        or self.operandsOf(nextInstruction) is None or nextInstruction.op1 in visited:
+                    break
+                target = nextInstruction.op1
+                visited.add(target)
+
+            if target != anInstruction.op1:
+                self.lines[i] = anInstruction._replace(op1=target)
+                self.counts['threaded jumps'] += 1
+                count += 1
+
+        return count
+
+
+    # Remove branches to the next line.
+    def removeBranchesToNext(self):
+        """
+        Removes every branch, conditional or not, whose label is on the line right after it, since running
+        it has no effect.
+
+        :return: The number of branches removed.
+        """
+
+        labels = self.labelIndexes()
+
+        for (i, anInstruction) in enumerate(self.lines):
+            if anInstruction.instruction == 'b' and self.operandsOf(anInstruction) is not None \
+                    and labels.get(anInstruction.op1) == i + 1:
+                self.remove(i, 'branches to next line')
+
+        return self.compact()
+
+
+    # Replace bit counting loops with a popcnt instruction.
+    def fuseBitCounts(self):
+        """
+        Replaces every loop of the form
+            loop: cmpi rX, 0
+                  ble done
+                  andi rT, rX, 1
+                  add rA, rA, rT
+                  lsri rX, rX, 1
+                  b loop
+            done: ...
+        where only the first and last lines have labels, with the single instruction
+            loop: popcnt rA, rX, rT
+
+        :return: The number of loops replaced.
+        """
+
+        count = 0
+
+        for i in range(len(self.lines) - 6):
+            loop = self.lines[i:i + 7]
+            if any(self.operandsOf(anInstruction) is None for anInstruction in loop[:6]) \
+                    or any(anInstruction.label for anInstruction in loop[1:6]) or not loop[0].label \
+                    or [anInstruction.instruction + anInstruction.condition for anInstruction in loop[:6]] \
+                    != ['cmpi', 'ble', 'andi', 'add', 'lsri', 'b']:
+                continue
+
+            (x, zero), (done,), (t, x2, one), (acc, acc2, t2), (x3, x4, shift), (back,) = \
+                [self.operandsOf(anInstruction) for anInstruction in loop[:6]]
+
+            # The two registers added may be given in either order.
+            if acc2 == t and t2 == acc:
+                acc2, t2 = t2, acc2
+
+            if zero == 0 and one == 1 and shift == 1 and x == x2 == x3 == x4 and acc == acc2 and t == t2 \
+                    and len({x, t, acc}) == 3 and done == loop[6].label and back == loop[0].label:
+                self.lines[i] = blub.Instruction(label=loop[0].label, instruction='popcnt', condition='',
+                                                 op1=loop[3].op1, op2=loop[0].op1, op3=loop[2].op1)
+                for j in range(i + 1, i + 6):
+                    self.remove(j, None)
+                self.counts['fused bit count loops'] += 1
+                count += 1
+
+        self.compact()
+        return count
+
+
+    # Replace instructions whose result is known with a movi instruction.
+    def foldConstants(self):
+        """
+        Keeps track of the registers whose values are known from movi instructions, and replaces every
+        andi, lsri or add instruction whose operands are all known with a movi of its result.
+
+        :return: The number of instructions replaced.
+        """
+
+        known = {}
+        count = 0
+
+        for (i, anInstruction) in enumerate(self.lines):
+            if anInstruction.label:
+                known = {}
+
+            operands = self.operandsOf(anInstruction)
+            name = anInstruction.instruction
+
+            if operands is None:
+                known = {}
+                continue
+
+            if name == 'movi':
+                if operands[1] <= self.maxImmediate:
+                    known[operands[0]] = operands[1]
+                else:
+                    known.pop(operands[0], None)
+
+            elif name in ('andi', 'lsri', 'add'):
+                value = None
+                if operands[1] in known:
+                    if name == 'andi':
+                        value = known[operands[1]] & operands[2]
+                    elif name == 'lsri':
+                        value = known[operands[1]] >> operands[2]
+                    elif operands[2] in known:
+                        value = known[operands[1]] + known[operands[2]]
+
+                if value is not None and value <= self.maxImmediate:
+                    self.lines[i] = anInstruction._replace(instruction='movi', op2=str(value), op3='')
+                    self.counts['folded constants'] += 1
+                    count += 1
+                    known[operands[0]] = value
+                else:
+                    known.pop(operands[0], None)
+
+        return count
+
+
+    # Remove writes to registers that are written again before they are read.
+    def removeDeadStores(self):
+        """
+        Removes every movi, andi, lsri or add instruction whose result is overwritten by a later instruction
+        of the same block before anything reads it.
+
+        :return: The number of instructions removed.
+        """
+
+        unread = {}
+
+        for (i, anInstruction) in enumerate(self.lines):
+            if anInstruction.label:
+                unread = {}
+
+            operands = self.operandsOf(anInstruction)
+            name = anInstruction.instruction
+
+            if operands is None or name == 'b':
+                unread = {}
+                continue
+
+            # Every operand that is read, which is every register operand but the one written.
+            written = operands[0] if name in ('movi', 'andi', 'lsri', 'add') else None
+            reads = {operands[0]} if written is None else set()
+            if name == 'add':
+                reads.update(operands[1:])
+            elif name in ('andi', 'lsri'):
+                reads.add(operands[1])
+
+            for reg in reads:
+                unread.pop(reg, None)
+
+            if written is not None:
+                if written in unread:
+                    self.remove(unread[written], 'dead stores')
+                unread[written] = i
+
+        return self.compact()
+
+
+    # Run all of the optimizations.
+    def run(self, maxRounds=10):
+        """
+        Runs the optimizations over and over until none of them changes anything.
+
+        :param maxRounds: The most times to run the optimizations.
+        :return: The optimized program as a new Program object.
+        """
+
+        for aRound in range(maxRounds):
+            changes = self.threadJumps() + self.removeBranchesToNext() + self.fuseBitCounts() \
+                      + self.foldConstants() + self.removeDeadStores()
+            if not changes:
+                break
+
+        return blub.Program.fromInstructions(self.lines)
+
+
+
+# Optimize a program.
+def optimize(aProgram):
+    """
+    Runs the peephole optimizations over a program.
+
+    :param aProgram: The Program object to optimize. It is not changed.
+    :return: A tuple of the optimized Program object, and a dictionary of the number of instructions removed
+             or rewritten by each optimization, along with the total number removed ('removed') and rewritten
+             ('rewritten').
+    """
+
+    theOptimizer = Optimizer(aProgram)
+    optimized = theOptimizer.run()
+
+    report = dict(theOptimizer.counts)
+    report['removed'] = len(aProgram) - len(optimized)
+    report['rewritten'] = report['threaded jumps'] + report['folded constants'] + report['fused bit count loops']
+
+    return optimized, report
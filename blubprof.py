@@ -0,0 +1,213 @@
+# Profile Program objects written in "Blub" assembly language while they run.
+# The profiler runs a Machine object's program one line at a time, counting how many times each line runs
+# and how long it takes, and how many times each conditional branch is taken. The counts are added up by
+# instruction and by label afterwards, and reported next to the line numbers the program is printed with.
+
+# Assumptions made prior to code writing:
+#   Profiling is a separate way of running a program, so the interpreter loops used for normal runs do not
+#   change at all when it is added.
+#
+#   A compare followed by a conditional branch is run as two separate lines rather than as a fused
+#   compare-and-branch, so that the time of each line is reported against that line.
+#
+#   The lines of a label's region are the lines from its label up to the next label. Lines before the
+#   first label belong to no label.
+
+# To time each line, we require the time module.
+import time
+
+# To access the opcodes of the decoded form of a program, import the blubvm module.
+import blubvm
+
+
+# Initialize a dictionary of the compare-and-branch opcodes, and the compare they are split back into.
+splitCompares = {blubvm.OP_CMPBGT, blubvm.OP_CMPBGE, blubvm.OP_CMPBEQ, blubvm.OP_CMPBNE, blubvm.OP_CMPBLE,
+                 blubvm.OP_CMPBLT}
+
+# The opcodes of the conditional branches.
+conditionalBranches = {blubvm.OP_BGT, blubvm.OP_BGE, blubvm.OP_BEQ, blubvm.OP_BNE, blubvm.OP_BLE,
+                       blubvm.OP_BLT}
+
+
+# Write the Profile class to hold what was measured during a profiled run.
+class Profile:
+    """
+    A class that holds the number of times each line of a program ran, the time it took, and the number
+    of times each conditional branch was and was not taken.
+    """
+
+    # Class constructor
+    def __init__(self, aProgram):
+        """
+        The constructor for the Profile class.
+
+        :param aProgram: The Program object being profiled.
+        """
+
+        self.code = aProgram
+
+        # Initialize lists of the run count and total seconds of each line, indexed by line number, and a
+        # dictionary of the [taken, not taken] counts of each conditional branch line.
+        self.counts = [0] * (len(aProgram) + 2)
+        self.times = [0.0] * (len(aProgram) + 2)
+        self.branches = {}
+
+
+    # Class methods
+
+    # Get the name of the instruction on a line, including the condition of a branch.
+    def instructionOf(self, lineNum):
+        anInstruction = self.code[lineNum]
+        return anInstruction.instruction + anInstruction.condition
+
+
+    # Get the label whose region each line is in.
+    def regions(self):
+        """
+        Works out the label whose region each line of the program is in.
+
+        :return: A list of labels indexed by line number, with None for the lines before the first label.
+        """
+
+        starts = sorted((lineNum, aLabel) for (aLabel, lineNum) in self.code.labelLocator.items()
+                        if lineNum is not None)
+        regions = [None] * len(self.counts)
+
+        for (i, (lineNum, aLabel)) in enumerate(starts):
+            stop = starts[i + 1][0] if i + 1 < len(starts) else len(regions)
+            regions[lineNum:stop] = [aLabel] * (stop - lineNum)
+
+        return regions
+
+
+    # Add up the counts and times of the lines by instruction.
+    def byInstruction(self):
+        """
+        Adds up the run counts and times of every line with the same instruction.
+
+        :return: A dictionary of instruction names and [run count, seconds] lists.
+        """
+
+        totals = {}
+
+        for lineNum in range(1, len(self.counts) - 1):
+            if self.counts[lineNum]:
+                total = totals.setdefault(self.instructionOf(lineNum), [0, 0.0])
+                total[0] += self.counts[lineNum]
+                total[1] += self.times[lineNum]
+
+        return totals
+
+
+    # Add up the counts and times of the lines by label.
+    def byLabel(self):
+        """
+        Adds up the run counts and times of every line in the region of each label.
+
+        :return: A dictionary of labels and [run count, seconds] lists. The lines before the first label are
+                 added up under None.
+        """
+
+        totals = {}
+
+        for (lineNum, aLabel) in enumerate(self.regions()):
+            if self.counts[lineNum] and 0 < lineNum < len(self.counts) - 1:
+                total = totals.setdefault(aLabel, [0, 0.0])
+                total[0] += self.counts[lineNum]
+                total[1] += self.times[lineNum]
+
+        return totals
+
+
+    # Build the hot-spot report.
+    def report(self, top=10):
+        """
+        Builds a report of where the program spent its time. The program is listed with the line numbers it
+        is printed with, each line preceded by its run count, its time and its share of the total time, and
+        is followed by the hottest lines, the totals by instruction and by label, and the branch counts.
+
+        :param top: The number of hottest lines to list.
+        :return: The report as a string.
+        """
+
+        totalTime = sum(self.times) or 1.0
+
+        def columns(count, seconds):
+            return "%10d %10.6f %6.1f%%" % (count, seconds, 100.0 * seconds / totalTime)
+
+        reportStr = "%10s %10s %7s\n" % ("count", "seconds", "time")
+        for (lineNum, line) in enumerate(str(self.code).splitlines(), 1):
+            taken = ("    taken %d, not taken %d" % tuple(self.branches[lineNum])) if lineNum in self.branches else ""
+            reportStr += columns(self.counts[lineNum], self.times[lineNum]) + "  " + line + taken + "\n"
+
+        reportStr += "\nHottest lines:\n"
+        hottest = sorted(range(1, len(self.counts) - 1), key=lambda lineNum: -self.times[lineNum])[:top]
+        for lineNum in hottest:
+            if self.counts[lineNum]:
+                reportStr += columns(self.counts[lineNum], self.times[lineNum]) + "  line %d\n" % lineNum
+
+        reportStr += "\nBy instruction:\n"
+        for (name, (count, seconds)) in sorted(self.byInstruction().items(), key=lambda item: -item[1][1]):
+            reportStr += columns(count, seconds) + "  " + name + "\n"
+
+        reportStr += "\nBy label:\n"
+        for (aLabel, (count, seconds)) in sorted(self.byLabel().items(), key=lambda item: -item[1][1]):
+            reportStr += columns(count, seconds) + "  " + (aLabel if aLabel is not None else "(no label)") + "\n"
+
+        return reportStr
+
+
+
+# Run a Machine object's program with every line counted and timed.
+def run(aMachine, aProfile=None):
+    """
+    Runs the program of a Machine object from its current program counter until it runs past its last
+    line, one line at a time, recording how many times each line runs and how long it takes.
+
+    :param aMachine: The Machine object to run.
+    :param aProfile: The Profile object to add the measurements to, or None to start a new one.
+    :return: The Profile object.
+    """
+
+    if aProfile is None:
+        aProfile = Profile(aMachine.code)
+
+    # Decode the program if it has not been decoded already, and split every compare-and-branch back into
+    # its compare so that the branch after it runs as a line of its own.
+    if aMachine.decoded is None:
+        aMachine.decoded = aMachine.decode()
+    decoded = [(blubvm.OP_CMPI, a, b, 0) if op in splitCompares else (op, a, b, c)
+               for (op, a, b, c) in aMachine.decoded]
+
+    counter = [aMachine.steps, aMachine.pc, aMachine.printed]
+    compared = [aMachine.cmpLeft, aMachine.cmpRight]
+    code = [aMachine.threadInstruction(pc, *decodedInstruction, counter, compared)
+            for (pc, decodedInstruction) in enumerate(decoded)]
+
+    # A conditional branch adds its block to the instruction count only when it is taken.
+    branchLines = {pc for (pc, (op, a, b, c)) in enumerate(decoded) if op in conditionalBranches}
+    for pc in branchLines:
+        aProfile.branches.setdefault(pc, [0, 0])
+
+    counts = aProfile.counts
+    times = aProfile.times
+    branches = aProfile.branches
+    clock = time.perf_counter
+
+    pc = aMachine.pc
+    while pc:
+        steps = counter[0]
+        startTime = clock()
+        nextPc = code[pc]()
+        times[pc] += clock() - startTime
+        counts[pc] += 1
+        if pc in branchLines:
+            branches[pc][counter[0] == steps] += 1
+        pc = nextPc
+
+    aMachine.pc = len(code) - 1
+    aMachine.steps = counter[0]
+    aMachine.printed = counter[2]
+    aMachine.cmpLeft, aMachine.cmpRight = compared
+
+    return aProfile
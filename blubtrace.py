@@ -0,0 +1,337 @@
+# Record the path Program objects written in "Blub" assembly language take while they run, and replay it.
+# A traced run records a line for every instruction run: its line number, the register it wrote and the value
+# it wrote there. The records are kept in a buffer of 32-bit integers that is either used as a ring, keeping
+# only the most recent records, or written to a file in whole chunks every time it fills up. A recorded trace
+# is replayed against the line numbers the program is printed with.
+
+# Assumptions made prior to code writing:
+#   Tracing is a separate way of running a program, so the interpreter loops used for normal runs do not change
+#   at all when it is added. Traced runs do not fast-forward counting loops, so every step of them is recorded.
+#
+#   An instruction that writes no register, such as a branch or a compare, is recorded with register -1 and
+#   the line run after it as its value. An instruction that writes more than one register, such as popcnt, is
+#   recorded with the first register it writes.
+#
+#   A compare followed by a conditional branch is recorded as two separate lines rather than as a fused
+#   compare-and-branch, so that the line the branch is on is the line recorded for it.
+#
+#   A trace that keeps only the instructions that jumped, such as taken branches, keeps the records of every
+#   instruction run after which the next line run was not the next line of the program.
+#
+#   Trace files hold 32-bit little-endian integers whatever the computer the trace was recorded on.
+
+# To read and write trace files, we require the sys, struct and array modules.
+import sys
+import struct
+import array
+
+# To access the opcodes of the decoded form of a program, import the blubvm module. The compares are split
+# from their branches the same way the profiler splits them.
+import blubvm
+import blubprof
+
+
+# The first bytes of every trace file, and the version of its format.
+MAGIC = b'BLUBTRCE'
+FORMAT_VERSION = 1
+
+# The header of a trace file: the magic bytes, the format version, whether only jumps were recorded, the hash
+# of the program, and the number of records made before the first one in the file. It is followed by the
+# records, each made of the line number, the register written and the value written.
+header = struct.Struct('<8sHH32sq')
+
+# The default number of records in the buffer of a trace.
+defaultSize = 65536
+
+# The opcodes of the instructions that write the register of their first operand.
+writingOps = {blubvm.OP_ADD, blubvm.OP_ANDI, blubvm.OP_LSRI, blubvm.OP_MOVI, blubvm.OP_POPCNT, blubvm.OP_LDR,
+              blubvm.OP_LDRB}
+
+
+# Get the register an instruction writes.
+def writtenRegister(op, a, b, c):
+    """
+    Get the register a decoded instruction writes, which is recorded along with its value.
+
+    :param op: The opcode of the instruction.
+    :param a: The first decoded operand.
+    :param b: The second decoded operand.
+    :param c: The third decoded operand.
+    :return: The register number, or -1 if the instruction writes no register.
+    """
+
+    if op in writingOps:
+        return a
+    if op in blubvm.callOpcodes.values():
+        return a & 31
+    return -1
+
+
+# Write records to a file as little-endian integers.
+def writeRecords(theFile, records):
+    if sys.byteorder == 'little':
+        theFile.write(records)
+    else:
+        swapped = array.array('i', records)
+        swapped.byteswap()
+        theFile.write(swapped.tobytes())
+
+
+
+# Write the Trace class to hold the records of a traced run.
+class Trace:
+    """
+    A class that holds the records of the instructions run by a traced Machine object, in a buffer of a fixed
+    number of records. The buffer is used as a ring keeping the most recent records, or is written to a file
+    every time it is full.
+    """
+
+    # Class constructor
+    def __init__(self, size=defaultSize, aFile=None, branchesOnly=False):
+        """
+        The constructor for the Trace class.
+
+        :param size: The number of records in the buffer.
+        :param aFile: The name of the file to write every record to, or None to keep only the last size records
+                      in memory. See save and close.
+        :param branchesOnly: Whether only the instructions that jumped, such as taken branches, are recorded.
+        """
+
+        self.size = size
+        self.branchesOnly = branchesOnly
+
+        # Initialize the buffer of records, three integers each, and the index in it of the next record.
+        self.records = array.array('i', bytes(12 * size))
+        self.position = 0
+
+        # Initialize a count of the records made before those in the buffer.
+        self.count = 0
+
+        # Initialize a variable to store the hash of the program being traced, see blubvm.Machine.hashProgram.
+        self.programHash = bytes(32)
+
+        # Open the file the records are written to, leaving room for its header, which is written once the
+        # trace is closed.
+        self.file = None
+        if aFile is not None:
+            self.file = open(aFile, 'wb')
+            self.file.write(bytes(header.size))
+
+
+    # Class methods
+
+    # Get the number of records made.
+    @property
+    def total(self):
+        return self.count + self.position // 3
+
+
+    # Make room for more records once the buffer is full.
+    def full(self):
+        """
+        Writes the whole buffer to the file of the trace, or lets the ring go round and overwrite its oldest
+        records. The traced loop calls this when the buffer is full, and then carries on from its start.
+        """
+
+        if self.file is not None:
+            writeRecords(self.file, self.records)
+        self.count += self.size
+
+
+    # Get the records kept, oldest first.
+    def entries(self):
+        """
+        Get the records kept in memory, from the oldest to the most recent.
+
+        :return: An array of three integers per record.
+        :raises ValueError: If the records have been written to a file, which is read with readTrace.
+        """
+
+        if self.file is not None:
+            raise ValueError("The records of a trace written to a file are read with readTrace")
+
+        if self.count:
+            return self.records[self.position:] + self.records[:self.position]
+        return self.records[:self.position]
+
+
+    # Get the records kept as tuples.
+    def __iter__(self):
+        return zip(*[iter(self.entries())] * 3)
+
+
+    # Get the number of records kept.
+    def __len__(self):
+        return len(self.entries()) // 3
+
+
+    # Get the number of records made before the first one kept, which is only more than 0 once a ring has
+    # gone round.
+    @property
+    def first(self):
+        return self.total - len(self)
+
+
+    # Get the header of a trace file.
+    def headerOf(self, first):
+        return header.pack(MAGIC, FORMAT_VERSION, int(self.branchesOnly), self.programHash, first)
+
+
+    # Write the records kept in memory to a file.
+    def save(self, aFile):
+        """
+        Writes the records kept in memory to a trace file, oldest first.
+
+        :param aFile: The name of the trace file.
+        """
+
+        records = self.entries()
+        with open(aFile, 'wb') as theFile:
+            theFile.write(self.headerOf(self.first))
+            writeRecords(theFile, records)
+
+
+    # Write the rest of the records to the file of the trace.
+    def close(self):
+        """
+        Writes the records left in the buffer to the file of the trace, along with its header, and closes it.
+        """
+
+        if self.file is None or self.file.closed:
+            return
+
+        writeRecords(self.file, memoryview(self.records)[:self.position])
+        self.file.seek(0)
+        self.file.write(self.headerOf(0))
+        self.file.close()
+
+
+
+# Read a trace file.
+def readTrace(aFile):
+    """
+    Reads the records of a trace file.
+
+    :param aFile: The name of the trace file.
+    :return: A Trace object holding the records of the file in memory.
+    :raises ValueError: If the file is not a trace file of this version.
+    """
+
+    with open(aFile, 'rb') as theFile:
+        data = theFile.read()
+
+    if len(data) < header.size:
+        raise ValueError("Not a blub trace: " + aFile)
+
+    magic, formatVersion, branchesOnly, programHash, first = header.unpack_from(data)
+    if magic != MAGIC or formatVersion != FORMAT_VERSION or (len(data) - header.size) % 12:
+        raise ValueError("Not a blub trace of this version: " + aFile)
+
+    records = array.array('i')
+    records.frombytes(data[header.size:])
+    if sys.byteorder != 'little':
+        records.byteswap()
+
+    # The records are kept as a full ring that starts at its first record.
+    aTrace = Trace(0, branchesOnly=bool(branchesOnly))
+    aTrace.size = len(records) // 3
+    aTrace.records = records
+    aTrace.position = len(records)
+    aTrace.count = first
+    aTrace.programHash = programHash
+
+    return aTrace
+
+
+# Walk through a trace against the lines of its program.
+def replay(aProgram, aTrace):
+    """
+    Walks through the records of a trace, giving for each the number of the record, the line of the program
+    it ran, numbered the way the program is printed, and the value it wrote or the line it jumped to.
+
+    :param aProgram: The Program object the trace was recorded from.
+    :param aTrace: The Trace object, as returned by readTrace.
+    :return: A generator of the records as strings.
+    :raises ValueError: If the trace was recorded from another program.
+    """
+
+    if aTrace.programHash != blubvm.Machine(aProgram).hashProgram():
+        raise ValueError("The trace was recorded from another program")
+
+    lines = str(aProgram).splitlines()
+
+    for (number, (pc, reg, value)) in enumerate(aTrace, aTrace.first):
+        line = lines[pc - 1] if 1 <= pc <= len(lines) else "%d    ?" % pc
+        if reg >= 0:
+            effect = "r%d = %d" % (reg, value)
+        else:
+            effect = "-> %d" % value if value != pc + 1 else ""
+        yield ("%10d  %-40s  %s" % (number, line, effect)).rstrip()
+
+
+
+# Run a Machine object's program while recording a trace of it.
+def run(aMachine, aTrace, limit=None):
+    """
+    Runs the program of a Machine object from its current program counter until it runs past its last line,
+    one line at a time, recording the line run, the register written and the value written by every
+    instruction, or only by the instructions that jumped.
+
+    :param aMachine: The Machine object to run.
+    :param aTrace: The Trace object to record into.
+    :param limit: The number of instructions after which to stop, or None to run to the end, as for
+                  blubvm.Machine.interpret.
+    """
+
+    # Decode the program if it has not been decoded already, and split every compare-and-branch back into
+    # its compare so that the branch after it is recorded as a line of its own.
+    if aMachine.decoded is None:
+        aMachine.decoded = aMachine.decode()
+    decoded = [(blubvm.OP_CMPI, a, b, 0) if op in blubprof.splitCompares else (op, a, b, c)
+               for (op, a, b, c) in aMachine.decoded]
+
+    counter = [aMachine.steps, aMachine.pc, aMachine.printed]
+    compared = [aMachine.cmpLeft, aMachine.cmpRight]
+    code = [aMachine.threadInstruction(pc, *decodedInstruction, counter, compared)
+            for (pc, decodedInstruction) in enumerate(decoded)]
+    written = [writtenRegister(*decodedInstruction) for decodedInstruction in decoded]
+
+    aTrace.programHash = aMachine.hashProgram()
+
+    registers = aMachine.registers
+    records = aTrace.records
+    position = aTrace.position
+    end = len(records)
+    branchesOnly = aTrace.branchesOnly
+    stopAt = counter[0] + limit if limit is not None else sys.maxsize
+
+    # The halt after the last line returns line 0, which stops the loop and is not recorded. Whatever was
+    # recorded is kept when an instruction raises an error.
+    pc = aMachine.pc
+    try:
+        while pc:
+            nextPc = code[pc]()
+
+            if nextPc and (not branchesOnly or nextPc != pc + 1):
+                reg = written[pc]
+                records[position] = pc
+                records[position + 1] = reg
+                records[position + 2] = registers[reg] if reg >= 0 else nextPc
+                position += 3
+                if position == end:
+                    aTrace.full()
+                    position = 0
+
+            pc = nextPc
+
+            # The instruction count only changes when the program counter jumps, so a run with a limit stops
+            # at the end of the block in which it is reached, just like the interpreter.
+            if counter[0] >= stopAt:
+                break
+
+    finally:
+        aTrace.position = position
+        aMachine.pc = pc or len(code) - 1
+        aMachine.steps = counter[0]
+        aMachine.printed = counter[2]
+        aMachine.cmpLeft, aMachine.cmpRight = compared
@@ -0,0 +1,249 @@
+# Run a Program object written in "Blub" assembly language over many sets of registers at once.
+# Each set of registers is a lane, and the registers of all the lanes are kept in a single 32 x N NumPy
+# array, so every instruction works on all the lanes that are at its line in one array operation. This
+# replaces N separate runs of Machine.interpret with a single pass over the program. It is run through
+# runLanes and the VectorMachine class rather than from the command line.
+
+# Assumptions made prior to code writing:
+#   Every lane has a program counter of its own. At every step the instruction at the lowest program
+#   counter of the lanes that have not finished is run for all the lanes at that line, so lanes that take
+#   different branches run apart and are brought back together when their program counters meet again.
+#
+#   Registers are kept in 64 bit integers so that every value put in them can be checked for overflow, and
+#   raise an OverflowError when it does not fit in a 32 bit register, like the interpreter does.
+#
+#   Instructions added to a Machine object, and the data memory, work on a single Machine object, so programs
+#   using them cannot be run over many lanes.
+#
+#   NumPy is not required by the rest of the package, so it is only needed once a program is run here.
+
+# To decode Program objects, import the blubvm module.
+import blubvm
+
+# NumPy holds the registers of every lane. It is not available on every installation.
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# Initialize dictionaries of the NumPy comparison each conditional branch and compare-and-branch tests.
+branchTests = {blubvm.OP_BGT: 'greater', blubvm.OP_BGE: 'greater_equal', blubvm.OP_BEQ: 'equal',
+               blubvm.OP_BNE: 'not_equal', blubvm.OP_BLE: 'less_equal', blubvm.OP_BLT: 'less'}
+compareTests = {blubvm.OP_CMPBGT: 'greater', blubvm.OP_CMPBGE: 'greater_equal', blubvm.OP_CMPBEQ: 'equal',
+                blubvm.OP_CMPBNE: 'not_equal', blubvm.OP_CMPBLE: 'less_equal', blubvm.OP_CMPBLT: 'less'}
+
+# The largest value that fits in a register.
+maxRegister = 2 ** 31 - 1
+
+
+# Count the bits that are set in each value of an array, counting none for the values that are not positive,
+# which popcnt leaves as they are. A negative value would never be shifted down to zero.
+def bitCounts(values):
+    counts = numpy.zeros_like(values)
+    values = numpy.where(values > 0, values, 0)
+    while values.any():
+        counts += values & 1
+        values >>= 1
+    return counts
+
+
+# Write the VectorMachine class to run a Program object over many lanes of registers at once.
+class VectorMachine:
+    """
+    A class that runs a Program object over N lanes of registers at once.
+    """
+
+    # Class constructor
+    def __init__(self, aProgram, lanes):
+        """
+        The constructor for the VectorMachine class.
+
+        :param aProgram: A Program object to run.
+        :param lanes: The number of lanes to run it over.
+        """
+
+        if numpy is None:
+            raise ImportError("Running a program over many lanes requires NumPy.")
+
+        # Decode the program once for every lane. Added instructions and the data memory cannot be run over many
+        # lanes.
+        theMachine = blubvm.Machine(aProgram)
+        self.code = aProgram
+        self.decoded = theMachine.decode()
+        if theMachine.extensions:
+            raise ValueError("Programs with added instructions cannot be run over many lanes.")
+        if any(op in blubvm.memoryOps for (op, a, b, c) in self.decoded):
+            raise ValueError("Programs that use the data memory cannot be run over many lanes.")
+
+        # Initialize the registers of every lane to zero, with a row for each register and a column for each
+        # lane, and the program counter, compare and instruction count of every lane.
+        self.lanes = lanes
+        self.registers = numpy.zeros((32, lanes), dtype=numpy.int64)
+        self.pc = numpy.ones(lanes, dtype=numpy.int64)
+        self.cmpLeft = numpy.zeros(lanes, dtype=numpy.int64)
+        self.cmpRight = numpy.full(lanes, -1, dtype=numpy.int64)
+        self.steps = numpy.zeros(lanes, dtype=numpy.int64)
+
+        # Initialize an array of the values printed by each lane, with a row for each value printed, and the
+        # number of values each lane has printed.
+        self.printed = numpy.zeros((16, lanes), dtype=numpy.int64)
+        self.printCounts = numpy.zeros(lanes, dtype=numpy.int64)
+
+
+    # Class methods
+
+    # Keep the values printed by some of the lanes.
+    def prnt(self, lanes, values):
+        """
+        Keeps a value printed by each of the given lanes, after the values they have printed before.
+
+        :param lanes: The lanes that printed, as an index into the lane arrays.
+        :param values: The value printed by each of those lanes.
+        """
+
+        rows = self.printCounts[lanes]
+        if rows.max() >= len(self.printed):
+            self.printed = numpy.concatenate([self.printed, numpy.zeros_like(self.printed)])
+
+        self.printed[rows, numpy.arange(self.lanes)[lanes]] = values
+        self.printCounts[lanes] += 1
+
+
+    # Check that the values put in a register fit in it.
+    @staticmethod
+    def checkOverflow(values):
+        if (values > maxRegister).any() or (values < -maxRegister - 1).any():
+            raise OverflowError("signed integer is greater than maximum")
+        return values
+
+
+    # Put every lane back to the start of the program.
+    def reset(self, inputs=None):
+        """
+        Puts every lane back to the start of the program with the registers it starts with, after the movi
+        instructions the program starts with, just like Machine.reset. A register given values keeps them
+        when the program starts by moving a value into it.
+
+        :param inputs: A dictionary of register numbers and the values they start with, either one value for
+                       every lane or an array with a value for each lane, or None.
+        :raises OverflowError: If a value does not fit in a register.
+        """
+
+        theMachine = blubvm.Machine(self.code)
+        theMachine.decoded = self.decoded
+        pc, startRegisters = theMachine.startState()
+
+        self.registers[:] = numpy.asarray(startRegisters, dtype=numpy.int64)[:, numpy.newaxis]
+        for (reg, values) in (inputs or {}).items():
+            self.registers[reg] = self.checkOverflow(numpy.asarray(values))
+
+        # The movi instructions skipped still count as instructions run.
+        self.pc[:] = pc
+        self.steps[:] = pc - 1
+        self.cmpLeft[:] = 0
+        self.cmpRight[:] = -1
+        self.printed[:] = 0
+        self.printCounts[:] = 0
+
+
+    # Run the program over every lane.
+    def run(self):
+        """
+        Runs the program of every lane from its program counter until every lane has run past the last line
+        of the program.
+
+        :return: A tuple of an array of the values printed, with a row for each value printed and a column
+                 for each lane, and an array of the number of values printed by each lane. A lane that printed
+                 fewer values than others has zeros in the rows it did not print.
+        """
+
+        code = self.decoded
+        end = len(code) - 1
+        registers = self.registers
+        pcs = self.pc
+        left = self.cmpLeft
+        right = self.cmpRight
+        steps = self.steps
+
+        while True:
+            pc = int(pcs.min())
+            if pc >= end:
+                break
+
+            # Run the instruction for every lane at this line. When all of them are, a slice of every lane is
+            # faster than picking the lanes out.
+            atLine = pcs == pc
+            lanes = slice(None) if atLine.all() else atLine.nonzero()[0]
+            op, a, b, c = code[pc]
+            nextPc = pc + 1
+
+            if op == blubvm.OP_ADD:
+                registers[a, lanes] = self.checkOverflow(registers[b, lanes] + registers[c, lanes])
+
+            elif op == blubvm.OP_ANDI:
+                registers[a, lanes] = self.checkOverflow(registers[b, lanes] & c)
+
+            elif op == blubvm.OP_LSRI:
+                registers[a, lanes] = registers[b, lanes] >> c
+
+            elif op == blubvm.OP_MOVI:
+                registers[a, lanes] = self.checkOverflow(numpy.asarray(b))
+
+            elif op == blubvm.OP_CMPI:
+                left[lanes] = registers[a, lanes]
+                right[lanes] = b
+
+            elif op == blubvm.OP_PRNT:
+                self.prnt(lanes, registers[a, lanes])
+
+            elif op == blubvm.OP_POPCNT:
+                values = registers[b, lanes]
+                positive = values > 0
+                registers[a, lanes] = self.checkOverflow(registers[a, lanes]
+                                                         + numpy.where(positive, bitCounts(values), 0))
+                registers[c, lanes] = numpy.where(positive, 1, registers[c, lanes])
+                registers[b, lanes] = left[lanes] = numpy.where(positive, 0, values)
+                right[lanes] = 0
+
+            elif op == blubvm.OP_B:
+                nextPc = a
+
+            elif op in branchTests:
+                taken = getattr(numpy, branchTests[op])(left[lanes], right[lanes])
+                nextPc = numpy.where(taken, a, nextPc)
+
+            elif op in compareTests:
+                # A compare-and-branch runs the compare and the branch after it, so it counts as two instructions.
+                left[lanes] = registers[a, lanes]
+                right[lanes] = b
+                taken = getattr(numpy, compareTests[op])(left[lanes], b)
+                nextPc = numpy.where(taken, c, nextPc + 1)
+                steps[lanes] += 1
+
+            pcs[lanes] = nextPc
+            steps[lanes] += 1
+
+        return self.printed[:self.printCounts.max()], self.printCounts
+
+
+
+# Run a program over many starting values of a register.
+def runLanes(aProgram, values, register=0):
+    """
+    Runs a program once for each of a number of starting values of a register, in a single pass.
+
+    :param aProgram: The Program object to run.
+    :param values: The starting values of the register, one for each lane.
+    :param register: The number of the register the values are put in. Every other register starts with the
+                     value the program starts by moving into it, or zero, see VectorMachine.reset.
+    :return: A tuple of an array of the values printed, with a row for each value printed and a column for
+             each lane, and an array of the number of values printed by each lane.
+    """
+
+    values = numpy.asarray(values, dtype=numpy.int64) if numpy is not None else values
+
+    theMachine = VectorMachine(aProgram, len(values))
+    theMachine.reset({register: values})
+
+    return theMachine.run()
@@ -22,18 +22,279 @@
 #   Commas separate the operands.
 #
 #   There may be extra whitespace within an instruction in the passed program.
+#
+#   Every Machine object has its own registers, compare, program counter and instructions, so any number of
+#   them can run in one process, in different threads or as asyncio tasks. A single Machine object is only
+#   run by one thread or task at a time.
 
 # The blubvm.py program should be runnable from the command line. To do so, we
 # require the sys module.
 import sys
 
+# To read the options given on the command line, we require the argparse module.
+import argparse
+
+# To time the engines against each other with the program output captured, we require the time, io and
+# contextlib modules.
+import time
+import io
+import contextlib
+
+# To read program files through memory-mapped buffers, we require the mmap module. To report the peak memory
+# used we require the resource module, which is not available on every platform.
+import mmap
+try:
+    import resource
+except ImportError:
+    resource = None
+
 # To initialize an array as our representation of registers, we will need the array module.
 import array
 
+# To run many Machine objects as cooperative tasks, we require the asyncio module.
+import asyncio
+
+# To save and restore checkpoints of a Machine object, we require the struct, hashlib, os and tempfile modules.
+import struct
+import hashlib
+import os
+import tempfile
+
+# To report how a run with a budget ended, we require the namedtuple function of the collections module.
+from collections import namedtuple
+
 # To create Program objects, and access Instruction attributes, import the blub module.
 import blub
 
 
+# Integer opcodes of the decoded form of a program, which is what the interpreter loop actually runs.
+# A branch has a separate opcode for each condition so that its condition does not have to be looked up, and
+# a compare followed by a conditional branch is fused into a single compare-and-branch opcode.
+(OP_HALT, OP_MOVI, OP_CMPI, OP_ANDI, OP_ADD, OP_LSRI, OP_PRNT,
+ OP_B, OP_BGT, OP_BGE, OP_BEQ, OP_BNE, OP_BLE, OP_BLT, OP_EXT,
+ OP_CMPBGT, OP_CMPBGE, OP_CMPBEQ, OP_CMPBNE, OP_CMPBLE, OP_CMPBLT, OP_POPCNT, OP_LOOP,
+ OP_LDR, OP_STR, OP_LDRB, OP_STRB, OP_CALLRR, OP_CALLRI, OP_CALLRRR, OP_CALLRRI) = range(31)
+
+# The version of the decoded form of a program. Decoded programs saved by one version are not loaded by
+# another, so changing the opcodes or the way programs are decoded should change this number too.
+VM_VERSION = 1
+
+# Initialize a dictionary of conditional branch opcodes and the compare-and-branch opcodes they are fused into.
+fusedBranches = {OP_BGT: OP_CMPBGT, OP_BGE: OP_CMPBGE, OP_BEQ: OP_CMPBEQ, OP_BNE: OP_CMPBNE, OP_BLE: OP_CMPBLE,
+                 OP_BLT: OP_CMPBLT}
+
+# The opcodes of the instructions that read or write the data memory.
+memoryOps = {OP_LDR, OP_STR, OP_LDRB, OP_STRB}
+
+# Initialize a dictionary of the operand kinds of the instructions added as a function of the values of their
+# operands, and the opcodes they are decoded into. See the Operation class.
+callOpcodes = {'rr': OP_CALLRR, 'ri': OP_CALLRI, 'rrr': OP_CALLRRR, 'rri': OP_CALLRRI}
+
+
+# Define the errors raised for programs that cannot be run. BlubError is the base class of all of them.
+class BlubError(Exception):
+    """
+    The base class of the errors raised when a "blub" program cannot be run.
+    """
+
+
+class InstructionError(BlubError):
+    """
+    The error raised when a single instruction is not valid. Its problems attribute lists what is wrong with it.
+    """
+
+    def __init__(self, problems):
+        super().__init__("; ".join(problems))
+        self.problems = problems
+
+
+class VerificationError(BlubError):
+    """
+    The error raised when a program has instructions that are not valid. Its diagnostics attribute lists a
+    Diagnostic object for every problem found in the program.
+    """
+
+    def __init__(self, diagnostics):
+        super().__init__("%d error%s found in the program:\n" % (len(diagnostics), "s" if len(diagnostics) > 1 else "")
+                         + "\n".join(str(aDiagnostic) for aDiagnostic in diagnostics))
+        self.diagnostics = diagnostics
+
+
+
+class CheckpointError(BlubError):
+    """
+    The error raised when a checkpoint cannot be restored, because it is damaged or was taken of another
+    program.
+    """
+
+
+
+class MemoryAccessError(BlubError):
+    """
+    The error raised when a load or store reaches outside the data memory. Its line and address attributes
+    give the line of the instruction and the address it used.
+    """
+
+    def __init__(self, line, address, size):
+        super().__init__("Line %d: address %d is outside the data memory of %d bytes" % (line, address, size))
+        self.line = line
+        self.address = address
+
+
+
+# Define a Diagnostic class to describe a problem found in a program: the line number it was found on, the
+# instruction on that line, and a message saying what is wrong with it.
+class Diagnostic(namedtuple('Diagnostic', ['line', 'instruction', 'message'])):
+
+    def __str__(self):
+        return "Line %d (%s): %s" % (self.line, self.instruction, self.message)
+
+
+
+# Define a RunResult class to report how a run with a budget ended: its status is 'done' if the program ran
+# past its last line, or 'steps', 'deadline' or 'output' for the budget that stopped it. The program counter,
+# instruction count and a copy of the registers are those at the point the run ended, and printed is the
+# number of values the program tried to print.
+RunResult = namedtuple('RunResult', ['status', 'pc', 'steps', 'registers', 'printed'])
+
+
+
+# Define an Operation class to declare an instruction added to a Machine object: the kinds of its operands, as
+# a string of 'r' for a register, 'i' for an immediate value and 'l' for a label, and the function it runs.
+# By default the function is given the values of the operands after the first, which must be a register, and
+# returns the value to put in that register, as in Operation('rrr', operator.mul). Such instructions are
+# decoded into opcodes of their own and run by every engine as quickly as the base instructions, so their
+# function should only depend on its arguments. An Operation with machine set to True is instead called with
+# the Machine object and its decoded operands, like the instruction functions of the Machine class, and may
+# change anything about the machine. To branch, it sets the program counter to the line before the one to go to.
+class Operation(namedtuple('Operation', ['kinds', 'function', 'machine'], defaults=[False])):
+
+    # Check that the operation can be added to a Machine object.
+    def check(self):
+        """
+        Checks the operand kinds and function of the operation.
+
+        :raises ValueError: If the operand kinds are not valid.
+        :raises TypeError: If the function cannot be called.
+        """
+
+        if not (1 <= len(self.kinds) <= 3) or any(not (kind in 'ril') for kind in self.kinds):
+            raise ValueError("Operand kinds must be 1 to 3 of 'r', 'i' and 'l', not '%s'" % self.kinds)
+        if not self.machine and not (self.kinds in callOpcodes):
+            raise ValueError("An instruction with operands '%s' must be called with the machine, only a "
+                             "register followed by 1 or 2 registers or immediate values can be worked out from "
+                             "their values" % self.kinds)
+        if not callable(self.function):
+            raise TypeError("The function of an instruction must be callable")
+
+
+
+# The layout of a checkpoint of a Machine object: the magic bytes, the format version, the hash of the program,
+# the program counter, the number of instructions run, the number of values printed, the two values of the last
+# compare, and the 32 registers.
+CHECKPOINT_MAGIC = b'BLUBCKPT'
+CHECKPOINT_VERSION = 1
+checkpointLayout = struct.Struct('<8sH32sqqqqq32i')
+
+
+
+# The layout of a word of the data memory: a 32-bit little-endian integer, whatever the computer.
+wordLayout = struct.Struct('<i')
+
+
+# Load and store the words and bytes of a data memory, checking that they are inside it.
+def loadWord(memory, address, line):
+    if not (0 <= address <= len(memory) - 4):
+        raise MemoryAccessError(line, address, len(memory))
+    return wordLayout.unpack_from(memory, address)[0]
+
+def storeWord(memory, address, value, line):
+    if not (0 <= address <= len(memory) - 4):
+        raise MemoryAccessError(line, address, len(memory))
+    wordLayout.pack_into(memory, address, value)
+
+def loadByte(memory, address, line):
+    if not (0 <= address < len(memory)):
+        raise MemoryAccessError(line, address, len(memory))
+    return memory[address]
+
+def storeByte(memory, address, value, line):
+    if not (0 <= address < len(memory)):
+        raise MemoryAccessError(line, address, len(memory))
+    memory[address] = value & 0xFF
+
+
+
+# Map a file into memory as the data memory of a Machine object.
+def mapMemory(aFile, size=None, readOnly=False):
+    """
+    Maps a file into memory, so that the ldr and str instructions read and write the file itself, without
+    copying it.
+
+    :param aFile: The name of the file. It is created if it does not exist.
+    :param size: The number of bytes of the data memory, or None for the size of the file. A smaller file is
+                 extended with zeros to this size.
+    :param readOnly: Whether the file is only read, in which case storing to it raises a TypeError.
+    :return: The memory-mapped buffer.
+    """
+
+    with open(aFile, 'rb' if readOnly else 'a+b') as theFile:
+        if size is not None and not readOnly and os.path.getsize(aFile) < size:
+            theFile.truncate(size)
+        return mmap.mmap(theFile.fileno(), size or 0, access=mmap.ACCESS_READ if readOnly else mmap.ACCESS_WRITE)
+
+
+
+# Write the BufferedOutput class to collect printed values and write them out in batches.
+class BufferedOutput:
+    """
+    A class that collects the values printed by a program and writes them to a file, one per line, once a
+    given number of them has been collected, rather than writing each value as it is printed.
+    """
+
+    # Class constructor
+    def __init__(self, aFile=None, flushSize=4096):
+        """
+        The constructor for the BufferedOutput class.
+
+        :param aFile: The file object to write to, or None to write to whatever sys.stdout is when writing.
+        :param flushSize: The number of values collected before they are written.
+        """
+
+        self.file = aFile
+        self.flushSize = flushSize
+        self.pending = []
+
+
+    # Collect a printed value, writing out the collected values once there are enough of them.
+    def __call__(self, value):
+        self.pending.append(str(value))
+        if len(self.pending) >= self.flushSize:
+            self.flush()
+
+
+    # Write out the collected values.
+    def flush(self):
+        """
+        Writes every collected value to the file, one per line.
+        """
+
+        if self.pending:
+            theFile = self.file if self.file is not None else sys.stdout
+            theFile.write("\n".join(self.pending) + "\n")
+            theFile.flush()
+            self.pending = []
+
+
+    # Use a BufferedOutput object in a with statement to write out what is left when it ends.
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exceptionInfo):
+        self.flush()
+
+
+
 # Write the Machine class to interpret a Program object and run it.
 class Machine:
 
@@ -42,28 +303,27 @@ class Machine:
     """
 
     # Class variables:
-    # Initialize an array of size 32 to represent registers.
-    registers = array.array('i', [0 for i in range(32)])
-
     # Define functions to test conditions for the branch operation in a blub program.
+    # NB:// The conditions are tested on the two values of the last compare rather than on the flags, which
+    # gives the same result as testing the flags of a signed comparison.
     # Greater than:
     def gt(self):
-        return not(bool(self.flags['n'])) and not(bool(self.flags['z']))
+        return self.cmpLeft > self.cmpRight
     # Greater than or equal to:
     def ge(self):
-        return bool(self.flags['z']) or not(bool(self.flags['n']))
+        return self.cmpLeft >= self.cmpRight
     # Equal to:
     def eq(self):
-        return bool(self.flags['z'])
+        return self.cmpLeft == self.cmpRight
     # Not equal to:
     def ne(self):
-        return not(bool(self.flags['z']))
+        return self.cmpLeft != self.cmpRight
     # Less than or equal to:
     def le(self):
-        return bool(self.flags['z']) or bool(self.flags['n'])
+        return self.cmpLeft <= self.cmpRight
     # Less than:
     def lt(self):
-        return bool(self.flags['n']) and not(bool(self.flags['z']))
+        return self.cmpLeft < self.cmpRight
 
     # Initialize a dictionary reference for conditions and the flag combinations necessary for them to be met.
     conditions = {'gt': gt, 'ge': ge, 'eq': eq, 'ne':ne,'le': le, 'lt': lt}
@@ -72,33 +332,121 @@ class Machine:
     # two operands, and the instructions with three operands.
     # NB// Given the processing of blub programs, any branch instruction is divided into 'b' as the instruction
     # and following sequence of characters as a condition when setting up the Instruction object.
-    Ops ={'ops1':{'prnt','b'}, 'ops2':{'movi', 'cmpi'}, 'ops3':{'andi','add','lsri'}}
+    Ops ={'ops1':{'prnt','b'}, 'ops2':{'movi', 'cmpi', 'ldr', 'str', 'ldrb', 'strb'},
+          'ops3':{'andi','add','lsri','popcnt'}}
 
 
     # Class constructor:
-    def __init__(self, aProgram : blub.Program):
+    def __init__(self, aProgram : blub.Program, output=None):
         """
         The constructor for the Machine class.
         It takes a Program object containing 'blub' code and sets it up for interpretation.
 
         :param aProgram: A Program object to interpret and run.
+        :param output: Where the values printed by "prnt" go: None to print them one per line as before, a
+                       function to call with each value (such as a BufferedOutput object), or a list or
+                       array.array to append each value to.
         """
 
         # Instance variables:
         # Initialize a code variable to store the given Program object.
         self.code = aProgram
 
+        # Initialize an array of size 32 to represent registers. Every Machine object has registers of its own.
+        self.registers = array.array('i', [0 for i in range(32)])
+
+        # Initialize copies of the instructions and the number of operands each takes, so that instructions
+        # added to or removed from one Machine object leave the others as they are.
+        self.operators = dict(self.operators)
+        self.Ops = {kind: set(names) for (kind, names) in self.Ops.items()}
+
+        # Initialize a dictionary of the instructions added as Operation objects.
+        self.added = {}
+
         # Initialize a program counter variable to store the value of the current line in the program being
         # executed. Start it at the first line number.
         self.pc = 1
 
-        # Initialize a dictionary to store flag values that are results from the "cmp" instruction.
-        # NB:// Given this implementation of this interpreter using pure Python, we need not really worry about
-        # overflow or carry outs from the operations done. The operations are on integers so far, and from
-        # online research, recent versions of Python have their integers with arbitrary precision, where the
-        # limit to the size of an integer is based on available memory. I have included the 'c' and 'v' flags
-        # nonetheless so that all the flags are there.
-        self.flags = {'n':0, 'z':0, 'c':0, 'v':0}
+        # Initialize variables to store the two values compared by the last "cmp" instruction. The flag values
+        # are only worked out from them when they are read, see the flags property.
+        # NB:// Comparing 0 with -1 sets none of the flags, which is the state the flags start in.
+        self.cmpLeft = 0
+        self.cmpRight = -1
+
+        # Initialize a variable to store the decoded form of the program once it has been decoded, a list of
+        # the calls to instructions that were added to the machine, and a list of the functions of the added
+        # instructions that work out the value of a register.
+        self.decoded = None
+        self.extensions = []
+        self.functions = []
+
+        # Initialize a variable that tells whether counting loops are fast-forwarded by the interpreter, and a
+        # variable to store the decoded program with its counting loops marked once they have been found.
+        self.fastForward = True
+        self.loopCode = None
+
+        # Initialize a variable to store where a reset machine starts and the registers it starts with, once
+        # they have been worked out.
+        self.startCode = None
+
+        # Initialize variables to store the threaded and compiled forms of the program, so that they are reused
+        # when the machine is reset and run again.
+        self.threadedCode = None
+        self.compiledCode = None
+
+        # Initialize a variable to store the data memory read and written by the ldr and str instructions, such
+        # as a memory-mapped file from mapMemory. A machine without data memory has none to read or write.
+        self.memory = None
+
+        # Initialize a variable to store the blubtrace.Trace object the runs of the interpreter are recorded in, or
+        # None to run them without recording them.
+        self.trace = None
+
+        # Initialize variables to count the number of instructions run and the number of values printed.
+        self.steps = 0
+        self.printed = 0
+
+        # Initialize a variable to store the hash of the program once it has been worked out for a checkpoint.
+        self.programHash = None
+
+        # Initialize the function that each value printed by "prnt" is passed to.
+        self.output = print if output is None else getattr(output, 'append', output)
+
+
+
+    # Get the flag values that result from the last "cmp" instruction.
+    @property
+    def flags(self):
+        """
+        Works out the condition flags from the two values of the last compare, the way a 32-bit ARM processor
+        sets them when it subtracts the second value from the first.
+
+        :return: A dictionary of the 'n', 'z', 'c' and 'v' flag values.
+        """
+
+        # Work with the 32-bit representations of the values and of their difference.
+        left = self.cmpLeft & 0xFFFFFFFF
+        right = self.cmpRight & 0xFFFFFFFF
+        result = (left - right) & 0xFFFFFFFF
+
+        # The result is negative, the result is zero, the subtraction did not borrow, and the subtraction
+        # overflowed (the values have different signs and the sign of the result is not that of the first).
+        return {'n': result >> 31, 'z': int(result == 0), 'c': int(left >= right),
+                'v': ((left ^ right) & (left ^ result)) >> 31}
+
+
+
+    # Check whether the program has run past its last line.
+    @property
+    def done(self):
+        """
+        Tells whether the program has finished running, as opposed to not having started or having been
+        stopped by a limit on the number of instructions.
+
+        :return: True if the program counter is past the last line of the program, False otherwise.
+        """
+
+        return self.pc > len(self.code)
 
 
 
@@ -118,28 +466,10 @@ class Machine:
 
         """
 
-        # Get the value in the given register.
-        valr = self.registers[reg]
-
-        # Compare will modify the values of 'n' and/or 'z', as it determines the relationship between two
-        # numerical values based on their difference:
-
-        # Valr is greater than val:
-        if ((valr - val) > 0):
-            # The difference is not zero and non-negative.
-            self.flags['n'] = 0
-            self.flags['z'] = 0
-
-        # Valr is equal to val:
-        elif ((valr - val) == 0):
-            # The difference is zero.
-            self.flags['z'] = 1
-
-        # Valr is less than val:
-        else:
-            # The difference is not zero and negative.
-            self.flags['n'] = 1
-            self.flags['z'] = 0
+        # Keep the value in the given register and the given value. The flags are worked out from them only
+        # when they are needed.
+        self.cmpLeft = self.registers[reg]
+        self.cmpRight = val
 
 
 
@@ -258,186 +588,1762 @@ class Machine:
         """
 
         #Print the value in the given register
-        print(self.registers[retReg])
+        self.output(self.registers[retReg])
+        self.printed += 1
+
+
+
+    # Count the bits of a value the way the bit counting loop of the blubopt module does.
+    def popcnt(self, retReg, reg, bitReg):
+        """
+        Adds the number of bits set in the value of a register to the value of the given destination register,
+        and clears the register, if its value is greater than zero. This is what the loop
+            loop: cmpi reg, 0
+                  ble done
+                  andi bitReg, reg, 1
+                  add retReg, retReg, bitReg
+                  lsri reg, reg, 1
+                  b loop
+        does, and the blubopt module replaces such loops with this instruction.
+
+        :param retReg: A register to which the number of bits set is added.
+        :param reg: A register where the value whose bits are counted is found.
+        :param bitReg: A register which is left holding the last bit the loop would have taken out.
+
+        """
+
+        # Get the value in the given register.
+        valr = self.registers[reg]
+
+        # The loop only runs while the value is greater than zero. Its last bit taken out is the highest bit
+        # set, which is 1.
+        if valr > 0:
+            self.registers[retReg] = self.registers[retReg] + valr.bit_count()
+            self.registers[bitReg] = 1
+            self.registers[reg] = 0
+
+        # The loop ends by comparing the register with 0.
+        self.cmpLeft = self.registers[reg]
+        self.cmpRight = 0
+
+
+
+    # Get the data memory, or an empty one if the machine has none.
+    def memoryOrEmpty(self):
+        return self.memory if self.memory is not None else b''
+
+
+
+    # Load a word from the data memory.
+    def ldr(self, retReg, addrReg, *placeHolder):
+        """
+        Loads the 32-bit word at an address of the data memory into a given register.
+
+        :param retReg: A register into which the word is to be loaded.
+        :param addrReg: A register holding the address of the word.
+        :raises MemoryAccessError: If the word is not inside the data memory.
+
+        """
+
+        self.registers[retReg] = loadWord(self.memoryOrEmpty(), self.registers[addrReg], self.pc)
+
+
+
+    # Store a word in the data memory. The function is not called str, which is a built-in function.
+    def strw(self, reg, addrReg, *placeHolder):
+        """
+        Stores the value of a given register as a 32-bit word at an address of the data memory.
+
+        :param reg: The register whose value is to be stored.
+        :param addrReg: A register holding the address of the word.
+        :raises MemoryAccessError: If the word is not inside the data memory.
+
+        """
+
+        storeWord(self.memoryOrEmpty(), self.registers[addrReg], self.registers[reg], self.pc)
+
+
+
+    # Load a byte from the data memory.
+    def ldrb(self, retReg, addrReg, *placeHolder):
+        """
+        Loads the byte at an address of the data memory into a given register.
+
+        :param retReg: A register into which the byte is to be loaded.
+        :param addrReg: A register holding the address of the byte.
+        :raises MemoryAccessError: If the byte is not inside the data memory.
+
+        """
+
+        self.registers[retReg] = loadByte(self.memoryOrEmpty(), self.registers[addrReg], self.pc)
+
+
+
+    # Store a byte in the data memory.
+    def strb(self, reg, addrReg, *placeHolder):
+        """
+        Stores the lowest 8 bits of the value of a given register at an address of the data memory.
+
+        :param reg: The register whose value is to be stored.
+        :param addrReg: A register holding the address of the byte.
+        :raises MemoryAccessError: If the byte is not inside the data memory.
+
+        """
+
+        storeByte(self.memoryOrEmpty(), self.registers[addrReg], self.registers[reg], self.pc)
 
 
 
     # Initialize a dictionary of instructions and the operations they map to.
-    operators = {'cmpi':cmpi, 'b':b, 'andi': andi, 'add':add, 'lsri':lsri, 'movi':movi, 'prnt':prnt}
+    operators = {'cmpi':cmpi, 'b':b, 'andi': andi, 'add':add, 'lsri':lsri, 'movi':movi, 'prnt':prnt,
+                 'popcnt':popcnt, 'ldr':ldr, 'str':strw, 'ldrb':ldrb, 'strb':strb}
+
+    # Initialize a dictionary of the operations above and the opcodes they are decoded into, along with a
+    # dictionary of branch conditions and the opcodes of the branches that test them.
+    opcodes = {cmpi: OP_CMPI, b: OP_B, andi: OP_ANDI, add: OP_ADD, lsri: OP_LSRI, movi: OP_MOVI, prnt: OP_PRNT,
+               popcnt: OP_POPCNT, ldr: OP_LDR, strw: OP_STR, ldrb: OP_LDRB, strb: OP_STRB}
+    branches = {'': OP_B, 'gt': OP_BGT, 'ge': OP_BGE, 'eq': OP_BEQ, 'ne': OP_BNE, 'le': OP_BLE, 'lt': OP_BLT}
 
 
 
     # Instance methods:
-    # Add an instruction to the Machine object. This assumes that one who intends to do so is familiar with
-    # the general syntax of 'blub' instructions, and have taken that into account when defining their function.
-    def __setitem__(self, instrName, aFunction, noOfOps):
+    # Add an instruction to the Machine object, as in theMachine['mul'] = Operation('rrr', operator.mul). This
+    # assumes that one who intends to do so is familiar with the general syntax of 'blub' instructions, and
+    # have taken that into account when defining their function.
+    def __setitem__(self, instrName, anOperation, noOfOps=None):
         """
-        Adds an instruction definition to the Machine object.
+        Adds an instruction definition to the Machine object, or replaces one of its instructions. The program
+        is decoded again before it is next run.
 
         :param instrName: The name of the instruction.
-        :param aFunction: The function representing an instruction.
-        :param noOfOps: The number of operands the instruction has.
+        :param anOperation: An Operation object declaring the kinds of the operands of the instruction and the
+                            function it runs. A function representing an instruction is also accepted when the
+                            number of operands is given, in which case it is called with the machine and its
+                            operands work out as they do for the base instructions.
+        :param noOfOps: The number of operands of an instruction given as a function.
+        :raises ValueError: If the operands of the instruction are not valid.
+        :raises TypeError: If the instruction is not an Operation object or function.
 
         """
 
-        #First check whether the given number of operands is between 1 and 3.
-        if noOfOps < 1 or noOfOps > 3:
-            #We cannot add the instruction.
-            exit("Instruction must have at least one operand and at most three operands to be added.")
+        if noOfOps is not None:
+            #First check whether the given number of operands is between 1 and 3.
+            if noOfOps < 1 or noOfOps > 3:
+                #We cannot add the instruction.
+                raise ValueError("Instruction must have at least one operand and at most three operands to be added.")
+            function = anOperation
+            self.added.pop(instrName, None)
+        else:
+            if not isinstance(anOperation, Operation):
+                raise TypeError("An instruction is added as an Operation object, not as %s"
+                                % type(anOperation).__name__)
+            anOperation.check()
+            function = anOperation.function
+            noOfOps = len(anOperation.kinds)
+            self.added[instrName] = anOperation
 
         # Add the instruction to our dictionary of operators.
-        self.operators[instrName] = aFunction
+        self.operators[instrName] = function
 
-        #Add the instruction to the appropriate set based on its number of operands.
+        #Add the instruction to the appropriate set based on its number of operands, and to no other.
+        for names in self.Ops.values():
+            names.discard(instrName)
         self.Ops['ops' + str(noOfOps)].add(instrName)
 
+        self.decoded = None
+
 
 
     # Delete an instruction in the Machine object.
     # NB:// For those instructions we have defined within this class, we need not have them removed as their
     # definitions would still remain within the class. Let us consider them base instructions and allow the
-    # deletion of added instructions.
+    # deletion of added instructions. Deleting a base instruction that was replaced puts it back.
     def __delitem__(self, instrName):
         """
         Removes an instruction definition from the Machine object if it is not a base instruction defined
         within the class.
 
         :param instrName: The name of the instruction to be removed.
+        :raises KeyError: If the machine has no such instruction.
+        :raises ValueError: If the instruction is a base instruction that has not been replaced.
 
         """
-        if not (instrName in {x for x in self.operators.keys()} ):
+
+        if not (instrName in self.operators.keys()):
+            raise KeyError(instrName)
+
+        isBase = instrName in Machine.operators.keys()
+        if isBase and self.operators[instrName] is Machine.operators[instrName] and not (instrName in self.added.keys()):
+            raise ValueError("Base instruction '%s' cannot be removed" % instrName)
+
+        for names in self.Ops.values():
+            names.discard(instrName)
+
+        if isBase:
+            self.operators[instrName] = Machine.operators[instrName]
+            for (kind, names) in Machine.Ops.items():
+                if instrName in names:
+                    self.Ops[kind].add(instrName)
+        else:
             del self.operators[instrName]
 
+        self.added.pop(instrName, None)
+        self.decoded = None
 
 
-    # Define decorators for error checking based on the number of operands an instruction has.
-    def ops1error(self, anInstruction):
-        def check(self, *args):
-            # There are more operands than required.
-            # A non-register was passed for a non-branch instruction.
-            # A non-existent label was passed for a branch instruction.
-            # A non-existent condition was passed for a branch instruction.
 
-            if (anInstruction.__name__ != 'b' and args[1]) or args[2] \
-                    or (anInstruction.__name__ != 'b' and (args[0][:1] != 'r' or (not args[0][1:].isdigit()))) \
-                    or (anInstruction.__name__ == 'b' and (not args[0] in self.code.labelLocator.keys()))\
-                    or (anInstruction.__name__ == 'b' and args[1] and (not args[1] in self.conditions.keys())):
-                exit("Error: " + anInstruction.__name__)
+    # Check whether an operand is written as a register, i.e. an 'r' succeeded by a number.
+    @staticmethod
+    def isRegister(operand):
+        """
+        Checks whether the given operand names a register.
 
-            else:
-                # Get the operand values and convert them to numbers (if appropriate) so they can be used to
-                # execute the respective instruction:
-
-                # Accommodate a 'b' instruction so that a label string is captured.
-                op1 = (int(args[0].replace('r', '')) if anInstruction.__name__ != 'b'
-                       else args[0])
-                # Accommodate a 'b' instruction so that any condition if it exists is captured.
-                op2 = args[1]
-
-                return anInstruction(self, op1, op2)
-        return check
-
-
-    def ops2error(self, anInstruction):
-        def check(self,*args):
-            # There are more or less operands than required.
-            # Non-registers were passed for register instructions.
-            # Non-integer was passed for immediate instruction's last operand.
-            if (not args[1]) or args[2]\
-                     or args[0][:1] != 'r' or (not args[0][1:].isdigit())\
-                     or (anInstruction.__name__[-1] != 'i' and (args[1][:1] != 'r' or (not args[1][1:].isdigit()))) \
-                     or (anInstruction.__name__[-1] == 'i' and (not args[1].isdigit())):
-                exit("Error: " + anInstruction.__name__)
+        :param operand: An operand string from an Instruction object.
+        :return: True if the operand is an 'r' succeeded by a number, False otherwise.
+        """
 
-            else:
-                # Get the operand values and convert them to numbers (if appropriate) so they can be used to
-                # execute the respective instruction:
-                op1 = int(args[0].replace('r', ''))
-                op2 = int(args[1].replace('r', ''))
-
-                return anInstruction(self, op1, op2)
-        return check
-
-
-    def ops3error(self, anInstruction):
-        def check(self, *args):
-            # There are less operands than required.
-            # NB// We only expect a maximum of 3 operand inputs based on the structure of an Instruction object.
-            # Non-registers were passed for register instructions.
-            # Non-integer was passed for immediate instruction's last operand.
-            if not args[1] or not args[2]\
-                     or args[0][:1] != 'r' or (not args[0][1:].isdigit())\
-                     or args[1][:1] != 'r' or (not args[1][1:].isdigit())\
-                     or (anInstruction.__name__[-1] == 'i' and (not args[2].isdigit()))\
-                     or (anInstruction.__name__[-1] != 'i' and (args[2][:1] != 'r' or (not args[2][1:].isdigit()))):
-                exit("Error: " + anInstruction.__name__)
+        return operand[:1] == 'r' and operand[1:].isdigit()
 
-            else:
-                # Get the operand values and convert them to numbers so they can be used to
-                # execute the respective instruction:
-                op1 = int(args[0].replace('r', ''))
-                op2 = int(args[1].replace('r', ''))
-                op3 = int(args[2].replace('r', ''))
 
-                return anInstruction(self, op1, op2, op3)
-        return check
+
+    # Decode a single instruction into its opcode and resolved operands.
+    def decodeInstruction(self, anInstruction):
+        """
+        Validates an Instruction object and converts it into a tuple of an integer opcode and three integer
+        operands. Registers are resolved to their numbers, immediates to their values and branch labels to
+        the line number they point to.
+
+        :param anInstruction: The Instruction object to decode.
+        :return: A tuple (opcode, a, b, c) that can be run by the interpreter loop.
+        :raises InstructionError: If the instruction is not valid, listing every problem found with it.
+        """
+
+        name = anInstruction.instruction
+        args = (anInstruction.op1, anInstruction.op2, anInstruction.op3)
+
+        # First check whether the line has an instruction, the instruction is defined in the machine, and
+        # it has at least one operand.
+        if name == '':
+            raise InstructionError(["missing instruction"])
+        if not (name in self.operators.keys()):
+            raise InstructionError(["unknown instruction '%s'" % name])
+        if args[0] == '':
+            raise InstructionError(["missing operands"])
+
+        # Work out what each operand has to be: 'r' for a register, 'i' for an immediate value and 'l' for a
+        # label. Instructions added as Operation objects declare their kinds, and otherwise instructions ending
+        # in 'i' take an immediate value as their last operand.
+        anOperation = self.added.get(name)
+        if anOperation is not None:
+            kinds = anOperation.kinds
+        elif name in self.Ops['ops1']:
+            kinds = 'l' if name == 'b' else 'r'
+        elif name in self.Ops['ops2']:
+            kinds = 'ri' if name[-1] == 'i' else 'rr'
+        else:
+            kinds = 'rri' if name[-1] == 'i' else 'rrr'
+
+        # Check every operand, so that all of the problems with the instruction are reported together.
+        problems = []
+
+        for (position, operand) in enumerate(args, 1):
+            kind = kinds[position - 1:position]
+
+            if not kind:
+                if operand:
+                    problems.append("too many operands, %s takes %d" % (name, len(kinds)))
+                    break
+            elif not operand:
+                problems.append("missing operand %d" % position)
+            elif kind == 'r' and not self.isRegister(operand):
+                problems.append("operand %d must be a register, not '%s'" % (position, operand))
+            elif kind == 'r' and int(operand[1:]) >= len(self.registers):
+                problems.append("register %s does not exist, the registers are r0 to r%d"
+                                % (operand, len(self.registers) - 1))
+            elif kind == 'i' and not operand.isdigit():
+                problems.append("operand %d must be an immediate value, not '%s'" % (position, operand))
+            elif kind == 'l' and not (operand in self.code.labelLocator.keys()):
+                problems.append("undefined label '%s'" % operand)
+
+        if name == 'b' and anOperation is None and anInstruction.condition and not (anInstruction.condition in self.conditions.keys()):
+            problems.append("unknown condition '%s'" % anInstruction.condition)
+
+        if problems:
+            raise InstructionError(problems)
+
+        # An instruction added as an Operation object has its labels resolved to their line numbers. One that
+        # works out the value of a register is decoded into the opcode for its operand kinds, with the number of
+        # its function kept above the register in its first operand, so that the engines call it directly.
+        if anOperation is not None:
+            operands = tuple(self.code.labelLocator[operand] if kind == 'l'
+                             else int(operand[1:]) if kind == 'r' else int(operand)
+                             for (kind, operand) in zip(kinds, args))
+
+            if anOperation.machine:
+                self.extensions.append((anOperation.function, operands))
+                return (OP_EXT, len(self.extensions) - 1, 0, 0)
+
+            self.functions.append(anOperation.function)
+            operands += (0,) * (3 - len(operands))
+            return (callOpcodes[kinds], operands[0] | ((len(self.functions) - 1) << 5), operands[1], operands[2])
+
+        # Gather the operands in the order in which the instruction functions expect them. A 'b' instruction
+        # has its label resolved to its line number, and any condition is kept as is.
+        if name in self.Ops['ops1']:
+            operands = ((int(args[0][1:]), anInstruction.condition) if name != 'b'
+                        else (self.code.labelLocator[args[0]], anInstruction.condition))
+        elif name in self.Ops['ops2']:
+            operands = (int(args[0][1:]), int(args[1].replace('r', '')))
+        else:
+            operands = (int(args[0][1:]), int(args[1][1:]), int(args[2].replace('r', '')))
+
+        # Look up the opcode of the instruction. Instructions that have been added to (or replaced in) the
+        # operators dictionary are not known to the interpreter loop, so they are called through the
+        # extension table with the operands they would have been given before decoding.
+        opcode = self.opcodes.get(self.operators[name])
+
+        if opcode is None:
+            self.extensions.append((self.operators[name], operands))
+            return (OP_EXT, len(self.extensions) - 1, 0, 0)
+
+        # A branch gets its own opcode for each condition, with the target line number as its operand.
+        if opcode == OP_B:
+            return (self.branches[operands[1]], operands[0], 0, 0)
+
+        # The condition kept for other single operand instructions is always empty, so it is left out.
+        if name in self.Ops['ops1']:
+            return (opcode, operands[0], 0, 0)
+
+        return (opcode,) + operands + (0,) * (3 - len(operands))
+
+
+
+    # Decode the whole program.
+    def decode(self):
+        """
+        Validates every instruction of the program once and converts the program into a list of decoded
+        instructions indexed by line number. Index 0 and the index after the last line hold a halt
+        instruction, so the interpreter loop never has to check the program counter against the program length.
+
+        :return: The list of decoded instructions.
+        :raises VerificationError: If any instruction is not valid, listing every problem in the program.
+        """
+
+        # Start fresh tables of calls to instructions not known to the interpreter loop, and of the functions
+        # of added instructions.
+        self.extensions = []
+        self.functions = []
+
+        decoded = [(OP_HALT, 0, 0, 0)]
+        diagnostics = []
+
+        # Every line is checked before any of them is run, and all of the problems found are reported at once.
+        for lineNum in range(1, len(self.code) + 1):
+            anInstruction = self.code[lineNum]
+            try:
+                decoded.append(self.decodeInstruction(anInstruction))
+            except InstructionError as anError:
+                diagnostics += [Diagnostic(lineNum, str(anInstruction).strip(), aProblem)
+                                for aProblem in anError.problems]
+                decoded.append((OP_HALT, 0, 0, 0))
+
+        if diagnostics:
+            raise VerificationError(diagnostics)
+
+        decoded.append((OP_HALT, 0, 0, 0))
+
+        return self.fuseCompares(decoded)
+
+
+
+    # Fuse the compares of a decoded program with the conditional branches that follow them.
+    @staticmethod
+    def fuseCompares(decoded):
+        """
+        Fuses every compare that is followed by a conditional branch into a compare-and-branch, which keeps
+        the branch target as its third operand. The branch is left in place, since it may be jumped to.
+
+        :param decoded: The list of decoded instructions, which is changed in place.
+        :return: The same list.
+        """
+
+        for pc in range(1, len(decoded) - 1):
+            if decoded[pc][0] == OP_CMPI and decoded[pc + 1][0] in fusedBranches:
+                decoded[pc] = (fusedBranches[decoded[pc + 1][0]], decoded[pc][1], decoded[pc][2],
+                               decoded[pc + 1][1])
+
+        return decoded
+
+
+
+    # Check the whole program for errors without running it.
+    def verify(self):
+        """
+        Checks every instruction of the program for unknown instructions, missing or extra operands, operands
+        of the wrong kind, registers that do not exist and branches to labels that are not declared.
+
+        :return: A list of Diagnostic objects, one for each problem found, in line order. The list is empty if
+                 the program has no errors, in which case the decoded program is kept for running it.
+        """
+
+        try:
+            self.decoded = self.decode()
+        except VerificationError as anError:
+            return anError.diagnostics
+
+        return []
 
 
 
     # Interpret and run the program.
-    def interpret(self):
+    def interpret(self, limit=None):
+        """
+        Runs the program from the current program counter until it runs past its last line.
+        The program is decoded before the first run, so the loop below only works with integers. Counting
+        loops are run all at once unless the fastForward variable is False, see the blubloop module.
+
+        :param limit: The number of instructions after which to stop, or None to run to the end. The limit is
+                      only checked when the program counter jumps, so the run stops at the end of the block in
+                      which it is reached. A stopped run carries on from where it stopped the next time this
+                      method is called, and the done property tells whether the program has finished.
+        """
 
-        # Interpret the instructions of the program until there are no more instructions to do so.
-        while self.pc <= len(self.code):
-            # Work on each of the lines of the program, accessing them by line number.
-
-            # First check whether the line has an instruction, the instruction is defined in the machine, and
-            # it has at least one operand.
-            if self.code[self.pc].instruction != '' and self.code[self.pc].op1 != '' and \
-                self.code[self.pc].instruction in self.operators.keys():
-
-                # We can work on the instruction. At this point we know that the instruction should at
-                # least have one operation.
-
-                #Add the relevant decorator to the function based on its number of operands.
-                if self.code[self.pc].instruction in self.Ops['ops1']:
-                    #Add the appropriate decorator:
-                    self.ops1error(self.operators[self.code[self.pc].instruction])(self, self.code[self.pc].op1,
-                                                                   self.code[self.pc].condition,
-                                                                   self.code[self.pc].op2)
-
-                elif self.code[self.pc].instruction in self.Ops['ops2']:
-                    #Add the appropriate decorator:
-                    self.ops2error(self.operators[self.code[self.pc].instruction])(self, self.code[self.pc].op1,
-                                                                   self.code[self.pc].op2,
-                                                                   self.code[self.pc].op3)
+        # A traced run is recorded by a loop of its own, so that this one does not change when tracing.
+        if self.trace is not None:
+            self.interpretTraced(limit)
+            return
+
+        # Decode the program if it has not been decoded already.
+        if self.decoded is None:
+            self.decoded = self.decode()
+
+        # Keep everything the loop needs in local variables to avoid attribute lookups on every step.
+        code, loops = self.findLoops() if self.fastForward else (self.decoded, None)
+        registers = self.registers
+        extensions = self.extensions
+        functions = self.functions
+        output = self.output
+        memory = self.memoryOrEmpty()
+        memoryEnd = len(memory)
+        unpackWord = wordLayout.unpack_from
+        packWord = wordLayout.pack_into
+        pc = self.pc
+        left = self.cmpLeft
+        right = self.cmpRight
+
+        # The number of instructions run is counted a block at a time: whenever the program counter jumps,
+        # the instructions from the start of the current block up to the jump are added to the count.
+        steps = self.steps
+        printed = self.printed
+        start = pc
+        stopAt = steps + limit if limit is not None else sys.maxsize
 
+        # Interpret the instructions of the program until there are no more instructions to do so.
+        # NB:// The most frequently run instructions are checked first.
+        while True:
+            op, a, b, c = code[pc]
+
+            if op == OP_ADD:
+                registers[a] = registers[b] + registers[c]
+                pc += 1
+
+            elif op == OP_ANDI:
+                registers[a] = registers[b] & c
+                pc += 1
+
+            elif op == OP_LSRI:
+                registers[a] = registers[b] >> c
+                pc += 1
+
+            # An added instruction works out the value of its register with its function, which is kept above
+            # the register in its first operand. Their opcodes come last, so they are told apart with one test.
+            elif op >= OP_CALLRR:
+                if op == OP_CALLRRR:
+                    registers[a & 31] = functions[a >> 5](registers[b], registers[c])
+                elif op == OP_CALLRRI:
+                    registers[a & 31] = functions[a >> 5](registers[b], c)
+                elif op == OP_CALLRR:
+                    registers[a & 31] = functions[a >> 5](registers[b])
+                else:
+                    registers[a & 31] = functions[a >> 5](b)
+                pc += 1
+
+            elif op == OP_B:
+                steps += pc - start + 1
+                pc = start = a
+                if steps >= stopAt:
+                    break
+
+            # A compare-and-branch runs the compare and the branch after it, so it counts as two instructions.
+            elif op == OP_CMPBLE:
+                left = registers[a]
+                right = b
+                if left <= right:
+                    steps += pc - start + 2
+                    pc = start = c
+                    if steps >= stopAt:
+                        break
+                else:
+                    pc += 2
+
+            elif op == OP_CMPBGT:
+                left = registers[a]
+                right = b
+                if left > right:
+                    steps += pc - start + 2
+                    pc = start = c
+                    if steps >= stopAt:
+                        break
+                else:
+                    pc += 2
+
+            elif op == OP_CMPBEQ:
+                left = registers[a]
+                right = b
+                if left == right:
+                    steps += pc - start + 2
+                    pc = start = c
+                    if steps >= stopAt:
+                        break
+                else:
+                    pc += 2
+
+            elif op == OP_CMPBNE:
+                left = registers[a]
+                right = b
+                if left != right:
+                    steps += pc - start + 2
+                    pc = start = c
+                    if steps >= stopAt:
+                        break
+                else:
+                    pc += 2
+
+            elif op == OP_CMPBGE:
+                left = registers[a]
+                right = b
+                if left >= right:
+                    steps += pc - start + 2
+                    pc = start = c
+                    if steps >= stopAt:
+                        break
+                else:
+                    pc += 2
+
+            elif op == OP_CMPBLT:
+                left = registers[a]
+                right = b
+                if left < right:
+                    steps += pc - start + 2
+                    pc = start = c
+                    if steps >= stopAt:
+                        break
+                else:
+                    pc += 2
+
+            elif op == OP_MOVI:
+                registers[a] = b
+                pc += 1
+
+            elif op == OP_CMPI:
+                # Compare only keeps the two values, the flags are worked out from them when they are needed.
+                left = registers[a]
+                right = b
+                pc += 1
+
+            elif op == OP_BLE:
+                if left <= right:
+                    steps += pc - start + 1
+                    pc = start = a
+                    if steps >= stopAt:
+                        break
+                else:
+                    pc += 1
+
+            elif op == OP_BGT:
+                if left > right:
+                    steps += pc - start + 1
+                    pc = start = a
+                    if steps >= stopAt:
+                        break
+                else:
+                    pc += 1
+
+            elif op == OP_BEQ:
+                if left == right:
+                    steps += pc - start + 1
+                    pc = start = a
+                    if steps >= stopAt:
+                        break
+                else:
+                    pc += 1
+
+            elif op == OP_BNE:
+                if left != right:
+                    steps += pc - start + 1
+                    pc = start = a
+                    if steps >= stopAt:
+                        break
+                else:
+                    pc += 1
+
+            elif op == OP_BGE:
+                if left >= right:
+                    steps += pc - start + 1
+                    pc = start = a
+                    if steps >= stopAt:
+                        break
+                else:
+                    pc += 1
+
+            elif op == OP_BLT:
+                if left < right:
+                    steps += pc - start + 1
+                    pc = start = a
+                    if steps >= stopAt:
+                        break
                 else:
-                    #Add the appropriate decorator:
-                    self.ops3error(self.operators[self.code[self.pc].instruction])(self, self.code[self.pc].op1,
-                                                                   self.code[self.pc].op2,
-                                                                   self.code[self.pc].op3)
+                    pc += 1
+
+            elif op == OP_PRNT:
+                output(registers[a])
+                printed += 1
+                pc += 1
+
+            elif op == OP_POPCNT:
+                left = registers[b]
+                if left > 0:
+                    registers[a] = registers[a] + left.bit_count()
+                    registers[c] = 1
+                    registers[b] = left = 0
+                right = 0
+                pc += 1
+
+            # Loads and stores check that the address is inside the data memory, since a negative one would
+            # count back from its end.
+            elif op == OP_LDR:
+                address = registers[b]
+                if not (0 <= address <= memoryEnd - 4):
+                    raise MemoryAccessError(pc, address, memoryEnd)
+                registers[a] = unpackWord(memory, address)[0]
+                pc += 1
+
+            elif op == OP_STR:
+                address = registers[b]
+                if not (0 <= address <= memoryEnd - 4):
+                    raise MemoryAccessError(pc, address, memoryEnd)
+                packWord(memory, address, registers[a])
+                pc += 1
+
+            elif op == OP_LDRB:
+                address = registers[b]
+                if not (0 <= address < memoryEnd):
+                    raise MemoryAccessError(pc, address, memoryEnd)
+                registers[a] = memory[address]
+                pc += 1
+
+            elif op == OP_STRB:
+                address = registers[b]
+                if not (0 <= address < memoryEnd):
+                    raise MemoryAccessError(pc, address, memoryEnd)
+                memory[address] = registers[a] & 0xFF
+                pc += 1
+
+            elif op == OP_LOOP:
+                # Run a counting loop all at once if what it does can be worked out, and otherwise run the
+                # compare-and-branch it is tested by as usual. See the blubloop module.
+                aLoop = loops[a]
+                ran = aLoop.run(registers, pc, start, steps, stopAt)
+                if ran is not None:
+                    pc, start, steps, left, right = ran
+                    if steps >= stopAt:
+                        break
+                else:
+                    left = registers[aLoop.register]
+                    right = aLoop.bound
+                    if aLoop.compare(left, right):
+                        steps += pc - start + 2
+                        pc = start = aLoop.target
+                        if steps >= stopAt:
+                            break
+                    else:
+                        pc += 2
+
+            elif op == OP_EXT:
+                # Call an added instruction the same way the original interpreter did, letting it change the
+                # program counter before it is incremented, and letting it use and change the compare.
+                self.pc = pc
+                self.cmpLeft = left
+                self.cmpRight = right
+                self.printed = printed
+                anInstruction, operands = extensions[a]
+                anInstruction(self, *operands)
+                left = self.cmpLeft
+                right = self.cmpRight
+                printed = self.printed
+
+                # Count the current block if the instruction jumped somewhere else.
+                if self.pc != pc:
+                    steps += pc - start + 1
+                    pc = start = self.pc + 1
+                    if steps >= stopAt:
+                        break
+                else:
+                    pc += 1
+
+            else:
+                # We have run past the last line of the program.
+                steps += pc - start
+                break
+
+        # Keep the state of the machine so that it can be inspected after the run.
+        self.pc = pc
+        self.steps = steps
+        self.printed = printed
+        self.cmpLeft = left
+        self.cmpRight = right
+
+
+
+    # Find the counting loops of the decoded program.
+    def findLoops(self):
+        """
+        Finds the counting loops of the decoded program, which the interpreter runs all at once rather than
+        one step at a time. They are found again whenever the decoded program is replaced.
+
+        :return: A tuple of the decoded program with the compare-and-branch of every counting loop replaced by
+                 an OP_LOOP instruction, and the list of blubloop.CountingLoop objects they refer to.
+        """
+
+        # Loops are only looked for when they are fast-forwarded.
+        import blubloop
+
+        if self.loopCode is None or self.loopCode[0] is not self.decoded:
+            self.loopCode = (self.decoded,) + blubloop.findLoops(self.decoded)
+
+        return self.loopCode[1:]
+
+
+
+    # Work out where a reset machine starts and the registers it starts with.
+    def startState(self):
+        """
+        Works out the state the program is in once it has run the movi instructions it starts with. These
+        lines are only ever run once, at the start, when no branch leads back to them, so a reset machine
+        starts after them with their values already in its registers.
+
+        :return: A tuple of the line number after the movi instructions and an array of the starting registers.
+        """
+
+        # Decode the program if it has not been decoded already.
+        if self.decoded is None:
+            self.decoded = self.decode()
+
+        if self.startCode is None or self.startCode[0] is not self.decoded:
+            code = self.decoded
+            targets = {a for (op, a, b, c) in code if OP_B <= op <= OP_BLT} \
+                      | {c for (op, a, b, c) in code if OP_CMPBGT <= op <= OP_CMPBLT}
+
+            # An added instruction may branch anywhere, so nothing is skipped in programs that use one.
+            pc = 1
+            startRegisters = array.array('i', bytes(4 * 32))
+            while code[pc][0] == OP_MOVI and not (pc in targets) and not self.extensions:
+                startRegisters[code[pc][1]] = code[pc][2]
+                pc += 1
+
+            self.startCode = (self.decoded, pc, startRegisters)
+
+        return self.startCode[1:]
+
+
+
+    # Put the machine back to the start of the program.
+    def reset(self, inputs=None):
+        """
+        Puts the machine back to the start of the program, with the registers, compare and counts it starts
+        with, so that the program can be run again without parsing or decoding it again. The registers are
+        changed in place.
+
+        :param inputs: A dictionary of register numbers and the values they start with, or None. A register
+                       given a value keeps it when the program starts by moving a value into it, so the movi
+                       instructions a program starts with act as the values of its inputs when none are given.
+        :raises OverflowError: If a value does not fit in a register.
+        """
+
+        pc, startRegisters = self.startState()
+
+        self.registers[:] = startRegisters
+        if inputs:
+            for (reg, value) in inputs.items():
+                self.registers[reg] = value
+
+        # The movi instructions skipped still count as instructions run.
+        self.pc = pc
+        self.steps = pc - 1
+        self.printed = 0
+        self.cmpLeft = 0
+        self.cmpRight = -1
+
+
+
+    # Interpret and run the program within limits on the instructions it runs, its time and its output.
+    def interpretWithBudget(self, maxSteps=None, timeout=None, maxOutput=None, sliceSize=10000):
+        """
+        Runs the program from the current program counter until it runs past its last line or goes over one
+        of its budgets. The program is run in slices of about sliceSize instructions, and the budgets are
+        checked when the program counter jumps and between slices, so checking them costs next to nothing.
+        A run stops at the end of the block in which its instruction budget runs out, and within a slice of
+        its deadline. Values printed beyond the output budget are dropped.
+
+        :param maxSteps: The most instructions to run, or None for no limit.
+        :param timeout: The most seconds to run for, or None for no limit.
+        :param maxOutput: The most values to print, or None for no limit.
+        :param sliceSize: The number of instructions to run between checks of the deadline.
+        :return: A RunResult object describing how the run ended.
+        """
+
+        deadline = time.perf_counter() + timeout if timeout is not None else None
+        output = self.output
+        printed = [0]
+
+        # Count the values printed, and drop the ones beyond the output budget.
+        def countOutput(value):
+            if maxOutput is None or printed[0] < maxOutput:
+                output(value)
+            printed[0] += 1
+
+        self.output = countOutput
+        status = 'done'
+
+        try:
+            while True:
+                limit = sliceSize if maxSteps is None else min(sliceSize, maxSteps - self.steps)
+                self.interpret(limit)
+
+                if self.done:
+                    break
+                if maxSteps is not None and self.steps >= maxSteps:
+                    status = 'steps'
+                    break
+                if maxOutput is not None and printed[0] > maxOutput:
+                    status = 'output'
+                    break
+                if deadline is not None and time.perf_counter() >= deadline:
+                    status = 'deadline'
+                    break
+        finally:
+            self.output = output
+
+        # A program that printed too much in its last slice still went over its budget.
+        if status == 'done' and maxOutput is not None and printed[0] > maxOutput:
+            status = 'output'
+
+        return RunResult(status, self.pc, self.steps, list(self.registers), printed[0])
+
+
+
+    # Get the hash of the program.
+    def hashProgram(self):
+        """
+        Works out a hash of the text of the program, the first time it is needed.
+
+        :return: The SHA-256 hash of the program as bytes.
+        """
+
+        if self.programHash is None:
+            self.programHash = hashlib.sha256(str(self.code).encode()).digest()
+
+        return self.programHash
+
+
+
+    # Take a checkpoint of the state of the machine.
+    def checkpoint(self):
+        """
+        Saves the state of the machine, so that a run can be carried on from where it is later, even in
+        another process. The checkpoint holds the program counter, the registers, the compare, the number of
+        instructions run and values printed, and a hash of the program so that it is only restored for the
+        same program. Taking a checkpoint only packs a few numbers, apart from hashing the program the first
+        time.
+
+        :return: The checkpoint as bytes.
+        """
+
+        # A compare with an immediate value too large for the checkpoint gives the same result with the
+        # largest value that fits, since registers are much smaller.
+        limit = 2 ** 63 - 1
+        left, right = (max(-limit, min(limit, value)) for value in (self.cmpLeft, self.cmpRight))
+
+        return checkpointLayout.pack(CHECKPOINT_MAGIC, CHECKPOINT_VERSION, self.hashProgram(), self.pc, self.steps,
+                                     self.printed, left, right, *self.registers)
+
+
+
+    # Restore the state of the machine from a checkpoint.
+    def restore(self, aCheckpoint):
+        """
+        Restores the state of the machine saved by checkpoint, so that the next run carries on from there.
+
+        :param aCheckpoint: The checkpoint as bytes.
+        :raises CheckpointError: If the checkpoint is damaged or was taken of a different program.
+        """
+
+        if len(aCheckpoint) != checkpointLayout.size:
+            raise CheckpointError("The checkpoint is damaged.")
+
+        fields = checkpointLayout.unpack(aCheckpoint)
+        magic, version, programHash = fields[:3]
+
+        if magic != CHECKPOINT_MAGIC or version != CHECKPOINT_VERSION:
+            raise CheckpointError("The checkpoint is damaged or of another version.")
+
+        if programHash != self.hashProgram():
+            raise CheckpointError("The checkpoint was taken of a different program.")
+
+        self.pc, self.steps, self.printed, self.cmpLeft, self.cmpRight = fields[3:8]
+        self.registers[:] = array.array('i', fields[8:])
+
+
+
+    # Save a checkpoint of the machine to a file.
+    def saveCheckpoint(self, aFile):
+        """
+        Writes a checkpoint of the machine to a file. The checkpoint is written to a temporary file first and
+        then moved into place, so the file always holds a whole checkpoint even if the process is stopped.
+
+        :param aFile: The name of the checkpoint file.
+        """
+
+        handle, tempPath = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(aFile)), suffix='.tmp')
+        with os.fdopen(handle, 'wb') as tempFile:
+            tempFile.write(self.checkpoint())
+        os.replace(tempPath, aFile)
+
 
-                # Update the program counter:
-                self.pc += 1
 
-            # The line of code has not met the minimum requirements for interpretation.
+    # Interpret and run the program, saving a checkpoint every so many instructions.
+    def interpretWithCheckpoints(self, aFile, interval=1000000):
+        """
+        Runs the program from the current program counter until it runs past its last line, saving a checkpoint
+        to a file about every interval instructions. If the file already holds a checkpoint of the program, the
+        run carries on from it. The file is removed once the program has finished.
+
+        :param aFile: The name of the checkpoint file.
+        :param interval: The number of instructions to run between checkpoints.
+        :return: True if the run carried on from a checkpoint, False if it started from the beginning.
+        :raises CheckpointError: If the file holds a checkpoint that cannot be restored.
+        """
+
+        resumed = os.path.exists(aFile)
+        if resumed:
+            with open(aFile, 'rb') as theFile:
+                self.restore(theFile.read())
+
+        self.interpret(interval)
+        while not self.done:
+            self.saveCheckpoint(aFile)
+            self.interpret(interval)
+
+        if os.path.exists(aFile):
+            os.remove(aFile)
+
+        return resumed
+
+
+
+    # Interpret and run the program as an asyncio task that lets other tasks run as it goes.
+    async def interpretAsync(self, sliceSize=10000):
+        """
+        Runs the program from the current program counter until it runs past its last line, in slices of
+        about sliceSize instructions, handing control back to the asyncio event loop after every slice so
+        that a long program does not keep other tasks from running.
+
+        :param sliceSize: The number of instructions to run before letting other tasks run.
+        """
+
+        self.interpret(sliceSize)
+
+        while not self.done:
+            await asyncio.sleep(0)
+            self.interpret(sliceSize)
+
+
+
+    # Create the function that runs a single decoded instruction for the threaded interpreter.
+    def threadInstruction(self, pc, op, a, b, c, counter, compared):
+        """
+        Creates a function that runs one decoded instruction and returns the line number of the next
+        instruction to run. The registers and operands are bound into the function when it is created.
+
+        :param pc: The line number of the instruction.
+        :param op: The opcode of the instruction.
+        :param a: The first decoded operand.
+        :param b: The second decoded operand.
+        :param c: The third decoded operand.
+        :param counter: A list holding the instruction count, the line number the current block started at and
+                        the number of values printed.
+        :param compared: A list holding the two values of the last compare.
+        :return: A function that takes no arguments and returns the next line number.
+        """
+
+        registers = self.registers
+        output = self.output
+        memory = self.memoryOrEmpty()
+        nextPc = pc + 1
+
+        if op == OP_ADD:
+            def run():
+                registers[a] = registers[b] + registers[c]
+                return nextPc
+
+        elif op == OP_ANDI:
+            def run():
+                registers[a] = registers[b] & c
+                return nextPc
+
+        elif op == OP_LSRI:
+            def run():
+                registers[a] = registers[b] >> c
+                return nextPc
+
+        elif op == OP_MOVI:
+            def run():
+                registers[a] = b
+                return nextPc
+
+        elif op == OP_PRNT:
+            def run():
+                output(registers[a])
+                counter[2] += 1
+                return nextPc
+
+        elif op == OP_CMPI:
+            def run():
+                compared[0] = registers[a]
+                compared[1] = b
+                return nextPc
+
+        elif op == OP_POPCNT:
+            def run():
+                value = registers[b]
+                if value > 0:
+                    registers[a] = registers[a] + value.bit_count()
+                    registers[c] = 1
+                    registers[b] = value = 0
+                compared[0] = value
+                compared[1] = 0
+                return nextPc
+
+        elif op == OP_LDR:
+            def run():
+                registers[a] = loadWord(memory, registers[b], pc)
+                return nextPc
+
+        elif op == OP_STR:
+            def run():
+                storeWord(memory, registers[b], registers[a], pc)
+                return nextPc
+
+        elif op == OP_LDRB:
+            def run():
+                registers[a] = loadByte(memory, registers[b], pc)
+                return nextPc
+
+        elif op == OP_STRB:
+            def run():
+                storeByte(memory, registers[b], registers[a], pc)
+                return nextPc
+
+        elif op in (OP_CALLRRR, OP_CALLRRI, OP_CALLRR, OP_CALLRI):
+            function = self.functions[a >> 5]
+            reg = a & 31
+
+            if op == OP_CALLRRR:
+                def run():
+                    registers[reg] = function(registers[b], registers[c])
+                    return nextPc
+            elif op == OP_CALLRRI:
+                def run():
+                    registers[reg] = function(registers[b], c)
+                    return nextPc
+            elif op == OP_CALLRR:
+                def run():
+                    registers[reg] = function(registers[b])
+                    return nextPc
             else:
-                # Exit out of the program since an error was encountered.
-                exit("Error: Improperly formatted instruction encountered. Cannot interpret the program.")
+                def run():
+                    registers[reg] = function(b)
+                    return nextPc
+
+        elif op == OP_B:
+            # A branch that is taken counts the instructions of the block that ends with it.
+            def run():
+                counter[0] += pc - counter[1] + 1
+                counter[1] = a
+                return a
+
+        elif op == OP_EXT:
+            anInstruction, operands = self.extensions[a]
+
+            def run():
+                self.pc = pc
+                self.cmpLeft, self.cmpRight = compared
+                self.printed = counter[2]
+                anInstruction(self, *operands)
+                compared[0] = self.cmpLeft
+                compared[1] = self.cmpRight
+                counter[2] = self.printed
+                if self.pc == pc:
+                    return nextPc
+                counter[0] += pc - counter[1] + 1
+                counter[1] = self.pc + 1
+                return self.pc + 1
+
+        elif op == OP_HALT:
+            # Line 0 is never run, so returning it stops the interpreter loop.
+            def run():
+                counter[0] += pc - counter[1]
+                return 0
+
+        # A compare-and-branch runs the compare and the branch after it, so it counts as two instructions.
+
+        elif op == OP_CMPBLE:
+            def run():
+                compared[0] = left = registers[a]
+                compared[1] = b
+                if left <= b:
+                    counter[0] += pc - counter[1] + 2
+                    counter[1] = c
+                    return c
+                return nextPc + 1
+
+        elif op == OP_CMPBGT:
+            def run():
+                compared[0] = left = registers[a]
+                compared[1] = b
+                if left > b:
+                    counter[0] += pc - counter[1] + 2
+                    counter[1] = c
+                    return c
+                return nextPc + 1
+
+        elif op == OP_CMPBEQ:
+            def run():
+                compared[0] = left = registers[a]
+                compared[1] = b
+                if left == b:
+                    counter[0] += pc - counter[1] + 2
+                    counter[1] = c
+                    return c
+                return nextPc + 1
+
+        elif op == OP_CMPBNE:
+            def run():
+                compared[0] = left = registers[a]
+                compared[1] = b
+                if left != b:
+                    counter[0] += pc - counter[1] + 2
+                    counter[1] = c
+                    return c
+                return nextPc + 1
+
+        elif op == OP_CMPBGE:
+            def run():
+                compared[0] = left = registers[a]
+                compared[1] = b
+                if left >= b:
+                    counter[0] += pc - counter[1] + 2
+                    counter[1] = c
+                    return c
+                return nextPc + 1
+
+        elif op == OP_CMPBLT:
+            def run():
+                compared[0] = left = registers[a]
+                compared[1] = b
+                if left < b:
+                    counter[0] += pc - counter[1] + 2
+                    counter[1] = c
+                    return c
+                return nextPc + 1
+
+        # A conditional branch tests the two values of the last compare, and counts the instructions of its
+        # block when it is taken.
+        elif op == OP_BLE:
+            def run():
+                if compared[0] <= compared[1]:
+                    counter[0] += pc - counter[1] + 1
+                    counter[1] = a
+                    return a
+                return nextPc
+
+        elif op == OP_BGT:
+            def run():
+                if compared[0] > compared[1]:
+                    counter[0] += pc - counter[1] + 1
+                    counter[1] = a
+                    return a
+                return nextPc
+
+        elif op == OP_BEQ:
+            def run():
+                if compared[0] == compared[1]:
+                    counter[0] += pc - counter[1] + 1
+                    counter[1] = a
+                    return a
+                return nextPc
+
+        elif op == OP_BNE:
+            def run():
+                if compared[0] != compared[1]:
+                    counter[0] += pc - counter[1] + 1
+                    counter[1] = a
+                    return a
+                return nextPc
+
+        elif op == OP_BGE:
+            def run():
+                if compared[0] >= compared[1]:
+                    counter[0] += pc - counter[1] + 1
+                    counter[1] = a
+                    return a
+                return nextPc
+
+        else:
+            def run():
+                if compared[0] < compared[1]:
+                    counter[0] += pc - counter[1] + 1
+                    counter[1] = a
+                    return a
+                return nextPc
+
+        return run
+
+
+
+    # Compile the decoded program into a list of functions, one for each line.
+    def compileThreaded(self):
+        """
+        Compiles the decoded program into a list of functions indexed by line number for the threaded
+        interpreter. The functions share a list holding the instruction count and the line number of the
+        current block, which they update as they branch, along with the number of values printed, and a list
+        holding the two values of the last compare.
+
+        :return: A tuple of the counter list, the compare list and the list of functions.
+        """
+
+        # Decode the program if it has not been decoded already.
+        if self.decoded is None:
+            self.decoded = self.decode()
+
+        counter = [0, 0, 0]
+        compared = [0, -1]
+        threaded = [self.threadInstruction(pc, *decodedInstruction, counter, compared)
+                    for (pc, decodedInstruction) in enumerate(self.decoded)]
+
+        return counter, compared, threaded
+
+
+
+    # Interpret and run the program using the threaded interpreter.
+    def interpretThreaded(self):
+        """
+        Runs the program from the current program counter until it runs past its last line, by calling the
+        function compiled for each line. Each function returns the next line number, so there is no
+        instruction dispatch left in the loop.
+        """
+
+        # Compile the program again only if it, its registers, its output or its data memory have been replaced
+        # since the last run.
+        if self.decoded is None:
+            self.decoded = self.decode()
+        bound = (self.decoded, self.registers, self.output, self.memory)
+        if self.threadedCode is None or any(x is not y for (x, y) in zip(bound, self.threadedCode)):
+            self.threadedCode = bound + self.compileThreaded()
+
+        counter, compared, code = self.threadedCode[4:]
+        counter[0] = self.steps
+        counter[1] = pc = self.pc
+        counter[2] = self.printed
+        compared[0] = self.cmpLeft
+        compared[1] = self.cmpRight
+
+        # Run until the halt function returns line 0.
+        while pc:
+            pc = code[pc]()
+
+        self.pc = len(code) - 1
+        self.steps = counter[0]
+        self.printed = counter[2]
+        self.cmpLeft, self.cmpRight = compared
+
+
+
+    # Interpret and run the program using compiled basic blocks.
+    def interpretCompiled(self):
+        """
+        Runs the program from the current program counter until it runs past its last line, by compiling
+        each basic block of the program into a Python function. See the blubjit module.
+        """
+
+        # The compiler is only imported when it is used.
+        import blubjit
+
+        blubjit.run(self)
+
+
+
+    # Interpret and run the program while profiling it.
+    def interpretProfiled(self, aProfile=None):
+        """
+        Runs the program from the current program counter until it runs past its last line, counting and
+        timing every line it runs. See the blubprof module.
+
+        :param aProfile: The blubprof.Profile object to add to, or None to start a new one.
+        :return: The blubprof.Profile object.
+        """
+
+        # The profiler is only imported when it is used, and none of the other engines know about it.
+        import blubprof
+
+        return blubprof.run(self, aProfile)
+
+
+
+    # Interpret and run the program while recording a trace of it.
+    def interpretTraced(self, limit=None):
+        """
+        Runs the program from the current program counter until it runs past its last line, recording the line
+        run, the register written and the value written by every instruction in the trace variable. See the
+        blubtrace module.
+
+        :param limit: The number of instructions after which to stop, or None to run to the end, as for interpret.
+        """
+
+        # The tracer is only imported when it is used.
+        import blubtrace
+
+        blubtrace.run(self, self.trace, limit)
+
+
+
+# Run many Machine objects concurrently as asyncio tasks.
+def runConcurrently(machines, sliceSize=10000):
+    """
+    Runs the programs of many Machine objects in this thread, taking turns every sliceSize instructions so
+    that every program makes progress. See Machine.interpretAsync.
+
+    :param machines: The Machine objects to run.
+    :param sliceSize: The number of instructions each program runs before letting the others run.
+    """
+
+    async def runAll():
+        await asyncio.gather(*(aMachine.interpretAsync(sliceSize) for aMachine in machines))
+
+    asyncio.run(runAll())
+
+
+
+# Time each of the given engines on a program and report the number of instructions they run per second.
+def compareEngines(aProgram, engineNames, added=None, memory=None, fastForward=True, inputs=None):
+    """
+    Runs a Program object once with each of the given engines on a fresh Machine object, with the output of
+    the program captured rather than printed, and reports how fast each engine ran it.
+
+    :param aProgram: The Program object to run.
+    :param engineNames: The names of the engines to compare, as found in the engines dictionary.
+    :param added: A dictionary of the names and Operation objects of the instructions added to the machines,
+                  or None.
+    :param memory: The contents of the data memory the machines start with, or None for none. Each machine
+                   runs on a copy of it.
+    :param fastForward: Whether the machines fast-forward counting loops.
+    :param inputs: A dictionary of register numbers and the values they start with, or None, see Machine.reset.
+    :return: A list of (engine name, instructions run, seconds taken) tuples.
+    """
+
+    results = []
+
+    for engineName in engineNames:
+        interpreter = Machine(aProgram)
+        for (instrName, anOperation) in (added or {}).items():
+            interpreter[instrName] = anOperation
+        if memory is not None:
+            interpreter.memory = bytearray(memory)
+        interpreter.fastForward = fastForward
+
+        # Decode before starting the clock, since every engine shares the decoded form.
+        interpreter.decoded = interpreter.decode()
+        if inputs:
+            interpreter.reset(inputs)
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            startTime = time.perf_counter()
+            engines[engineName](interpreter)
+            elapsed = time.perf_counter() - startTime
+
+        results.append((engineName, interpreter.steps, elapsed))
+
+    return results
+
+
+
+# Parse a program with an InstructionStream and report how fast it was parsed.
+def measureParse(aProgramFile, useMmap=False):
+    """
+    Reads a program file one line at a time without keeping its instructions, and resolves the labels it
+    branches to.
+
+    :param aProgramFile: The name of the "blub" program file to parse.
+    :param useMmap: Whether to read the file through a memory-mapped buffer rather than a file object.
+    :return: A tuple of the number of lines parsed, the seconds taken, and the labels that are branched to
+             but never declared.
+    """
+
+    with open(aProgramFile, 'rb' if useMmap else 'r') as theFile:
+        theSource = mmap.mmap(theFile.fileno(), 0, access=mmap.ACCESS_READ) if useMmap else theFile
+
+        startTime = time.perf_counter()
+        theStream = blub.InstructionStream(theSource)
+        for anInstruction in theStream:
+            pass
+        undefined = [aLabel for (aLabel, lineNum) in theStream.resolveLabels().items() if lineNum is None]
+        elapsed = time.perf_counter() - startTime
+
+    return theStream.lineCount, elapsed, undefined
+
+
+
+# Initialize a dictionary of the engines that can run a Machine object, selectable from the command line.
+engines = {'decoded': Machine.interpret, 'threaded': Machine.interpretThreaded, 'jit': Machine.interpretCompiled}
 
 
 
 # The main program of blub.py
-if __name__ == '__main__':
-    # User will input the name of the program in the command line.
+def main():
+    """
+    Runs the program given on the command line, or does whatever else its options ask for.
+    """
+
+    # User will input the name of the program in the command line, along with the engine to run it with.
+    parser = argparse.ArgumentParser(description='Interpret a "blub" program.')
+    parser.add_argument('program', nargs='?',
+                        help='The "blub" program file to run, or with --batch a directory or manifest of them.')
+    parser.add_argument('--engine', choices=sorted(engines), default='decoded',
+                        help='The engine used to run the program (default: decoded).')
+    parser.add_argument('--compare', action='store_true',
+                        help='Time every engine on the program and report the instructions run per second.')
+    parser.add_argument('--parse-only', action='store_true',
+                        help='Only parse the program one line at a time, and report the lines parsed per second.')
+    parser.add_argument('--mmap', action='store_true',
+                        help='Read the program file through a memory-mapped buffer.')
+    parser.add_argument('--columnar', action='store_true',
+                        help='Store the program in compact columns of numbers rather than Instruction objects.')
+    parser.add_argument('--assemble', metavar='IMAGE',
+                        help='Assemble the program into a binary image instead of running it. Images are run '
+                             'and disassembled by giving them in place of the program file.')
+    parser.add_argument('--cache', action='store_true',
+                        help='Load the program through the on-disk cache of parsed and decoded programs.')
+    parser.add_argument('--optimize', action='store_true',
+                        help='Run the peephole optimizer over the program before running it.')
+    parser.add_argument('--set', action='append', default=[], metavar='REG=VALUE',
+                        help='Start the program with a value in a register, such as r0=1234, in place of the value '
+                             'it moves into it when it starts. May be given more than once.')
+    parser.add_argument('--inputs', metavar='FILE',
+                        help='Run the program once for every row of a CSV or binary file of register values, and '
+                             'report the runs per second.')
+    parser.add_argument('--memoize', action='store_true',
+                        help='Replay the output and final registers of runs from the same starting registers from a '
+                             'cache rather than running the program again.')
+    parser.add_argument('--memo-dir', metavar='DIR',
+                        help='Keep the results cached by --memoize on disk in DIR as well, so that they are shared '
+                             'between runs.')
+    parser.add_argument('--memory', metavar='FILE',
+                        help='Map FILE into memory as the data memory read and written by the ldr, str, ldrb and '
+                             'strb instructions. Stores are written to the file.')
+    parser.add_argument('--memory-size', type=int, default=None, metavar='N',
+                        help='The number of bytes of the data memory, extending the file with zeros if it is '
+                             'smaller (default: the size of the file).')
+    parser.add_argument('--extend', action='append', default=[], metavar='MODULE',
+                        help='Add the instructions declared in the instructions dictionary of a Python module, '
+                             'such as blubisa for mul, sub, lsl and xor. May be given more than once.')
+    parser.add_argument('--no-fast-forward', action='store_true',
+                        help='Run counting loops one step at a time rather than all at once.')
+    parser.add_argument('--buffer', type=int, metavar='N', default=0,
+                        help='Write the printed values in batches of N rather than one at a time.')
+    parser.add_argument('--max-steps', type=int, default=None,
+                        help='Stop the program, or each program of --batch, once it has run this many '
+                             'instructions.')
+    parser.add_argument('--timeout', type=float, default=None,
+                        help='Stop the program, or each program of --batch, once it has run for this many '
+                             'seconds. Batches run by the decoded interpreter stop each program after a default '
+                             'timeout otherwise.')
+    parser.add_argument('--max-output', type=int, default=None,
+                        help='Stop the program once it has printed this many values.')
+    parser.add_argument('--verify', action='store_true',
+                        help='Only check the program for errors, and report every error found.')
+    parser.add_argument('--checkpoint', metavar='FILE',
+                        help='Save a checkpoint of the run to FILE as it goes, and carry on from the checkpoint '
+                             'in FILE if there is one.')
+    parser.add_argument('--checkpoint-interval', type=int, default=1000000, metavar='N',
+                        help='The number of instructions run between checkpoints (default: 1000000).')
+    parser.add_argument('--trace', metavar='FILE',
+                        help='Record the line, the register written and the value written of every instruction '
+                             'run to a trace file. Only runs with --engine decoded can be traced.')
+    parser.add_argument('--trace-size', type=int, default=None, metavar='N',
+                        help='Keep only the last N records of --trace in memory, written when the run ends or '
+                             'fails, rather than all of them.')
+    parser.add_argument('--trace-branches', action='store_true',
+                        help='Record only the instructions that jumped, such as taken branches, with --trace.')
+    parser.add_argument('--replay', metavar='TRACE',
+                        help='Walk through a trace file against the line numbers of the program rather than '
+                             'running it.')
+    parser.add_argument('--profile', action='store_true',
+                        help='Count and time every line while running the program, and report the hot spots.')
+    parser.add_argument('--bench', action='store_true',
+                        help='Time parsing, decoding and running a corpus of generated programs with every engine.')
+    parser.add_argument('--bench-output', metavar='FILE',
+                        help='The file to write the benchmark results to as JSON (default: standard output).')
+    parser.add_argument('--bench-scale', type=float, default=1.0,
+                        help='How much larger or smaller than their default size to make the benchmark programs.')
+    parser.add_argument('--bench-repeats', type=int, default=3,
+                        help='The number of times each benchmark step is timed, keeping the best (default: 3).')
+    parser.add_argument('--batch', action='store_true',
+                        help='Run every program of a directory or manifest across a pool of worker processes, '
+                             'and write the output, timing and status of each as a line of JSON.')
+    parser.add_argument('--jobs', type=int, default=None,
+                        help='The number of worker processes used by --batch (default: one per CPU).')
+    args = parser.parse_args()
+
+    # Runs stopped by a budget or saved in checkpoints are run a slice at a time, which only the decoded
+    # interpreter can do.
+    if args.engine != 'decoded' and (args.max_steps is not None or args.timeout is not None
+                                     or args.max_output is not None or args.checkpoint):
+        parser.error('--max-steps, --timeout, --max-output and --checkpoint only run with --engine decoded')
+
+    # Traced runs record every instruction with a loop of their own, which only runs the decoded form.
+    if args.engine != 'decoded' and args.trace:
+        parser.error('--trace only runs with --engine decoded')
+
+    # Images only hold the instructions every Machine object starts with.
+    if args.assemble and args.extend:
+        parser.error('--assemble cannot be given with --extend, as images only hold the base instructions')
+
+    # Run the benchmark suite and write its results as JSON.
+    if args.bench:
+        import blubbench
+        blubbench.writeResults(blubbench.runBenchmarks(scale=args.bench_scale, repeats=args.bench_repeats),
+                               args.bench_output)
+        sys.exit()
+
+    if args.program is None:
+        parser.error('the program file is required unless --bench is given')
+
+    # Run a batch of programs, exiting with an error status if any of them failed or was stopped by its budget.
+    if args.batch:
+        import blubbatch
+        sys.exit(1 if blubbatch.main(args.program, args.engine, args.jobs, maxSteps=args.max_steps,
+                                     timeout=args.timeout) else 0)
+
+    # Parse the program without keeping it, and report the parse throughput and the peak memory used.
+    if args.parse_only:
+        lineCount, elapsed, undefined = measureParse(args.program, args.mmap)
+        print("%d lines in %.4f s  %.0f lines/s" % (lineCount, elapsed, lineCount / elapsed))
+        if resource is not None:
+            print("Peak memory: %d KB" % resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+        for aLabel in undefined:
+            print("Undefined label: " + aLabel)
+        sys.exit()
+
     # Capture the name and create a Program object, then print its contents.
-    prog = blub.Program(sys.argv[1])
+    import blubasm
+    programClass = blub.ColumnarProgram if args.columnar else blub.Program
+    decoded = None
+    if blubasm.isImage(args.program):
+        prog = blubasm.ImageProgram(args.program)
+        decoded = prog.decode()
+    elif args.cache:
+        import blubcache
+        prog, decoded = blubcache.ProgramCache().load(args.program)
+    elif args.mmap:
+        with open(args.program, 'rb') as programFile:
+            prog = programClass(mmap.mmap(programFile.fileno(), 0, access=mmap.ACCESS_READ))
+    else:
+        prog = programClass(args.program)
+
+    # Optimize the program if asked to, and report what the optimizer did.
+    if args.optimize:
+        import blubopt
+        prog, report = blubopt.optimize(prog)
+        decoded = None
+        print("Optimizer removed %d and rewrote %d instructions: %s"
+              % (report['removed'], report['rewritten'],
+                 ", ".join("%d %s" % (report[x], x) for x in sorted(report) if not (x in ('removed', 'rewritten')))),
+              file=sys.stderr)
+
+    # Walk through a recorded trace of the program rather than running it.
+    if args.replay:
+        import blubtrace
+        try:
+            aTrace = blubtrace.readTrace(args.replay)
+            for aLine in blubtrace.replay(prog, aTrace):
+                print(aLine)
+        except (OSError, ValueError) as anError:
+            print("Error: " + str(anError), file=sys.stderr)
+            sys.exit(1)
+        print("%d records from record %d%s" % (len(aTrace), aTrace.first, ", jumps only" if aTrace.branchesOnly
+                                                else ""), file=sys.stderr)
+        sys.exit()
 
     #Prints the program with line numbers starting from 1.
-    print(prog)
+    if not args.assemble:
+        print(prog)
 
-    #Run the program
+    # Check the whole program before running any of it, and report every error found.
     interpreter = Machine(prog)
+    interpreter.decoded = decoded
+    interpreter.fastForward = not args.no_fast_forward
+
+    # Add the instructions of the modules given on the command line. A program that uses them is decoded by the
+    # machine that has them.
+    if args.extend:
+        import importlib
+        decoded = None
+        try:
+            for moduleName in args.extend:
+                for (instrName, anOperation) in importlib.import_module(moduleName).instructions.items():
+                    interpreter[instrName] = anOperation
+        except (ImportError, AttributeError, ValueError, TypeError) as anError:
+            print("Error: " + str(anError), file=sys.stderr)
+            sys.exit(1)
+    if args.memory:
+        try:
+            interpreter.memory = mapMemory(args.memory, args.memory_size)
+        except (OSError, ValueError) as anError:
+            print("Error: " + str(anError), file=sys.stderr)
+            sys.exit(1)
+    diagnostics = interpreter.verify() if decoded is None else []
+    for aDiagnostic in diagnostics:
+        print("Error: " + str(aDiagnostic), file=sys.stderr)
+    if diagnostics:
+        sys.exit(1)
+    if args.verify:
+        print("No errors found.")
+        sys.exit()
+
+    # Assemble the program into an image rather than running it.
+    if args.assemble:
+        blubasm.assemble(prog, args.assemble)
+        sys.exit()
+
+    # Work out the values the registers given on the command line start with.
+    import blubinput
+    try:
+        inputs = dict(blubinput.assignmentOf(anAssignment) for anAssignment in args.set)
+    except ValueError as anError:
+        parser.error(str(anError))
+
+    # Cache the results of runs if asked to.
+    memo = None
+    if args.memoize or args.memo_dir:
+        import blubmemo
+        memo = blubmemo.ResultCache(cacheDir=args.memo_dir)
+
+    # Run the program once for every row of an input file.
+    if args.inputs:
+        print("Result:")
+        try:
+            blubinput.main(interpreter, args.inputs, args.engine, inputs, memo=memo)
+        except (OSError, ValueError, OverflowError) as anError:
+            print("Error: " + str(anError), file=sys.stderr)
+            sys.exit(1)
+        if memo is not None:
+            print("Result cache: %d hits, %d misses" % (memo.hits, memo.misses), file=sys.stderr)
+        sys.exit()
+
+    if inputs:
+        try:
+            interpreter.reset(inputs)
+        except OverflowError:
+            parser.error('a value given with --set does not fit in a register')
+
+    # Record a trace of the run if asked to.
+    aTrace = None
+    if args.trace:
+        import blubtrace
+        try:
+            aTrace = blubtrace.Trace(args.trace_size or blubtrace.defaultSize,
+                                     None if args.trace_size else args.trace, args.trace_branches)
+        except (OSError, ValueError) as anError:
+            print("Error: " + str(anError), file=sys.stderr)
+            sys.exit(1)
+        interpreter.trace = aTrace
+
+    # Keep the data memory the program starts with, so that the engines are compared on the same data.
+    startMemory = bytes(interpreter.memory) if args.compare and interpreter.memory is not None else None
+
+    #Run the program
+    budgeted = args.max_steps is not None or args.timeout is not None or args.max_output is not None
     print("Result:")
-    interpreter.interpret()
+
+    # A program that goes wrong while it runs, such as by overflowing a register or reading past the end of its
+    # memory, is reported rather than ending in a traceback.
+    try:
+        with (BufferedOutput(flushSize=args.buffer) if args.buffer > 0 else contextlib.nullcontext()) as output:
+            if output is not None:
+                interpreter.output = output
+            if args.profile:
+                report = interpreter.interpretProfiled().report()
+            elif budgeted:
+                result = interpreter.interpretWithBudget(args.max_steps, args.timeout, args.max_output)
+            elif args.checkpoint:
+                try:
+                    if interpreter.interpretWithCheckpoints(args.checkpoint, args.checkpoint_interval):
+                        print("Carried on from the checkpoint in " + args.checkpoint, file=sys.stderr)
+                except CheckpointError as anError:
+                    print("Error: " + str(anError), file=sys.stderr)
+                    sys.exit(1)
+            elif memo is not None:
+                memo.run(interpreter, engines[args.engine])
+            else:
+                engines[args.engine](interpreter)
+    except (BlubError, OverflowError) as anError:
+        print("Error: " + str(anError), file=sys.stderr)
+        sys.exit(1)
+    finally:
+        # Keep what was recorded, even of a run that failed.
+        if aTrace is not None:
+            if args.trace_size:
+                aTrace.save(args.trace)
+            else:
+                aTrace.close()
+    if args.profile:
+        print(report, file=sys.stderr)
+    if memo is not None and not (args.profile or budgeted or args.checkpoint):
+        print("Result cache: %d hits, %d misses" % (memo.hits, memo.misses), file=sys.stderr)
+
+    # Report a run that was stopped by one of its budgets, along with where it stopped.
+    if budgeted and not args.profile:
+        if result.status != 'done':
+            print("Stopped by the %s budget at line %d after %d instructions and %d values printed"
+                  % (result.status, result.pc, result.steps, result.printed), file=sys.stderr)
+            print("Registers: " + " ".join("r%d=%d" % (reg, value) for (reg, value) in enumerate(result.registers)
+                                           if value), file=sys.stderr)
+            sys.exit(2)
+
+    # Report how fast each engine runs the program, relative to the decoded interpreter.
+    if args.compare:
+        results = compareEngines(prog, sorted(engines), interpreter.added, startMemory, interpreter.fastForward,
+                                 inputs)
+        rates = {name: steps / elapsed if elapsed else 0.0 for (name, steps, elapsed) in results}
+        for (name, steps, elapsed) in results:
+            relative = "%.2fx" % (rates[name] / rates['decoded']) if rates['decoded'] else "n/a"
+            print("%-10s %12d instructions in %8.4f s  %14.0f instructions/s  (%s)"
+                  % (name, steps, elapsed, rates[name], relative), file=sys.stderr)
+
+
+
+# Run the main program of the blubvm module that the other modules import, rather than of the __main__ module
+# Python runs this file as, so that the classes and errors they share with it are the same objects.
+if __name__ == '__main__':
+    import blubvm
+    blubvm.main()
@@ -0,0 +1,80 @@
+# Test the compiled engine of the blubjit module against the decoded interpreter.
+
+# Assumptions made prior to code writing:
+#   Every engine raises an OverflowError for a value that does not fit in a register before the value is
+#   printed or stored, so the engines are compared on what they printed and stored when they raised it.
+
+# To run the tests, we require the unittest, io, os and tempfile modules.
+import unittest
+import io
+import os
+import tempfile
+
+# To parse and run the programs, import the blub and blubvm modules.
+import blub
+import blubvm
+
+
+# Run a program with an engine until it raises an OverflowError.
+def runUntilOverflow(test, source, engineName, memory=None):
+    """
+    Runs a program with an engine, checking that it raises an OverflowError.
+
+    :param test: The TestCase object running the program.
+    :param source: The program as a string.
+    :param engineName: The name of the engine, as found in blubvm.engines.
+    :param memory: The data memory of the machine, or None for none.
+    :return: A list of the values printed before the error.
+    """
+
+    theMachine = blubvm.Machine(blub.Program(io.StringIO(source)))
+    printed = []
+    theMachine.output = printed.append
+    theMachine.memory = memory
+
+    with test.assertRaises(OverflowError):
+        blubvm.engines[engineName](theMachine)
+
+    return printed
+
+
+
+# Write the OverflowTest class to check that compiled blocks raise before their values are seen.
+class OverflowTest(unittest.TestCase):
+
+    # Keep the compiled source of the tests apart from the source cached by other runs.
+    def setUp(self):
+        self.cacheDir = tempfile.TemporaryDirectory()
+        self.oldCacheDir = os.environ.get('BLUB_CACHE_DIR')
+        os.environ['BLUB_CACHE_DIR'] = self.cacheDir.name
+
+
+    def tearDown(self):
+        if self.oldCacheDir is None:
+            del os.environ['BLUB_CACHE_DIR']
+        else:
+            os.environ['BLUB_CACHE_DIR'] = self.oldCacheDir
+        self.cacheDir.cleanup()
+
+
+    # A value that does not fit is not printed.
+    def testNothingPrinted(self):
+        source = "movi r1, 2147483647\nadd r2, r1, r1\nprnt r2\n"
+        for engineName in sorted(blubvm.engines):
+            with self.subTest(engine=engineName):
+                self.assertEqual(runUntilOverflow(self, source, engineName), [])
+
+
+    # A value that does not fit is not stored in the data memory.
+    def testNothingStored(self):
+        source = "movi r1, 2147483647\nmovi r5, 0\nadd r2, r1, r1\nstr r2, r5\nprnt r1\n"
+        for engineName in sorted(blubvm.engines):
+            with self.subTest(engine=engineName):
+                memory = bytearray(16)
+                self.assertEqual(runUntilOverflow(self, source, engineName, memory), [])
+                self.assertEqual(memory, bytearray(16))
+
+
+
+if __name__ == '__main__':
+    unittest.main()